@@ -6,6 +6,7 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.action_chains import ActionChains
+from selenium.common.exceptions import TimeoutException
 import time
 import os
 import pandas as pd
@@ -13,16 +14,2712 @@ import PyPDF2
 import pdfplumber
 import re
 from datetime import datetime
+from contextlib import contextmanager, ExitStack
 import json
 import sqlite3
 import pathlib
+import threading
+import queue
+from collections import deque, OrderedDict
+import uuid
+import itertools
+import base64
+import hashlib
+import mimetypes
+import difflib
 from packaging import version # <-- IMPORT THIS
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; images are then attached as they are
+    Image = ImageOps = None
+
+
+class PageReadiness:
+    """
+    Waits on concrete WhatsApp Web DOM conditions instead of fixed sleeps.
+    Timeouts adapt to the latencies observed for each condition in this session.
+    """
+
+    # DOM probes run as scripts so they are not slowed down by the driver's implicit wait
+    LOGGED_IN_JS = "return !!document.querySelector('div[contenteditable=\"true\"][data-tab=\"3\"]');"
+    CHAT_LIST_JS = "return !!document.querySelector('#pane-side');"
+    CHAT_STATE_JS = """
+        var box = document.querySelector('footer div[contenteditable="true"]') ||
+                  document.querySelector('div[contenteditable="true"][data-tab="10"]');
+        if (box) return 'ready';
+        var popups = document.querySelectorAll('[role="dialog"], div[data-animate-modal-popup="true"]');
+        for (var i = 0; i < popups.length; i++) {
+            var text = popups[i].innerText || '';
+            if (text.indexOf('Phone number shared via url is invalid') !== -1 ||
+                text.indexOf('Telefonnummer') !== -1 ||
+                text.indexOf('not exist') !== -1 ||
+                text.indexOf("doesn't have WhatsApp") !== -1) {
+                return 'invalid';
+            }
+        }
+        return null;
+    """
+    COMPOSE_BOX_JS = """
+        var box = document.querySelector('footer div[contenteditable="true"]') ||
+                  document.querySelector('div[contenteditable="true"][data-tab="10"]');
+        return !!(box && box.offsetParent !== null);
+    """
+    MEDIA_PREVIEW_JS = """
+        return !!(document.querySelector('[data-testid="media-viewer"]') ||
+                  document.querySelector('[data-testid="send-container"]') ||
+                  document.querySelector('div[data-testid="send"]') ||
+                  document.querySelector('div[data-testid="media-caption-input"]') ||
+                  document.querySelector('div[aria-placeholder="Add a caption..."]'));
+    """
+    FILE_INPUT_JS = "return !!document.querySelector('input[type=\"file\"]');"
+    OUTGOING_COUNT_JS = "return document.querySelectorAll('#main div.message-out').length;"
+    LAST_OUTGOING_JS = """
+        var out = document.querySelectorAll('#main div.message-out');
+        if (!out.length) return null;
+        var last = out[out.length - 1];
+        return [last.innerText || '', !!last.querySelector('img, video')];
+    """
+    NEW_OUTGOING_JS = "return document.querySelectorAll('#main div.message-out').length > arguments[0];"
+    OUTGOING_STATUS_JS = """
+        var out = document.querySelectorAll('#main div.message-out');
+        if (out.length <= arguments[0]) return null;
+        var last = out[out.length - 1];
+        if (last.querySelector('span[data-icon="msg-time"]')) return null;
+        if (last.querySelector('span[data-icon^="msg-dblcheck"]')) return 'delivered';
+        return 'sent';
+    """
+
+    def __init__(self, default_timeout=20, min_timeout=3, max_timeout=45, history_size=50, poll_frequency=0.1):
+        self.default_timeout = default_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.history_size = history_size
+        self.poll_frequency = poll_frequency
+        self.latencies = {}
+        self.misses = {}  # name -> consecutive adaptive timeouts
+        self._lock = threading.Lock()
+
+    def timeout_for(self, name):
+        """
+        Twice the recent 90th percentile latency, clamped; the default until enough samples exist.
+        Doubled for every consecutive timeout, so a page that got slower widens it again.
+        """
+        with self._lock:
+            samples = sorted(self.latencies.get(name, ()))
+            misses = self.misses.get(name, 0)
+        if len(samples) < 5:
+            base = self.default_timeout
+        else:
+            base = samples[int(len(samples) * 0.9) - 1] * 2
+        return min(self.max_timeout, max(self.min_timeout, base * 2 ** misses))
+
+    def _record(self, name, elapsed, timed_out=False):
+        with self._lock:
+            # A timeout counts as a sample at the timeout value: the real latency was at least that
+            self.latencies.setdefault(name, deque(maxlen=self.history_size)).append(elapsed)
+            self.misses[name] = min(self.misses.get(name, 0) + 1, 4) if timed_out else 0
+
+    def wait_for(self, driver, name, script, *args, timeout=None):
+        """Poll a JS condition until it returns a truthy value; returns that value or None on timeout."""
+        adaptive = timeout is None
+        timeout = timeout or self.timeout_for(name)
+        start = time.time()
+        try:
+            result = WebDriverWait(driver, timeout, poll_frequency=self.poll_frequency).until(
+                lambda d: d.execute_script(script, *args)
+            )
+        except TimeoutException:
+            print(f"Readiness '{name}' not reached within {timeout:.1f}s")
+            # Fixed timeouts (e.g. a search expected to miss) say nothing about page speed
+            if adaptive:
+                self._record(name, timeout, timed_out=True)
+            return None
+        self._record(name, time.time() - start)
+        return result
+
+    def wait_for_login(self, driver, max_wait_time=120):
+        # Login depends on the user scanning a QR code, so it is never adaptive
+        try:
+            WebDriverWait(driver, max_wait_time, poll_frequency=0.5).until(
+                lambda d: d.execute_script(self.LOGGED_IN_JS)
+            )
+        except TimeoutException:
+            return False
+        self.wait_for(driver, "chat_list", self.CHAT_LIST_JS)
+        return True
+
+    def wait_for_chat(self, driver):
+        """Wait until a chat opened by URL is usable. Returns 'ready', 'invalid' or None."""
+        return self.wait_for(driver, "chat", self.CHAT_STATE_JS)
+
+    def wait_for_compose_box(self, driver):
+        return bool(self.wait_for(driver, "compose_box", self.COMPOSE_BOX_JS))
+
+    def wait_for_file_input(self, driver):
+        return bool(self.wait_for(driver, "file_input", self.FILE_INPUT_JS))
+
+    def wait_for_media_preview(self, driver):
+        return bool(self.wait_for(driver, "media_preview", self.MEDIA_PREVIEW_JS))
+
+    def last_outgoing_matches(self, driver, text):
+        """
+        True when the open chat's last outgoing bubble already holds `text` (compared without
+        whitespace differences); without text, when that bubble is an attachment.
+        """
+        try:
+            bubble = driver.execute_script(self.LAST_OUTGOING_JS)
+        except Exception:
+            return False
+        if not bubble:
+            return False
+        shown, has_media = bubble
+        wanted = " ".join(str(text or "").split())
+        if not wanted:
+            return bool(has_media)
+        return wanted[:200] in " ".join((shown or "").split())
+
+    def outgoing_count(self, driver):
+        try:
+            return driver.execute_script(self.OUTGOING_COUNT_JS) or 0
+        except Exception:
+            return 0
+
+    def wait_for_outgoing(self, driver, previous_count):
+        """Wait only until the new outgoing bubble shows up; its delivery is followed by DeliveryTracker."""
+        return bool(self.wait_for(driver, "outgoing_bubble", self.NEW_OUTGOING_JS, previous_count))
+
+    def wait_for_message_tick(self, driver, previous_count):
+        """Wait until a new outgoing bubble has left the pending (clock) state. Returns 'sent', 'delivered' or None."""
+        return self.wait_for(driver, "message_tick", self.OUTGOING_STATUS_JS, previous_count)
+
+
+class ChatNavigator:
+    """
+    Opens chats inside the already-loaded WhatsApp Web app through the sidebar search,
+    falling back to a full /send?phone= page load when the in-page switch fails. Numbers
+    without a known chat go straight to the page load: the search cannot find them, and
+    waiting for it to say so would cost more than it saves.
+    """
+
+    SEARCH_BOX_XPATH = '//div[@contenteditable="true"][@data-tab="3"]'
+    # Returns the single search result whose title ends in the number's last 10 digits.
+    # Display names are never trusted: until the list re-renders for the typed query it still
+    # shows unrelated chats, and two contacts can share a name. Once the results for the query
+    # are shown without exactly one match (or WhatsApp says nothing was found) it returns
+    # 'none', so the caller falls back to a full reload without waiting out the timeout.
+    SEARCH_MATCH_JS = """
+        var tail = arguments[0].slice(-10);
+        var pane = document.querySelector('#pane-side');
+        if (!pane) return null;
+        var titles = pane.querySelectorAll('span[title]');
+        var matches = [];
+        for (var i = 0; i < titles.length; i++) {
+            var digits = (titles[i].getAttribute('title') || '').replace(/\\D/g, '');
+            if (digits.length >= 10 && digits.slice(-10) === tail) {
+                matches.push(titles[i]);
+            }
+        }
+        if (matches.length === 1) return [matches[0], matches[0].getAttribute('title')];
+        var text = (pane.innerText || '').slice(0, 300);
+        if (text.indexOf('No chats, contacts or messages found') !== -1 || text.indexOf('No results') !== -1) return 'none';
+        if (pane.querySelector('[aria-label^="Search results"]')) return 'none';
+        return null;
+    """
+    CHAT_HEADER_JS = """
+        var header = document.querySelector('#main header span[title]');
+        var box = document.querySelector('footer div[contenteditable="true"]');
+        return !!(header && box && header.getAttribute('title') === arguments[0]);
+    """
+
+    def __init__(self, readiness, search_timeout=2.5):
+        self.readiness = readiness
+        self.search_timeout = search_timeout
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Start a new per-run tally of in-page switches vs. full reloads."""
+        self.stats = {"in_page": 0, "full_reloads": 0}
+
+    def _open_in_page(self, driver, mobile):
+        try:
+            if not driver.execute_script(PageReadiness.LOGGED_IN_JS):
+                return False
+            search_box = driver.find_element(By.XPATH, self.SEARCH_BOX_XPATH)
+            search_box.click()
+            search_box.send_keys(Keys.CONTROL + "a", Keys.DELETE)
+            search_box.send_keys(PhoneNormalizer.digits(mobile))
+
+            match = self.readiness.wait_for(driver, "search_result", self.SEARCH_MATCH_JS, mobile,
+                                            timeout=self.search_timeout)
+            if not match or match == 'none':
+                search_box.send_keys(Keys.CONTROL + "a", Keys.DELETE)
+                return False
+
+            element, title = match
+            element.click()
+            return bool(self.readiness.wait_for(driver, "chat_switch", self.CHAT_HEADER_JS, title))
+        except Exception as e:
+            print(f"In-page chat switch failed for {mobile}: {e}")
+            return False
+
+    def open_chat(self, driver, mobile, name=None, known_chat=True):
+        """
+        Open the chat for `mobile`. Returns 'ready', 'invalid' or None if the chat never loaded.
+        `name` is only used in log output; a chat is never picked by its display name. Without
+        `known_chat` the sidebar search is skipped.
+        """
+        if known_chat and self._open_in_page(driver, mobile):
+            self.stats["in_page"] += 1
+            return 'ready'
+
+        self.stats["full_reloads"] += 1
+        print(f"Opening chat for {name or mobile} by URL")
+        driver.get(f"https://web.whatsapp.com/send?phone={PhoneNormalizer.digits(mobile)}")
+        return self.readiness.wait_for_chat(driver)
+
+    def summary(self):
+        return f"{self.stats['in_page']} full page reloads avoided"
+
+
+class MessageComposer:
+    """
+    Puts a whole multi-line message into a WhatsApp compose/caption box in one paste event,
+    falling back to line-by-line typing only when the pasted text does not verify.
+    """
+
+    PASTE_JS = """
+        var box = arguments[0], text = arguments[1];
+        box.focus();
+        var data = new DataTransfer();
+        data.setData('text/plain', text);
+        box.dispatchEvent(new ClipboardEvent('paste', {clipboardData: data, bubbles: true, cancelable: true}));
+        return true;
+    """
+    # Whitespace is normalised because the editor renders line breaks as separate paragraphs
+    VERIFY_JS = """
+        var norm = function(t) { return (t || '').replace(/\\s+/g, ' ').trim(); };
+        return norm(arguments[0].innerText) === norm(arguments[1]);
+    """
+
+    def __init__(self, readiness, verify_timeout=2):
+        self.readiness = readiness
+        self.verify_timeout = verify_timeout
+        self.stats = {"pasted": 0, "typed": 0}
+
+    def _clear(self, message_box):
+        message_box.send_keys(Keys.CONTROL + "a", Keys.DELETE)
+
+    def _type_lines(self, message_box, text):
+        """The original typing path: one send_keys per line with Shift+Enter line breaks."""
+        message_lines = text.split('\n')
+        for j, line in enumerate(message_lines):
+            if line.strip():
+                message_box.send_keys(line)
+            if j < len(message_lines) - 1:
+                message_box.send_keys(Keys.SHIFT + Keys.ENTER)
+
+    def compose(self, driver, message_box, text):
+        """Replace the box contents with `text`. Returns 'pasted' or 'typed'."""
+        message_box.click()
+        self._clear(message_box)
+        try:
+            driver.execute_script(self.PASTE_JS, message_box, text)
+            if self.readiness.wait_for(driver, "compose_text", self.VERIFY_JS, message_box, text,
+                                       timeout=self.verify_timeout):
+                self.stats["pasted"] += 1
+                return 'pasted'
+        except Exception as e:
+            print(f"Single-shot message insert failed: {e}")
+
+        print("Pasted text did not verify, typing the message line by line")
+        self._clear(message_box)
+        self._type_lines(message_box, text)
+        self.stats["typed"] += 1
+        return 'typed'
+
+
+class WorkStealingQueue:
+    """
+    Shards work items round-robin into one deque per worker. A worker that runs out of
+    its own items steals from the tail of the busiest other deque, so a slow or logged-out
+    session never strands its share of the list. With a `feed` iterator the deques are
+    topped up `refill_size` items at a time, so streamed lists never sit in memory whole.
+    Reading the feed (which may parse a file chunk) happens under its own lock, outside the
+    queue lock, so the other workers keep taking items meanwhile.
+    """
+
+    def __init__(self, items, worker_names, feed=None, refill_size=200):
+        self._lock = threading.Lock()
+        self._feed_lock = threading.Lock()  # always taken before _lock
+        self._names = list(worker_names)
+        self._queues = {name: deque() for name in worker_names}
+        self._distribute(items)
+        self._feed = feed
+        self.refill_size = refill_size
+        self.steals = 0
+
+    def _distribute(self, items):
+        for i, item in enumerate(items):
+            self._queues[self._names[i % len(self._names)]].append(item)
+
+    def _refill(self):
+        with self._feed_lock:
+            if self._feed is None:
+                return False
+            batch = []
+            for item in self._feed:
+                batch.append(item)
+                if len(batch) >= self.refill_size:
+                    break
+            with self._lock:
+                if not batch:
+                    self._feed = None
+                    return False
+                self._distribute(batch)
+            return True
+
+    def _take(self, worker_name):
+        own = self._queues[worker_name]
+        if own:
+            return own.popleft()
+        victim = max(self._queues.values(), key=len)
+        if victim:
+            self.steals += 1
+            return victim.pop()
+        return None
+
+    def next(self, worker_name):
+        """Return the worker's next item, a stolen item, or None when all work is taken."""
+        while True:
+            with self._lock:
+                item = self._take(worker_name)
+                if item is not None or self._feed is None:
+                    return item
+            if not self._refill():
+                with self._lock:
+                    return self._take(worker_name)
+
+    def remaining(self):
+        with self._lock:
+            return sum(len(q) for q in self._queues.values())
+
+    def drain(self):
+        """
+        Stop handing out work: discard the queued items nobody picked up and close the feed
+        without reading the rest of it. Returns how many queued items were discarded.
+        """
+        with self._feed_lock, self._lock:
+            count = sum(len(q) for q in self._queues.values())
+            for q in self._queues.values():
+                q.clear()
+            if self._feed is not None:
+                close = getattr(self._feed, "close", None)
+                if close:
+                    close()
+                self._feed = None
+            return count
+
+
+class SendPipeline:
+    """
+    Prepares upcoming sends on a worker thread while the browser thread is busy with the
+    current chat. `prepare` runs up to `depth` items ahead (reading a streamed sheet,
+    normalising numbers, rendering messages, cache lookups) and iterating yields
+    (item, prepared, error) in the original order. Only Python-side work belongs in
+    `prepare`; the WebDriver stays on the consuming thread.
+    """
+
+    _DONE = object()
+
+    def __init__(self, items, prepare, depth=16):
+        self._queue = queue.Queue(maxsize=depth)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(items, prepare), daemon=True)
+        self._thread.start()
+
+    def _put(self, value):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(value, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self, items, prepare):
+        try:
+            for item in items:
+                try:
+                    result = (item, prepare(item), None)
+                except Exception as e:
+                    result = (item, None, e)
+                if not self._put(result):
+                    return
+        except Exception as e:
+            # The source itself failed (e.g. the sheet could not be read further)
+            self._put((None, None, e))
+        finally:
+            self._put(self._DONE)
+
+    def __iter__(self):
+        while True:
+            result = self._queue.get()
+            if result is self._DONE:
+                return
+            yield result
+
+    def close(self):
+        """Stop preparing; call when the consumer leaves early (cancel or error)."""
+        self._stop.set()
+
+
+class MessageTemplate:
+    """
+    A message template parsed once into literal segments and field slots, so rendering a
+    recipient is a single join instead of one str.replace per column. Placeholders are
+    {Field}, optionally followed by filters: {Name|title}, {City|default:your city}.
+    A placeholder whose field is absent and has no default is left in the text as written.
+    """
+
+    PLACEHOLDER = re.compile(r'\{([^{}|]+)((?:\|[^{}|]*)*)\}')
+    FILTERS = {
+        "upper": str.upper,
+        "lower": str.lower,
+        "title": str.title,
+        "strip": str.strip,
+        "first": lambda value: value.split()[0] if value.split() else value,
+        "digits": lambda value: re.sub(r'\D', '', value),
+    }
+    _cache = {}
+    _CACHE_SIZE = 256
+
+    def __init__(self, text):
+        self.text = text or ""
+        self.segments = []  # literal strings and (field, filters, default, placeholder) slots
+        self.errors = []
+        pos = 0
+        for match in self.PLACEHOLDER.finditer(self.text):
+            if match.start() > pos:
+                self.segments.append(self.text[pos:match.start()])
+            filters, default = [], None
+            for spec in match.group(2).split('|')[1:]:
+                name, _, argument = spec.partition(':')
+                name = name.strip()
+                if name == 'default':
+                    default = argument
+                elif name in self.FILTERS:
+                    filters.append(self.FILTERS[name])
+                else:
+                    self.errors.append(f"Unknown filter '{name}' in {match.group(0)}")
+            self.segments.append((match.group(1).strip(), tuple(filters), default, match.group(0)))
+            pos = match.end()
+        if pos < len(self.text):
+            self.segments.append(self.text[pos:])
+        self.fields = list(dict.fromkeys(seg[0] for seg in self.segments if not isinstance(seg, str)))
+
+    @classmethod
+    def compile(cls, text):
+        """Return the compiled template for `text`, reusing earlier compilations."""
+        template = cls._cache.get(text)
+        if template is None:
+            if len(cls._cache) >= cls._CACHE_SIZE:
+                cls._cache.clear()
+            template = cls._cache[text] = cls(text)
+        return template
+
+    def missing(self, columns):
+        """Fields used without a default that the given columns cannot supply."""
+        columns = set(columns)
+        return list(dict.fromkeys(seg[0] for seg in self.segments
+                                  if not isinstance(seg, str) and seg[2] is None and seg[0] not in columns))
+
+    def render(self, values):
+        if not self.fields:
+            return self.text
+        parts = []
+        for seg in self.segments:
+            if isinstance(seg, str):
+                parts.append(seg)
+                continue
+            field, filters, default, placeholder = seg
+            value = values.get(field)
+            if value is None or value == '':
+                if default is not None:
+                    value = default
+                elif value is None:
+                    parts.append(placeholder)
+                    continue
+            value = str(value)
+            for apply_filter in filters:
+                value = apply_filter(value)
+            parts.append(value)
+        return ''.join(parts)
+
+    def render_all(self, rows, limit=None):
+        return [self.render(row) for row in (rows if limit is None else rows[:limit])]
+
+
+class CourierMessageRenderer:
+    """
+    Builds courier dispatch messages. Everything except the customer's name and location
+    depends only on the challan, so that part is rendered once per challan (keyed by
+    challan number and a hash of its content) and each customer only splices in their
+    own two lines. The company header and footer are compiled MessageTemplates that can
+    use the challan's fields, e.g. {challan_no} or {courier_name}.
+    """
+
+    DEFAULT_HEADER = "Greeting from *Accurate Medical Print Solutions*"
+    DEFAULT_FOOTER = "For any queries, contact us on 8108100404 or email us on logistics@accuratemedical.in"
+
+    def __init__(self, header=None, footer=None, cache_size=2048):
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0}
+        self.configure(header, footer)
+
+    def configure(self, header=None, footer=None):
+        self.header = MessageTemplate.compile(self.DEFAULT_HEADER if header is None else header)
+        self.footer = MessageTemplate.compile(self.DEFAULT_FOOTER if footer is None else footer)
+        with self._lock:
+            self._cache.clear()
+
+    @staticmethod
+    def _content_key(courier_data):
+        # The tuple itself is the key, so two challans only share a cache entry when their content is equal
+        return (
+            courier_data.get('challan_no'), courier_data.get('date'), courier_data.get('courier_name'),
+            courier_data.get('docket_no'), courier_data.get('no_of_boxes'), courier_data.get('courier_link'),
+            courier_data.get('shipment_type'), courier_data.get('customer_name'), courier_data.get('customer_location'),
+            tuple((item['name'], item['quantity'], item['unit']) for item in courier_data.get('items', ()))
+        )
+
+    def _challan_parts(self, courier_data):
+        """The text before and after the customer lines, for one challan."""
+        message_parts = []
+        
+        # Header
+        message_parts.append(self.header.render(courier_data))
+        message_parts.append("")
+        message_parts.append("*COURIER DISPATCH NOTIFICATION*")
+        message_parts.append("=" * 25)
+        
+        message_parts.append(f"*Challan No:* {courier_data['challan_no']}")
+        message_parts.append(f"*Date:* {courier_data['date']}")
+        prefix = "\n".join(message_parts)
+        
+        message_parts = [""]
+        
+        # Courier details
+        message_parts.append("*COURIER DETAILS*")
+        message_parts.append("-" * 20)
+        message_parts.append(f"*Courier:* {courier_data['courier_name']}")
+        message_parts.append(f"*Docket No:* `{courier_data['docket_no']}`")
+        message_parts.append(f"*No. of Boxes:* {courier_data['no_of_boxes']}")
+        message_parts.append(f"*Track at:* {courier_data['courier_link']}")
+        
+        message_parts.append("")
+        
+        # Items shipped (only non-zero quantities with bold quantities and units)
+        message_parts.append("*ITEMS SHIPPED*")
+        message_parts.append("-" * 15)
+        
+        item_count = 0
+        for item in courier_data['items']:
+            if item['quantity'] > 0:
+                item_count += 1
+                # Make both quantity and unit bold using WhatsApp formatting
+                unit_text = f" *{item['unit']}*" if item['unit'] else ""
+                message_parts.append(f"• {item['name']}: *{item['quantity']}*{unit_text}")
+        
+        if item_count == 0:
+            message_parts.append("• No items with specified quantities")
+        
+        message_parts.append("")
+        # Add shipment type AFTER the items list
+        shipment_type = courier_data.get('shipment_type', 'Complete')
+        message_parts.append(f"*Shipment Type:* {shipment_type}")
+        
+        message_parts.append("")
+        message_parts.append("*Your order has been dispatched successfully!*")
+        message_parts.append("")
+        message_parts.append(self.footer.render(courier_data))
+        return prefix, "\n".join(message_parts)
+
+    def render(self, courier_data, customer):
+        key = self._content_key(courier_data)
+        with self._lock:
+            parts = self._cache.get(key)
+            if parts is not None:
+                self._cache.move_to_end(key)
+                self.stats["hits"] += 1
+        if parts is None:
+            parts = self._challan_parts(courier_data)
+            with self._lock:
+                self.stats["misses"] += 1
+                self._cache[key] = parts
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        prefix, suffix = parts
+        return f"{prefix}\n*Customer:* {customer['name']}\n*Delivery Location:* {customer['address']}\n{suffix}"
+
+
+class CourierSheetSchema:
+    """
+    Maps a dispatch sheet's headers onto courier fields and product columns. Mappings
+    live in the courier_columns table. Every header is first matched on a normalised form,
+    so "Docket No." / "docket no" / "DocketNo" all land on docket_no; only headers left over
+    are then matched fuzzily, and only against fields. Product names differ by a single
+    size or code ("... A3" / "... A5"), so an unknown product header is reported as
+    unmatched for the user to map rather than guessed.
+    """
+
+    FIELDS = ('date', 'challan_no', 'customer_code', 'customer_name', 'customer_location', 'courier_name',
+              'docket_no', 'courier_link', 'no_of_boxes', 'shipment_type', 'mobile')
+    FUZZY_CUTOFF = 0.85
+
+    def __init__(self, columns):
+        # columns: [{"name", "kind" ('field' | 'item'), "aliases", "unit"}], in display order
+        self.columns = columns
+
+    @staticmethod
+    def normalize(header):
+        return re.sub(r'[^a-z0-9]', '', str(header).lower())
+
+    def match(self, headers):
+        """Return ({name: header}, [(item name, header, unit)], [unmatched headers])."""
+        by_key = {}
+        for column in self.columns:
+            for alias in [column["name"]] + column["aliases"]:
+                by_key.setdefault(self.normalize(alias), column)
+        assigned, taken = {}, set()
+        for header in headers:
+            column = by_key.get(self.normalize(header))
+            if column is not None and column["name"] not in taken:
+                assigned[header] = column
+                taken.add(column["name"])
+        for header in headers:
+            if header in assigned:
+                continue
+            open_fields = {key: column for key, column in by_key.items()
+                           if column["kind"] != 'item' and column["name"] not in taken}
+            close = difflib.get_close_matches(self.normalize(header), list(open_fields), n=1, cutoff=self.FUZZY_CUTOFF)
+            if close:
+                assigned[header] = open_fields[close[0]]
+                taken.add(open_fields[close[0]]["name"])
+        fields, items, unmatched = {}, [], []
+        for header in headers:
+            column = assigned.get(header)
+            if column is None:
+                unmatched.append(header)
+            elif column["kind"] == 'item':
+                items.append((column["name"], header, column["unit"]))
+            else:
+                fields[column["name"]] = header
+        return fields, items, unmatched
+
+
+class PhoneNormalizer:
+    """
+    Turns phone numbers into E.164 ("+919876543210"). National numbers get the default
+    country code, trunk prefixes ("0" / "0" + country code) and international "00" prefixes
+    are removed, and anything outside 10-15 digits is rejected as "". The '+' is kept so a
+    normalized number is never given the default country code a second time; digits() gives
+    the bare form wa.me, the send URL and the search boxes expect.
+    """
+
+    # National significant number lengths for the default-country rule; others fall back to 10
+    NATIONAL_LENGTHS = {'91': 10, '1': 10, '44': 10, '61': 9, '971': 9, '966': 9, '65': 8, '92': 10, '880': 10}
+    MIN_DIGITS, MAX_DIGITS = 10, 15
+    # Written in every accepted format; normalize() must map each result to itself
+    SELF_CHECK_SAMPLES = ('9876543210', '09876543210', '+65 9123 4567', '0065 9123 4567', '+1 (415) 555-0100',
+                          '+44 7911 123456', '971501234567', '12345')
+
+    def __init__(self, country_code='91'):
+        self.configure(country_code)
+
+    def configure(self, country_code):
+        self.country_code = re.sub(r'\D', '', str(country_code or '91')) or '91'
+        self.national_length = self.NATIONAL_LENGTHS.get(self.country_code, 10)
+
+    def normalize(self, number):
+        raw = str(number or '').strip()
+        digits = re.sub(r'\D', '', raw)
+        if raw.startswith('00'):
+            digits = digits[2:]
+        elif not raw.startswith('+'):
+            cc, n = self.country_code, self.national_length
+            if len(digits) == n:
+                digits = cc + digits
+            elif len(digits) == n + 1 and digits.startswith('0'):
+                digits = cc + digits[1:]
+            elif len(digits) == len(cc) + n + 1 and digits.startswith('0' + cc):
+                digits = digits[1:]
+        return '+' + digits if self.MIN_DIGITS <= len(digits) <= self.MAX_DIGITS else ''
+
+    @staticmethod
+    def digits(number):
+        return str(number or '').lstrip('+')
+
+    def self_check(self):
+        """Return the samples for which normalize(normalize(x)) != normalize(x); empty when sound."""
+        broken = []
+        for sample in self.SELF_CHECK_SAMPLES:
+            once = self.normalize(sample)
+            if self.normalize(once) != once:
+                broken.append(sample)
+        return broken
+
+    def normalize_series(self, series):
+        """Vectorized normalize() over a pandas Series of raw numbers."""
+        raw = series.fillna('').astype(str).str.strip()
+        digits = raw.str.replace(r'\D', '', regex=True)
+        international = raw.str.startswith('+')
+        double_zero = raw.str.startswith('00')
+        local = ~international & ~double_zero
+        cc, n = self.country_code, self.national_length
+        length = digits.str.len()
+        out = digits.where(~double_zero, digits.str[2:])
+        out = out.where(~(local & (length == n)), cc + digits)
+        out = out.where(~(local & (length == n + 1) & digits.str.startswith('0')), cc + digits.str[1:])
+        out = out.where(~(local & (length == len(cc) + n + 1) & digits.str.startswith('0' + cc)), digits.str[1:])
+        return ('+' + out).where(out.str.len().between(self.MIN_DIGITS, self.MAX_DIGITS), '')
+
+    @staticmethod
+    def duplicates(keys, row_numbers, limit=100):
+        """
+        Find repeated keys in a Series. Returns (mask of rows to keep, merged row count,
+        up to `limit` report entries of {"key", "rows"} listing every row that shared a key).
+        """
+        keep = ~keys.duplicated(keep='first')
+        repeated = keys.duplicated(keep=False)
+        report = []
+        if repeated.any():
+            groups = pd.Series(row_numbers, index=keys.index)[repeated].groupby(keys[repeated].to_numpy(), sort=False)
+            for key, rows in groups:
+                report.append({"key": key, "rows": [int(r) for r in rows]})
+                if len(report) >= limit:
+                    break
+        return keep, int((~keep).sum()), report
+
+
+class NumberStatusCache:
+    """
+    Remembers what WhatsApp said about each number (valid / invalid / unknown) in the
+    number_status table. Senders consult it before navigating, so a number already known
+    to be invalid costs nothing instead of a chat load. Entries expire per status.
+    """
+
+    TTL_DAYS = {"valid": 7, "invalid": 30, "unknown": 1}
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        self.saved_this_session = 0
+
+    def lookup(self, phone):
+        """Return the cached status of a number, or None if unknown or expired."""
+        row = self.db.query_one('''
+            SELECT status FROM number_status
+            WHERE phone = ? AND checked_at >= datetime('now', '-' || ttl_days || ' days')
+        ''', (phone,))
+        return row[0] if row else None
+
+    def is_invalid(self, phone):
+        return self.lookup(phone) == 'invalid'
+
+    def record(self, phone, status, source='send'):
+        self.db.execute('''
+            INSERT INTO number_status (phone, status, ttl_days, source, checked_at)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(phone) DO UPDATE SET status = excluded.status, ttl_days = excluded.ttl_days,
+                                             source = excluded.source, checked_at = excluded.checked_at
+        ''', (phone, status, self.TTL_DAYS[status], source))
+
+    def count_saved(self):
+        """A navigation skipped because the number was already known to be invalid."""
+        with self._lock:
+            self.saved_this_session += 1
+        self.db.execute('''
+            INSERT INTO app_settings (key, value) VALUES ('navigations_saved', '1')
+            ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1, updated_at = CURRENT_TIMESTAMP
+        ''')
+
+    def summary(self):
+        counts = dict(self.db.query('''
+            SELECT status, COUNT(*) FROM number_status
+            WHERE checked_at >= datetime('now', '-' || ttl_days || ' days') GROUP BY status
+        '''))
+        total = self.db.query_one("SELECT value FROM app_settings WHERE key = 'navigations_saved'")
+        return {
+            "valid": counts.get('valid', 0),
+            "invalid": counts.get('invalid', 0),
+            "unknown": counts.get('unknown', 0),
+            "saved_this_session": self.saved_this_session,
+            "saved_total": int(total[0]) if total else 0
+        }
+
+
+class SendPacer:
+    """
+    Token-bucket pacing for one WhatsApp account, shared by every sender. Each send takes a
+    token and tokens refill at the current rate. The rate starts at the configured
+    messages-per-minute, halves on signs of throttling (a failed send, a chat that loads far
+    slower than usual, a rate-limit banner) and climbs back after a run of clean sends.
+    """
+
+    MIN_RATE = 1.0  # messages per minute, also the lowest rate the settings accept
+    BURST = 3
+    BACKOFF_FACTOR = 0.5
+    RECOVER_FACTOR = 1.25
+    RECOVER_AFTER = 10  # clean sends before the rate is raised again
+    SLOW_FACTOR = 3.0  # a send this many times slower than the recent median counts as a slow load
+    # Failures that say nothing about throttling
+    BENIGN_FAILURES = ("invalid number", "invalid number (cached)", "nothing to send")
+    THROTTLE_JS = """
+        var nodes = document.querySelectorAll('[role="dialog"], [role="alert"], div[data-animate-modal-popup="true"]');
+        var phrases = ['too many', 'too quickly', 'try again later', 'temporarily', 'unusual activity'];
+        for (var i = 0; i < nodes.length; i++) {
+            var text = (nodes[i].innerText || '').toLowerCase();
+            for (var j = 0; j < phrases.length; j++) {
+                if (text.indexOf(phrases[j]) !== -1) return true;
+            }
+        }
+        return false;
+    """
+
+    def __init__(self, messages_per_minute=20, burst=BURST):
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._durations = deque(maxlen=20)
+        self._tokens = float(burst)
+        self._refilled_at = time.time()
+        self._clean_streak = 0
+        self.stats = {"sent": 0, "backoffs": 0, "waited": 0.0}
+        self.configure(messages_per_minute)
+
+    def configure(self, messages_per_minute):
+        with self._lock:
+            self.target = max(self.MIN_RATE, float(messages_per_minute or self.MIN_RATE))
+            self.rate = self.target
+
+    @contextmanager
+    def override(self, messages_per_minute):
+        """Use another target rate for the duration of one run, then go back to the saved one."""
+        if not messages_per_minute:
+            yield self
+            return
+        with self._lock:
+            saved = self.target
+            self.target = max(self.MIN_RATE, float(messages_per_minute))
+            self.rate = self.target
+            override = self.target
+        try:
+            yield self
+        finally:
+            with self._lock:
+                # A rate saved from the settings while the run was going wins over the old one
+                if self.target == override:
+                    self.target = saved
+                    self.rate = min(self.rate, saved)
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate / 60.0)
+        self._refilled_at = now
+
+    def acquire(self, tokens=1, job=None):
+        """
+        Block until `tokens` sends may go out; returns the seconds waited. Bigger requests
+        (a forward to several chats) leave the bucket in debt instead of waiting for a full
+        bucket. Returns early if the job is cancelled.
+        """
+        started = time.time()
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= min(tokens, self.burst):
+                    self._tokens -= tokens
+                    waited = time.time() - started
+                    self.stats["waited"] += waited
+                    return waited
+                delay = (min(tokens, self.burst) - self._tokens) * 60.0 / self.rate
+            if job and job.cancelled:
+                return time.time() - started
+            # Short naps so a backoff, a rate change or a cancel takes effect promptly
+            time.sleep(min(delay, 0.5))
+
+    def report(self, driver, sent, reason=None, duration=None):
+        """Feed one send's outcome back; slows down or recovers the rate."""
+        try:
+            banner = bool(driver and driver.execute_script(self.THROTTLE_JS))
+        except Exception:
+            banner = False
+        with self._lock:
+            median = sorted(self._durations)[len(self._durations) // 2] if len(self._durations) >= 5 else None
+            slow = bool(duration and median and duration > median * self.SLOW_FACTOR)
+            failed = not sent and reason not in self.BENIGN_FAILURES
+            if sent and duration:
+                self._durations.append(duration)
+            if sent:
+                self.stats["sent"] += 1
+
+            if banner or failed or slow:
+                self.rate = max(self.MIN_RATE, self.rate * self.BACKOFF_FACTOR)
+                self._tokens = min(self._tokens, 0.0)
+                self._clean_streak = 0
+                self.stats["backoffs"] += 1
+                cause = "rate-limit banner" if banner else "failed send" if failed else "slow load"
+                print(f"Pacing: {cause}, slowing down to {self.rate:.1f} messages/min")
+            elif sent:
+                self._clean_streak += 1
+                if self._clean_streak >= self.RECOVER_AFTER and self.rate < self.target:
+                    self.rate = min(self.target, self.rate * self.RECOVER_FACTOR)
+                    self._clean_streak = 0
+                    print(f"Pacing: speeding back up to {self.rate:.1f} messages/min")
+
+    def summary(self):
+        with self._lock:
+            return {"target": self.target, "rate": round(self.rate, 1), "sent": self.stats["sent"],
+                    "backoffs": self.stats["backoffs"], "waited": round(self.stats["waited"], 1)}
+
+
+class DeliveryTracker:
+    """
+    Follows sent messages from pending (clock) to sent, delivered and read without holding up
+    the send loop. Right after a send, the state of the chat's last bubble is recorded. Later
+    changes are read from the chat list's status icons in one script call between contacts.
+    settle() waits only for messages still pending at the end of a run. Every state change is
+    stored in message_deliveries. Watches are kept per browser; when a browser is replaced
+    its watches are handed over to the new one, and what was still pending is written off.
+    """
+
+    RANK = {"pending": 0, "sent": 1, "delivered": 2, "read": 3}
+    LAST_BUBBLE_JS = """
+        var out = document.querySelectorAll('#main div.message-out');
+        var header = document.querySelector('#main header span[title]');
+        if (!out.length) return null;
+        var icon = out[out.length - 1].querySelector('span[data-icon^="msg-"]');
+        var name = icon ? icon.getAttribute('data-icon') : '';
+        var label = icon ? (icon.getAttribute('aria-label') || '').toLowerCase() : '';
+        var status = name === 'msg-time' ? 'pending' : name === 'msg-check' ? 'sent' :
+                     name.indexOf('msg-dblcheck') === 0 ? (label.indexOf('read') !== -1 ? 'read' : 'delivered') : 'pending';
+        return [status, header ? header.getAttribute('title') : null];
+    """
+    # Status icon of each wanted chat's last message, for the chats currently rendered in the list
+    CHAT_LIST_JS = """
+        var wanted = arguments[0], found = {};
+        var titles = document.querySelectorAll('#pane-side span[title]');
+        for (var i = 0; i < titles.length; i++) {
+            var title = titles[i].getAttribute('title');
+            if (wanted.indexOf(title) === -1) continue;
+            var row = titles[i].closest('[role="listitem"], [role="row"]') || titles[i].parentElement;
+            var icon = row && row.querySelector('span[data-icon^="status-"]');
+            if (!icon) continue;
+            var name = icon.getAttribute('data-icon');
+            var label = (icon.getAttribute('aria-label') || '').toLowerCase();
+            found[title] = name === 'status-time' ? 'pending' : name === 'status-check' ? 'sent' :
+                           (label.indexOf('read') !== -1 ? 'read' : 'delivered');
+        }
+        return found;
+    """
+
+    def __init__(self, db, poll_interval=1.0):
+        self.db = db
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._watching = {}  # id(driver) -> {(job_id, item_key): entry}
+
+    def _save(self, entries):
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.db.executemany('''
+            INSERT INTO message_deliveries (job_id, item_key, recipient, chat_title, status, sent_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(job_id, item_key) DO UPDATE SET
+                recipient = excluded.recipient,
+                chat_title = COALESCE(excluded.chat_title, message_deliveries.chat_title),
+                status = excluded.status,
+                updated_at = excluded.updated_at
+        ''', [(e["job_id"], e["item_key"], e["recipient"], e["title"], e["status"], e["sent_at"], now) for e in entries])
+
+    def watch(self, driver, job, item_key, recipient, title, status="pending"):
+        """Start following a message whose chat title is known (e.g. one delivered by forwarding)."""
+        entry = {"job_id": job.id, "item_key": item_key, "recipient": recipient, "title": title,
+                 "status": status, "sent_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+        self._save([entry])
+        if title and self.RANK[status] < self.RANK["delivered"]:
+            with self._lock:
+                self._watching.setdefault(id(driver), {})[(job.id, item_key)] = entry
+        return entry
+
+    def track(self, driver, job, item_key, recipient):
+        """Record the message just sent in the open chat. Returns its current state."""
+        try:
+            state = driver.execute_script(self.LAST_BUBBLE_JS)
+        except Exception:
+            state = None
+        status, title = state if state else ("pending", None)
+        return self.watch(driver, job, item_key, recipient, title, status)["status"]
+
+    def poll(self, driver):
+        """Pick up state changes of the watched messages from the chat list; cheap enough to call after every send."""
+        with self._lock:
+            watched = list(self._watching.get(id(driver), {}).values())
+        if not watched:
+            return
+        try:
+            found = driver.execute_script(self.CHAT_LIST_JS, sorted({e["title"] for e in watched})) or {}
+        except Exception:
+            return
+        changed = []
+        with self._lock:
+            watching = self._watching.get(id(driver), {})
+            for entry in watched:
+                status = found.get(entry["title"])
+                if status and self.RANK[status] > self.RANK[entry["status"]]:
+                    entry["status"] = status
+                    changed.append(entry)
+                    if self.RANK[status] >= self.RANK["delivered"]:
+                        watching.pop((entry["job_id"], entry["item_key"]), None)
+        if changed:
+            self._save(changed)
+
+    def handover(self, old_driver, new_driver):
+        """
+        Move the watches of a browser that was replaced to its successor. Messages still pending
+        in the old browser cannot be read any more, so settle() reports them without waiting.
+        """
+        with self._lock:
+            entries = self._watching.pop(id(old_driver), {})
+            for entry in entries.values():
+                if entry["status"] == "pending":
+                    entry["orphaned"] = True
+            self._watching.setdefault(id(new_driver), {}).update(entries)
+
+    def abandon(self, driver):
+        """Give up on a browser whose session is lost: its pending messages are stored as 'unsent' and returned."""
+        with self._lock:
+            entries = list(self._watching.pop(id(driver), {}).values())
+        unsent = [e for e in entries if e["status"] == "pending"]
+        for entry in unsent:
+            entry["status"] = "unsent"
+        if unsent:
+            self._save(unsent)
+        return unsent
+
+    def settle(self, driver, navigator=None, timeout=30):
+        """
+        Wait up to `timeout` seconds for watched messages still pending. Stragglers whose chat is
+        not in the rendered chat list are opened once to read their bubble. Returns the entries
+        that never left the clock, which are stored as 'unsent'.
+        """
+        def pending():
+            with self._lock:
+                return [e for e in self._watching.get(id(driver), {}).values()
+                        if e["status"] == "pending" and not e.get("orphaned")]
+
+        deadline = time.time() + timeout
+        while pending() and time.time() < deadline:
+            self.poll(driver)
+            if pending():
+                time.sleep(self.poll_interval)
+
+        stragglers = pending()
+        with self._lock:
+            orphaned = [e for e in self._watching.get(id(driver), {}).values() if e["status"] == "pending" and e.get("orphaned")]
+        if navigator:
+            for entry in stragglers:
+                try:
+                    if navigator.open_chat(driver, entry["recipient"], entry["title"]) == 'ready':
+                        state = driver.execute_script(self.LAST_BUBBLE_JS)
+                        if state and state[0] != "pending":
+                            entry["status"] = state[0]
+                except Exception as e:
+                    print(f"Could not re-check delivery to {entry['recipient']}: {e}")
+        unsent = [e for e in stragglers if e["status"] == "pending"] + orphaned
+        for entry in unsent:
+            entry["status"] = "unsent"
+        with self._lock:
+            self._watching.pop(id(driver), None)
+        if stragglers or orphaned:
+            self._save(stragglers + orphaned)
+        return unsent
+
+    def summary(self, job_id):
+        rows = self.db.query('SELECT status, COUNT(*) FROM message_deliveries WHERE job_id = ? GROUP BY status', (job_id,))
+        return {status: count for status, count in rows}
+
+
+class FailureLedger:
+    """
+    Collects one run's failed sends by cause. Permanent failures (bad numbers, nothing to send)
+    go straight to the dead_letters table. Transient ones are kept with what is needed to
+    send them again, and retried at the end of the run with exponential backoff; whatever
+    still fails after MAX_ATTEMPTS is dead-lettered too.
+    """
+
+    # category: (label, transient)
+    CATEGORIES = {
+        "invalid_number": ("Invalid number", False),
+        "nothing_to_send": ("Nothing to send", False),
+        "compose_box": ("Compose box not found", True),
+        "upload_failed": ("Upload failed", True),
+        # Re-sending would repeat the attachments that did go out
+        "partial_media": ("Some attachments not sent", False),
+        "driver_crashed": ("Browser crashed", True),
+        "timeout": ("Timeout", True),
+        # The message may still go out, so it is never re-sent automatically; it is listed for review
+        "unsent": ("Stuck pending", False),
+        "other": ("Other error", True),
+    }
+    # Checked in order against the lower-cased reason
+    PATTERNS = [
+        (("invalid number", "no phone number", "no valid phone"), "invalid_number"),
+        (("nothing to send",), "nothing_to_send"),
+        (("stuck pending",), "unsent"),
+        (("invalid session id", "chrome not reachable", "disconnected", "no such window", "session deleted",
+          "connection refused", "max retries exceeded", "browser crashed", "session lost"), "driver_crashed"),
+        (("partial upload",), "partial_media"),
+        (("compose box", "message box", "message input"), "compose_box"),
+        (("upload", "attach", "image", "media"), "upload_failed"),
+        (("timeout", "timed out", "did not appear", "did not load", "not reached"), "timeout"),
+    ]
+    MAX_ATTEMPTS = 3
+    BACKOFF_BASE = 5.0  # seconds before the first retry round, doubled for each later round
+    # Failures that can happen after Enter was pressed, so the message may have gone out anyway
+    MAYBE_SENT = ("timeout", "driver_crashed")
+
+    def __init__(self, db, job=None):
+        self.db = db
+        self.job = job
+        self._lock = threading.Lock()
+        self._retry = {}  # item_key -> entry
+        self.counts = {}
+        self.recovered = 0
+
+    @classmethod
+    def classify(cls, reason):
+        text = str(reason or '').lower()
+        for needles, category in cls.PATTERNS:
+            if any(needle in text for needle in needles):
+                return category
+        return "other"
+
+    def fail(self, item_key, recipient, reason, payload=None, message=None, attempts=1):
+        """
+        Note a failed send. `payload` is whatever the caller's retry function needs to send it
+        again; without one the failure cannot be retried. Returns the category.
+        """
+        category = self.classify(reason)
+        entry = {"item_key": item_key, "recipient": recipient, "category": category, "reason": str(reason),
+                 "payload": payload, "message": message, "attempts": attempts}
+        if self.CATEGORIES[category][1] and payload is not None and attempts < self.MAX_ATTEMPTS:
+            with self._lock:
+                self._retry[item_key] = entry
+        else:
+            self._dead_letter([entry])
+        return category
+
+    def _dead_letter(self, entries):
+        with self._lock:
+            for entry in entries:
+                self.counts[entry["category"]] = self.counts.get(entry["category"], 0) + 1
+        if not self.job or not entries:
+            return
+        try:
+            self.db.executemany('''
+                INSERT INTO dead_letters (job_id, item_key, recipient, category, reason, attempts, message)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(job_id, item_key) DO UPDATE SET
+                    recipient = excluded.recipient, category = excluded.category, reason = excluded.reason,
+                    attempts = excluded.attempts, message = excluded.message, created_at = CURRENT_TIMESTAMP
+            ''', [(self.job.id, e["item_key"], e["recipient"], e["category"], e["reason"], e["attempts"], e["message"])
+                  for e in entries])
+        except Exception as e:
+            print(f"Could not write dead letters: {e}")
+
+    def retry(self, send, already_sent=None):
+        """
+        Run the retry rounds: send(item_key, recipient, payload) -> (sent, reason). Outcomes are
+        recorded on the job; returns how many failures were recovered. For MAYBE_SENT failures
+        already_sent(payload) is asked first, so a message that did go out is not sent twice.
+        """
+        for attempt in range(1, self.MAX_ATTEMPTS):
+            with self._lock:
+                pending, self._retry = list(self._retry.values()), {}
+            if not pending:
+                break
+            delay = self.BACKOFF_BASE * 2 ** (attempt - 1)
+            print(f"Retrying {len(pending)} failed sends in {delay:.0f}s (round {attempt})")
+            deadline = time.time() + delay
+            while time.time() < deadline and not (self.job and self.job.cancelled):
+                time.sleep(max(0.0, min(0.5, deadline - time.time())))
+            for i, entry in enumerate(pending):
+                if self.job and self.job.cancelled:
+                    # Left for a resume to pick up
+                    self._dead_letter(pending[i:])
+                    return self.recovered
+                try:
+                    if already_sent and entry["category"] in self.MAYBE_SENT and already_sent(entry["payload"]):
+                        print(f"Message to {entry['recipient']} had gone out after all; not sending it again")
+                        sent, reason = True, "already sent"
+                    else:
+                        sent, reason = send(entry["item_key"], entry["recipient"], entry["payload"])
+                except Exception as e:
+                    sent, reason = False, f"{type(e).__name__}: {e}"
+                if self.job:
+                    self.job.record_item(entry["item_key"], entry["recipient"], sent, None if sent else reason)
+                if sent:
+                    self.recovered += 1
+                else:
+                    self.fail(entry["item_key"], entry["recipient"], reason, entry["payload"], entry["message"],
+                              entry["attempts"] + 1)
+        with self._lock:
+            exhausted, self._retry = list(self._retry.values()), {}
+        self._dead_letter(exhausted)
+        return self.recovered
+
+    def breakdown(self):
+        """Final failures by label, e.g. {"Invalid number": 3}."""
+        with self._lock:
+            return {self.CATEGORIES[category][0]: count for category, count in sorted(self.counts.items())}
+
+    def summary_text(self):
+        parts = [f"{label}: {count}" for label, count in self.breakdown().items()]
+        recovered = f"{self.recovered} recovered on retry" if self.recovered else ""
+        return "; ".join(p for p in (", ".join(parts), recovered) if p)
+
+
+class SelectorRegistry:
+    """
+    Named groups of fallback selectors for WhatsApp Web controls. Each lookup probes every
+    selector of a group in one execute_script call per poll, so a dead selector costs
+    nothing instead of a full wait timeout. Hits and misses are kept per selector and
+    persisted in selector_stats; the last selector that worked is tried first, then the
+    rest by hit rate, so after a WhatsApp UI change the working fallback moves to the front.
+    """
+
+    GROUPS = {
+        "attachment": [
+            ('css', '[data-testid="clip"]'),
+            ('css', '[data-icon="clip"]'),
+            ('css', 'span[data-testid="clip"]'),
+            ('css', 'button[aria-label="Attach"]'),
+            ('css', 'div[title="Attach"]'),
+        ],
+        # File inputs are used directly, buttons are clicked to reveal the input
+        "photo": [
+            ('css', 'input[accept*="image"]'),
+            ('css', 'input[type="file"][accept*="image"]'),
+            ('css', 'li[data-testid="mi-attach-photo"]'),
+            ('css', 'button[aria-label="Photos & Videos"]'),
+        ],
+        "file_input": [
+            ('css', 'input[type="file"]'),
+        ],
+        "caption": [
+            ('css', 'div[contenteditable="true"][data-tab="10"]'),
+            ('css', 'div[aria-placeholder="Add a caption..."]'),
+            ('css', 'div[data-testid="media-caption-input"]'),
+        ],
+        "send": [
+            ('css', 'span[data-testid="send"]'),
+            ('css', 'button[data-testid="send"]'),
+            ('css', '[aria-label="Send"]'),
+        ],
+        "message_box": [
+            ('xpath', '//footer//div[@contenteditable="true"]'),
+            ('xpath', '//div[@contenteditable="true"][@data-tab="10"]'),
+            ('xpath', '//div[@contenteditable="true"][@data-tab="1"]'),
+            ('xpath', '//div[@role="textbox"][@contenteditable="true"]'),
+            ('xpath', '//div[@title="Type a message"]'),
+        ],
+        "forward_option": [
+            ('css', 'li[data-testid="mi-msg-forward"]'),
+            ('css', 'div[aria-label="Forward"]'),
+            ('xpath', '//div[@role="application"]//li//div[text()="Forward"]'),
+        ],
+        "forward_button": [
+            ('css', 'span[data-icon="forward"]'),
+            ('css', 'button[aria-label="Forward"]'),
+            ('css', 'div[data-testid="forward"]'),
+        ],
+        "forward_search": [
+            ('css', 'div[role="dialog"] div[contenteditable="true"]'),
+            ('css', 'div[data-animate-modal-popup="true"] div[contenteditable="true"]'),
+            ('css', 'div[role="dialog"] input[type="text"]'),
+        ],
+        "forward_send": [
+            ('css', 'div[role="dialog"] span[data-icon="send"]'),
+            ('css', 'div[role="dialog"] [aria-label="Send"]'),
+            ('css', 'div[data-animate-modal-popup="true"] span[data-icon="send"]'),
+        ],
+    }
+
+    # Returns [index, element] for the first selector that matches (and is visible), or null
+    PROBE_JS = """
+        const selectors = arguments[0], needVisible = arguments[1];
+        for (let i = 0; i < selectors.length; i++) {
+            let el = null;
+            try {
+                el = selectors[i][0] === 'xpath'
+                    ? document.evaluate(selectors[i][1], document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue
+                    : document.querySelector(selectors[i][1]);
+            } catch (e) { el = null; }
+            if (el && (!needVisible || (el.getClientRects().length > 0 && !el.disabled))) return [i, el];
+        }
+        return null;
+    """
+    POLL_INTERVAL = 0.2
+
+    def __init__(self, db=None, flush_every=25):
+        self.db = db
+        self.flush_every = flush_every
+        self._lock = threading.Lock()
+        self._stats = {}  # (group, selector) -> [hits, misses, last_hit_at]
+        self._dirty = set()
+        if db:
+            for group, selector, hits, misses, last_hit_at in db.query(
+                    'SELECT grp, selector, hits, misses, last_hit_at FROM selector_stats'):
+                self._stats[(group, selector)] = [hits, misses, last_hit_at or 0]
+
+    def ordered(self, group):
+        """The group's selectors, most recently successful first, then by hit rate."""
+        with self._lock:
+            defaults = self.GROUPS[group]
+            stats = [self._stats.get((group, sel), [0, 0, 0]) for _, sel in defaults]
+            latest = max(range(len(defaults)), key=lambda i: stats[i][2])
+            has_latest = stats[latest][2] > 0
+
+            def rank(i):
+                hits, misses, _ = stats[i]
+                return (not (has_latest and i == latest), -(hits + 1) / (hits + misses + 2), i)
+
+            return [defaults[i] for i in sorted(range(len(defaults)), key=rank)]
+
+    def find(self, driver, group, timeout=10, visible=True):
+        """Wait up to `timeout` seconds for any selector in the group; returns the element or None."""
+        order = self.ordered(group)
+        deadline = time.time() + timeout
+        while True:
+            try:
+                found = driver.execute_script(self.PROBE_JS, [list(sel) for sel in order], visible)
+            except Exception as e:
+                print(f"Selector probe for '{group}' failed: {e}")
+                found = None
+            if found:
+                index, element = found
+                self._record(group, order, int(index))
+                return element
+            if time.time() >= deadline:
+                self._record(group, order, None)
+                print(f"No '{group}' selector matched within {timeout}s")
+                return None
+            time.sleep(self.POLL_INTERVAL)
+
+    def _record(self, group, order, hit_index):
+        now = time.time()
+        with self._lock:
+            for i, (_, selector) in enumerate(order):
+                if hit_index is not None and i > hit_index:
+                    break
+                entry = self._stats.setdefault((group, selector), [0, 0, 0])
+                if i == hit_index:
+                    entry[0] += 1
+                    entry[2] = now
+                else:
+                    entry[1] += 1
+                self._dirty.add((group, selector))
+            due = len(self._dirty) >= self.flush_every
+        if due:
+            self.flush()
+
+    def flush(self):
+        if not self.db:
+            return
+        with self._lock:
+            rows = [(group, selector, *self._stats[(group, selector)]) for group, selector in self._dirty]
+            self._dirty.clear()
+        if rows:
+            self.db.executemany('''
+                INSERT INTO selector_stats (grp, selector, hits, misses, last_hit_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(grp, selector) DO UPDATE SET hits = excluded.hits, misses = excluded.misses,
+                                                         last_hit_at = excluded.last_hit_at
+            ''', rows)
+
+    def report(self):
+        with self._lock:
+            return {group: [{"selector": sel, "hits": self._stats.get((group, sel), [0, 0, 0])[0],
+                             "misses": self._stats.get((group, sel), [0, 0, 0])[1]} for _, sel in selectors]
+                    for group, selectors in self.GROUPS.items()}
+
+
+class ImagePreprocessor:
+    """
+    Downsizes and re-encodes campaign images before they are attached, so the browser uploads
+    a small file instead of re-encoding a full-size phone photo for every recipient. Results
+    are stored under cache_dir by content hash, so the same picture in a later campaign is
+    reused as is. Without Pillow, images are passed through untouched.
+    """
+
+    MAX_SIDE = 1600  # WhatsApp's standard-quality photos are not larger than this
+    QUALITY = 82
+    EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}  # GIFs may be animated and are left alone
+    VERSION = 1  # Bump when the output changes so older cache entries are not reused
+
+    def __init__(self, cache_dir, max_side=MAX_SIDE, quality=QUALITY, max_cache_bytes=512 * 1024 * 1024):
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_side = max_side
+        self.quality = quality
+        self.max_cache_bytes = max_cache_bytes
+        self.stats = {"processed": 0, "reused": 0, "passed_through": 0}
+
+    def _digest(self, path):
+        digest = hashlib.sha256(f"{self.VERSION}|{self.max_side}|{self.quality}|".encode())
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def process(self, path):
+        """Return the path of the prepared copy of `path`, or `path` itself when it is not worth processing."""
+        if Image is None or os.path.splitext(path)[1].lower() not in self.EXTENSIONS:
+            self.stats["passed_through"] += 1
+            return path
+        try:
+            digest = self._digest(path)
+            for suffix in ('.jpg', '.png'):
+                cached = self.cache_dir / f"{digest}{suffix}"
+                if cached.exists():
+                    self.stats["reused"] += 1
+                    return str(cached)
+
+            with Image.open(path) as original:
+                image = ImageOps.exif_transpose(original)
+                has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+                image.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+                target = self.cache_dir / f"{digest}{'.png' if has_alpha else '.jpg'}"
+                partial = target.with_name(target.name + '.part')
+                # Saving without exif/pnginfo drops the metadata
+                if has_alpha:
+                    image.save(partial, 'PNG', optimize=True)
+                else:
+                    image.convert('RGB').save(partial, 'JPEG', quality=self.quality, optimize=True, progressive=True)
+
+            # Kept even when it is not smaller than the original: the original still carries EXIF/GPS
+            original_size = os.path.getsize(path)
+            os.replace(partial, target)
+            self.stats["processed"] += 1
+            print(f"Prepared {os.path.basename(path)}: {original_size / 1024:.0f} KB -> {target.stat().st_size / 1024:.0f} KB")
+            self._prune()
+            return str(target)
+        except Exception as e:
+            print(f"Image preprocessing failed for {path}, sending the original: {e}")
+            self.stats["passed_through"] += 1
+            return path
+
+    def _prune(self):
+        """Drop the least recently written entries once the cache grows past max_cache_bytes."""
+        entries = sorted((f for f in self.cache_dir.iterdir() if f.is_file()), key=lambda f: f.stat().st_mtime)
+        total = sum(f.stat().st_size for f in entries)
+        for entry in entries:
+            if total <= self.max_cache_bytes:
+                break
+            total -= entry.stat().st_size
+            entry.unlink()
+
+
+class MediaFile:
+    """An attachment validated once per campaign and shared by every recipient."""
+
+    MAX_BYTES = 64 * 1024 * 1024  # WhatsApp's media limit
+    EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.mp4', '.3gp', '.3gpp', '.mov'}
+
+    def __init__(self, path, source=None):
+        self.path = os.path.abspath(path)
+        self.source = source or self.path  # The file the user picked, before preprocessing
+        stat = os.stat(self.path)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.name = os.path.basename(self.path)
+        self.mime = mimetypes.guess_type(self.path)[0] or 'application/octet-stream'
+        # Identifies this exact file version inside the page's media cache
+        self.key = hashlib.sha1(f"{self.path}|{self.size}|{self.mtime}".encode()).hexdigest()[:16]
+        self._b64 = None
+        self._lock = threading.Lock()
+
+    @property
+    def b64(self):
+        """Base64 payload, read and encoded at most once."""
+        with self._lock:
+            if self._b64 is None:
+                with open(self.path, 'rb') as f:
+                    self._b64 = base64.b64encode(f.read()).decode('ascii')
+            return self._b64
+
+
+class MediaAttacher:
+    """
+    Attaches a prepared MediaFile to the open chat and sends it with an optional caption.
+    The first attachment in a page goes through WhatsApp's own file input; the File object
+    is then kept in the page (window.__wbsMedia) so later recipients get it by a synthetic
+    drop without re-uploading anything. The strategy that last worked is tried first.
+    """
+
+    STRATEGIES = ("attach_menu", "drop")
+    MAX_STRATEGY_FAILURES = 2
+
+    # Keeps the File picked into an input so later chats can reuse it
+    REMEMBER_JS = """
+        var input = arguments[0], key = arguments[1];
+        if (!input || !input.files || !input.files.length) return false;
+        window.__wbsMedia = window.__wbsMedia || {};
+        window.__wbsMedia[key] = input.files[0];
+        return true;
+    """
+    CACHED_JS = "return !!(window.__wbsMedia && window.__wbsMedia[arguments[0]]);"
+    HIDDEN_INPUT_JS = """
+        var input = document.getElementById('wbs-media-input');
+        if (!input) {
+            input = document.createElement('input');
+            input.type = 'file';
+            input.id = 'wbs-media-input';
+            input.style.display = 'none';
+            document.body.appendChild(input);
+        }
+        return input;
+    """
+    # Only used when the file cannot be handed to a file input; the payload crosses the wire once per page
+    DATA_URL_JS = """
+        var b64 = arguments[0], name = arguments[1], mime = arguments[2], key = arguments[3];
+        var bytes = atob(b64), buffer = new Uint8Array(bytes.length);
+        for (var i = 0; i < bytes.length; i++) buffer[i] = bytes.charCodeAt(i);
+        window.__wbsMedia = window.__wbsMedia || {};
+        window.__wbsMedia[key] = new File([buffer], name, {type: mime});
+        return true;
+    """
+    DROP_JS = """
+        var file = window.__wbsMedia && window.__wbsMedia[arguments[0]];
+        if (!file) return 'not_cached';
+        var target = document.querySelector('#main') ||
+                     document.querySelector('[data-testid="conversation-panel-messages"]');
+        if (!target) return 'no_target';
+        var dt = new DataTransfer();
+        dt.items.add(file);
+        ['dragenter', 'dragover', 'drop'].forEach(function(type) {
+            target.dispatchEvent(new DragEvent(type, {dataTransfer: dt, bubbles: true, cancelable: true}));
+        });
+        return 'dropped';
+    """
+
+    def __init__(self, readiness, selectors, composer, preprocessor=None):
+        self.readiness = readiness
+        self.selectors = selectors
+        self.composer = composer
+        self.preprocessor = preprocessor
+        self._prepared = {}
+        self._preferred = None
+        self._failures = {name: 0 for name in self.STRATEGIES}
+        self._lock = threading.Lock()
+        self.stats = {name: 0 for name in self.STRATEGIES}
+
+    def prepare(self, path):
+        """Validate `path` and return its MediaFile (cached per file version), or None."""
+        if not path or not isinstance(path, str):
+            return None
+        try:
+            abs_path = os.path.abspath(path)
+            if not os.path.isfile(abs_path):
+                print(f"Media file not found: {abs_path}")
+                return None
+            stat = os.stat(abs_path)
+            if stat.st_size > MediaFile.MAX_BYTES:
+                print(f"Warning: File too large ({stat.st_size} bytes)")
+                return None
+            if os.path.splitext(abs_path)[1].lower() not in MediaFile.EXTENSIONS:
+                print(f"Unsupported media type: {abs_path}")
+                return None
+            cache_key = (abs_path, stat.st_size, stat.st_mtime)
+            with self._lock:
+                media = self._prepared.get(cache_key)
+            if media is None:
+                prepared_path = self.preprocessor.process(abs_path) if self.preprocessor else abs_path
+                media = MediaFile(prepared_path, source=abs_path)
+                with self._lock:
+                    media = self._prepared.setdefault(cache_key, media)
+            return media
+        except Exception as e:
+            print(f"Error preparing media: {e}")
+            return None
+
+    def _order(self, driver, media):
+        with self._lock:
+            order = list(self.STRATEGIES)
+            if self._preferred:
+                order.remove(self._preferred)
+                order.insert(0, self._preferred)
+            # A file already in the page is always worth a cheap drop first, unless drops keep failing
+            try:
+                cached = driver.execute_script(self.CACHED_JS, media.key)
+            except Exception:
+                cached = False
+            if cached and self._failures["drop"] < self.MAX_STRATEGY_FAILURES:
+                order.remove("drop")
+                order.insert(0, "drop")
+            return order
+
+    def _attach_menu(self, driver, media):
+        """Clip button -> photo option -> WhatsApp's own file input."""
+        attachment_btn = self.selectors.find(driver, "attachment", timeout=10)
+        if not attachment_btn:
+            return False
+        attachment_btn.click()
+        self.readiness.wait_for_file_input(driver)
+        option = self.selectors.find(driver, "photo", timeout=5, visible=False)
+        if option and option.tag_name.lower() != 'input':
+            # Button - click first then find input
+            option.click()
+            option = self.selectors.find(driver, "file_input", timeout=5, visible=False)
+        if not option:
+            return False
+        option.send_keys(media.path)
+        driver.execute_script(self.REMEMBER_JS, option, media.key)
+        return True
+
+    def _drop(self, driver, media):
+        """Drop the page-cached File onto the chat, loading it into the page first if needed."""
+        if not driver.execute_script(self.CACHED_JS, media.key):
+            try:
+                hidden_input = driver.execute_script(self.HIDDEN_INPUT_JS)
+                hidden_input.send_keys(media.path)
+                driver.execute_script(self.REMEMBER_JS, hidden_input, media.key)
+            except Exception as e:
+                print(f"Hidden input upload failed ({e}), sending file contents to the page")
+                driver.execute_script(self.DATA_URL_JS, media.b64, media.name, media.mime, media.key)
+        result = driver.execute_script(self.DROP_JS, media.key)
+        if result != 'dropped':
+            print(f"Media drop failed: {result}")
+        return result == 'dropped'
+
+    def attach(self, driver, media):
+        """Put `media` into the open chat's preview. Returns the strategy used or None."""
+        for name in self._order(driver, media):
+            try:
+                attached = getattr(self, f"_{name}")(driver, media) and self.readiness.wait_for_media_preview(driver)
+            except Exception as e:
+                print(f"Media strategy '{name}' failed: {e}")
+                attached = False
+            with self._lock:
+                if attached:
+                    self._preferred = name
+                    self._failures[name] = 0
+                    self.stats[name] += 1
+                    return name
+                self._failures[name] += 1
+            # Close a half-open menu or preview before trying the next way in
+            try:
+                driver.find_element(By.TAG_NAME, 'body').send_keys(Keys.ESCAPE)
+            except Exception:
+                pass
+        return None
+
+    def send(self, driver, media, caption_message=""):
+        """Attach, caption and send `media` in the open chat."""
+        strategy = self.attach(driver, media)
+        if not strategy:
+            return {"status": "error", "message": "Could not attach media"}
+
+        if caption_message and caption_message.strip():
+            caption_input = self.selectors.find(driver, "caption", timeout=5)
+            if caption_input:
+                try:
+                    self.composer.compose(driver, caption_input, caption_message)
+                except Exception as e:
+                    print(f"Caption failed: {e}")
+
+        send_btn = self.selectors.find(driver, "send", timeout=10)
+        try:
+            if send_btn:
+                send_btn.click()
+            else:
+                driver.find_element(By.TAG_NAME, 'body').send_keys(Keys.ENTER)
+        except Exception as e:
+            return {"status": "error", "message": f"Could not send media: {e}"}
+        return {"status": "success", "message": f"Media sent via {strategy}"}
+
+
+class MessageForwarder:
+    """
+    Forwards the last outgoing message of the open chat to several chats at once through
+    WhatsApp Web's forward dialog, so an identical broadcast costs a checkbox per recipient
+    instead of a chat load, an upload and a typed message.
+    """
+
+    BATCH_SIZE = 5  # WhatsApp's limit on chats per forward
+
+    # Hovers the last outgoing bubble and returns its context-menu chevron
+    MESSAGE_MENU_JS = """
+        var out = document.querySelectorAll('#main div.message-out');
+        if (!out.length) return null;
+        var last = out[out.length - 1];
+        last.scrollIntoView({block: 'end'});
+        last.dispatchEvent(new MouseEvent('mouseover', {bubbles: true}));
+        return last.querySelector('[data-icon="down-context"], [aria-label="Context menu"], [data-testid="icon-down-context"]');
+    """
+    # Same matching rules as ChatNavigator.SEARCH_MATCH_JS, scoped to the forward dialog
+    DIALOG_MATCH_JS = """
+        var tail = arguments[0].slice(-10);
+        var dialog = document.querySelector('div[role="dialog"]') ||
+                     document.querySelector('div[data-animate-modal-popup="true"]');
+        if (!dialog) return null;
+        var titles = dialog.querySelectorAll('span[title]');
+        var matches = [];
+        for (var i = 0; i < titles.length; i++) {
+            var digits = (titles[i].getAttribute('title') || '').replace(/\\D/g, '');
+            if (digits.length >= 10 && digits.slice(-10) === tail) {
+                matches.push(titles[i]);
+            }
+        }
+        return matches.length === 1 ? matches[0] : null;
+    """
+    DIALOG_CLOSED_JS = """
+        return !(document.querySelector('div[role="dialog"]') ||
+                 document.querySelector('div[data-animate-modal-popup="true"]'));
+    """
+
+    def __init__(self, readiness, selectors, search_timeout=2.5):
+        self.readiness = readiness
+        self.selectors = selectors
+        self.search_timeout = search_timeout
+        self.stats = {"forwarded": 0, "not_found": 0}
+
+    def _close_dialog(self, driver):
+        try:
+            driver.find_element(By.TAG_NAME, 'body').send_keys(Keys.ESCAPE)
+        except Exception:
+            pass
+
+    def forward_last(self, driver, recipients):
+        """
+        Forward the open chat's last outgoing message to `recipients` [(mobile, name)], at most
+        BATCH_SIZE of them. Returns {mobile: chat title} for the chats it was forwarded to; recipients
+        that the dialog cannot find (no existing chat or contact) are left for the caller to send directly.
+        """
+        try:
+            menu = driver.execute_script(self.MESSAGE_MENU_JS)
+            if not menu:
+                return {}
+            menu.click()
+            for group in ("forward_option", "forward_button"):
+                control = self.selectors.find(driver, group, timeout=3)
+                if not control:
+                    self._close_dialog(driver)
+                    return {}
+                control.click()
+            search = self.selectors.find(driver, "forward_search", timeout=5)
+            if not search:
+                self._close_dialog(driver)
+                return {}
+
+            picked = {}
+            for mobile, _ in recipients[:self.BATCH_SIZE]:
+                search.click()
+                search.send_keys(Keys.CONTROL + "a", Keys.DELETE)
+                search.send_keys(PhoneNormalizer.digits(mobile))
+                match = self.readiness.wait_for(driver, "forward_result", self.DIALOG_MATCH_JS, mobile,
+                                                timeout=self.search_timeout)
+                if match:
+                    picked[mobile] = match.get_attribute('title')
+                    match.click()
+                else:
+                    self.stats["not_found"] += 1
+            search.send_keys(Keys.CONTROL + "a", Keys.DELETE)
+
+            send_btn = self.selectors.find(driver, "forward_send", timeout=5) if picked else None
+            if not send_btn:
+                self._close_dialog(driver)
+                return {}
+            send_btn.click()
+            self.readiness.wait_for(driver, "forward_done", self.DIALOG_CLOSED_JS)
+            self.stats["forwarded"] += len(picked)
+            return picked
+        except Exception as e:
+            print(f"Forwarding failed: {e}")
+            self._close_dialog(driver)
+            return {}
+
+
+class DatasetRegistry:
+    """
+    Parsed sheets kept on the Python side under opaque handles. The page only receives
+    columns, counts and pages of rows, and send jobs look the rows up by handle, so large
+    sheets never cross the JS bridge. A streamed dataset holds only a preview of its rows;
+    the rest are read from its file again when needed. The least recently used datasets are
+    evicted first.
+    """
+
+    def __init__(self, max_datasets=8):
+        self.max_datasets = max_datasets
+        self._lock = threading.Lock()
+        self._datasets = OrderedDict()
+
+    def add(self, kind, rows, columns=None, file_path=None, handle=None, total=None, streamed=False, **extra):
+        handle = handle or uuid.uuid4().hex
+        dataset = {"handle": handle, "kind": kind, "rows": rows, "columns": columns or [],
+                   "file_path": file_path, "total": len(rows) if total is None else total,
+                   "streamed": streamed, **extra}
+        with self._lock:
+            self._datasets[handle] = dataset
+            self._datasets.move_to_end(handle)
+            while len(self._datasets) > self.max_datasets:
+                self._datasets.popitem(last=False)
+        return dataset
+
+    def get(self, handle):
+        with self._lock:
+            dataset = self._datasets.get(handle)
+            if dataset:
+                self._datasets.move_to_end(handle)
+            return dataset
+
+    def discard(self, handle):
+        with self._lock:
+            self._datasets.pop(handle, None)
+
+    @staticmethod
+    def describe(dataset):
+        """The small reference the page keeps and hands back to start a send."""
+        return {"handle": dataset["handle"], "kind": dataset["kind"], "file_path": dataset["file_path"],
+                "total": dataset["total"]}
+
+    @staticmethod
+    def page_rows(rows, offset=0, limit=50):
+        # Nested values (e.g. a customer's linked courier entry) stay on the Python side
+        rows = itertools.islice(rows, offset, offset + limit)
+        return [{key: value for key, value in row.items() if not isinstance(value, (dict, list))} for row in rows]
+
+
+class Database:
+    """
+    Data access layer for whatsapp_data.db: one shared WAL-mode connection behind a lock,
+    cached prepared statements, context-managed transactions and schema migrations that run
+    once at startup, so the job workers and the UI threads can use the database together.
+    """
+
+    def __init__(self, db_path, busy_timeout=5.0):
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        # pywebview answers every js_api call on a new thread, so per-thread connections would
+        # be opened (and leaked) on each UI poll; one connection is shared and serialised instead
+        self._lock = threading.RLock()
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            # sqlite3 keeps a per-connection cache of prepared statements
+            conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, cached_statements=256,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._conn = conn
+        return self._conn
+
+    @contextmanager
+    def transaction(self):
+        """Yield a cursor inside BEGIN IMMEDIATE ... COMMIT, rolling back on any exception."""
+        with self._lock:
+            conn = self._connection()
+            if conn.in_transaction:
+                # Nested use joins the outer transaction (the lock is re-entrant)
+                yield conn.cursor()
+                return
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn.cursor()
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def query(self, sql, params=()):
+        with self._lock:
+            return self._connection().execute(sql, params).fetchall()
+
+    def query_one(self, sql, params=()):
+        with self._lock:
+            return self._connection().execute(sql, params).fetchone()
+
+    def execute(self, sql, params=()):
+        """Run one write statement in its own transaction and return the cursor."""
+        with self.transaction() as cursor:
+            cursor.execute(sql, params)
+            return cursor
+
+    def executemany(self, sql, rows):
+        with self.transaction() as cursor:
+            cursor.executemany(sql, rows)
+            return cursor
+
+    def migrate(self, migrations):
+        """Apply migrations newer than PRAGMA user_version, each in its own transaction."""
+        current = self.query_one("PRAGMA user_version")[0]
+        for number, migration in enumerate(migrations, start=1):
+            if number <= current:
+                continue
+            print(f"--- Applying database migration {number}: {migration.__doc__ or migration.__name__} ---")
+            with self.transaction() as cursor:
+                migration(cursor)
+                cursor.execute(f"PRAGMA user_version = {number}")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def _migrate_base_schema(cursor):
+    """base schema"""
+    # Idempotent so databases created before migrations existed are brought up to date
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS groups (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            members TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS templates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS custom_templates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            message_template TEXT NOT NULL,
+            excel_file_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            method TEXT NOT NULL,
+            params TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            total INTEGER DEFAULT 0,
+            result TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS job_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id TEXT NOT NULL,
+            item_key TEXT NOT NULL,
+            recipient TEXT,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 1,
+            last_error TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(job_id, item_key)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS whatsapp_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    cursor.execute("PRAGMA table_info(users)")
+    columns = [row[1] for row in cursor.fetchall()]
+    if not columns:
+        cursor.execute('''
+            CREATE TABLE users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                password TEXT NOT NULL,
+                role TEXT NOT NULL DEFAULT 'user',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_login TIMESTAMP
+            )
+        ''')
+    else:
+        if 'role' not in columns:
+            cursor.execute('ALTER TABLE users ADD COLUMN role TEXT NOT NULL DEFAULT "user"')
+        if 'created_at' not in columns:
+            cursor.execute('ALTER TABLE users ADD COLUMN created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP')
+        if 'last_login' not in columns:
+            cursor.execute('ALTER TABLE users ADD COLUMN last_login TIMESTAMP')
+    cursor.execute('INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)',
+                   ('admin', '123456', 'admin'))
+
+
+def _migrate_lookup_indexes(cursor):
+    """indexes for job lookups"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_job_items_status ON job_items (job_id, status)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created_at)')
+
+
+def _migrate_app_settings(cursor):
+    """key/value app settings"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS app_settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _migrate_courier_columns(cursor):
+    """courier sheet column mapping"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS courier_columns (
+            name TEXT PRIMARY KEY,
+            kind TEXT NOT NULL DEFAULT 'item',
+            aliases TEXT NOT NULL DEFAULT '[]',
+            unit TEXT NOT NULL DEFAULT '',
+            position INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    # The headers and products the parser used to have hard-coded
+    fields = [
+        ('date', ['Date']), ('challan_no', ['Challan No']), ('customer_code', ['Customer Code']),
+        ('customer_name', ['Customer']), ('customer_location', ['Location']), ('courier_name', ['Courier Name']),
+        ('docket_no', ['Docket No', 'Docket No.']), ('courier_link', ['Courier Link']),
+        ('no_of_boxes', ['No. of boxes']), ('shipment_type', ['Shipment', 'Shipment Type']),
+        ('mobile', ['Mobile No.', 'Mobile No']),
+    ]
+    items = [
+        "13X17 Blue Base Film ACC-91", "8X10 Blue Base Film ACC-91", "Accurate Paper ACC-41 A4",
+        "Accurate Paper ACC-61 A4", "Accurate Paper ACC-61 A5", "White Instant Film-ACC-81 - A3",
+        "White Instant Film-ACC-81 - A4", "BLACK Ink-81", "CYAN Ink-81", "LIGHT CYAN Ink-81",
+        "LIGHT MAGENTA-Ink-81", "MAGENTA Ink-81", "YELLOW Ink-81", "Maintanace box",
+    ]
+    rows = [(name, 'field', json.dumps(aliases), '', position) for position, (name, aliases) in enumerate(fields)]
+    rows += [(name, 'item', '[]', 'Grm' if 'Ink' in name else '', len(fields) + position)
+             for position, name in enumerate(items)]
+    cursor.executemany('''
+        INSERT OR IGNORE INTO courier_columns (name, kind, aliases, unit, position) VALUES (?, ?, ?, ?, ?)
+    ''', rows)
+
+
+def _migrate_number_status(cursor):
+    """WhatsApp registration cache"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS number_status (
+            phone TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            ttl_days INTEGER NOT NULL,
+            source TEXT,
+            checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _migrate_selector_stats(cursor):
+    """selector hit/miss statistics"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS selector_stats (
+            grp TEXT NOT NULL,
+            selector TEXT NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            misses INTEGER NOT NULL DEFAULT 0,
+            last_hit_at REAL,
+            PRIMARY KEY (grp, selector)
+        )
+    ''')
+
+
+def _migrate_message_deliveries(cursor):
+    """message delivery states"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS message_deliveries (
+            job_id TEXT NOT NULL,
+            item_key TEXT NOT NULL,
+            recipient TEXT,
+            chat_title TEXT,
+            status TEXT NOT NULL,
+            sent_at TEXT,
+            updated_at TEXT,
+            PRIMARY KEY (job_id, item_key)
+        )
+    ''')
+
+
+def _migrate_dead_letters(cursor):
+    """dead-letter list of failed recipients"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS dead_letters (
+            job_id TEXT NOT NULL,
+            item_key TEXT NOT NULL,
+            recipient TEXT,
+            category TEXT NOT NULL,
+            reason TEXT,
+            attempts INTEGER NOT NULL DEFAULT 1,
+            message TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (job_id, item_key)
+        )
+    ''')
+
+
+# Append new migrations here; PRAGMA user_version records how many have been applied
+def _migrate_e164_plus(cursor):
+    """'+' on cached phone numbers"""
+    # Numbers were cached as bare country-code digits before normalize() kept the '+'
+    cursor.execute("UPDATE number_status SET phone = '+' || phone WHERE phone NOT LIKE '+%'")
+
+
+MIGRATIONS = [_migrate_base_schema, _migrate_lookup_indexes, _migrate_app_settings, _migrate_courier_columns,
+              _migrate_number_status, _migrate_selector_stats, _migrate_message_deliveries, _migrate_dead_letters,
+              _migrate_e164_plus]
+
+
+class JobStore:
+    """
+    Persists campaigns (jobs) and per-recipient outcomes (job_items) in SQLite so a run
+    interrupted by a crash or sleep can be resumed without re-sending. Each item outcome is
+    committed as soon as it is recorded; a WAL commit is cheap next to the send itself, and
+    a crash then loses nothing that was already delivered.
+    """
+
+    ACTIVE = ('queued', 'running', 'paused')
+
+    def __init__(self, db):
+        self.db = db
+
+    def create_job(self, job_id, kind, method, args, kwargs):
+        self.db.execute('''
+            INSERT INTO jobs (id, kind, method, params, status) VALUES (?, ?, ?, ?, 'queued')
+            ON CONFLICT(id) DO UPDATE SET status = 'queued', updated_at = CURRENT_TIMESTAMP
+        ''', (job_id, kind, method, json.dumps({"args": list(args), "kwargs": kwargs})))
+
+    def set_status(self, job_id, status, total=None, result=None):
+        self.db.execute('''
+            UPDATE jobs SET status = ?, total = COALESCE(?, total), result = COALESCE(?, result),
+                            updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (status, total, json.dumps(result) if result is not None else None, job_id))
+
+    def record_item(self, job_id, item_key, recipient, status, error=None):
+        row = (job_id, item_key, recipient, status, error, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        with self.db.transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO job_items (job_id, item_key, recipient, status, last_error, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(job_id, item_key) DO UPDATE SET
+                    recipient = excluded.recipient,
+                    status = excluded.status,
+                    attempts = job_items.attempts + 1,
+                    last_error = excluded.last_error,
+                    updated_at = excluded.updated_at
+            ''', row)
+            if status == 'sent':
+                # An item delivered later (e.g. by a resumed run) is no longer a failed recipient
+                cursor.execute('DELETE FROM dead_letters WHERE job_id = ? AND item_key = ?', (job_id, item_key))
+
+    def delivered_keys(self, job_id):
+        """Keys a resume skips: sent items, and unconfirmed ones ('unsent') that are left for review."""
+        rows = self.db.query("SELECT item_key FROM job_items WHERE job_id = ? AND status IN ('sent', 'unsent')", (job_id,))
+        return {row[0] for row in rows}
+
+    def load_job(self, job_id):
+        row = self.db.query_one('SELECT kind, method, params FROM jobs WHERE id = ?', (job_id,))
+        if not row:
+            return None
+        params = json.loads(row[2])
+        return {"kind": row[0], "method": row[1], "args": params.get("args", []), "kwargs": params.get("kwargs", {})}
+
+    def list_jobs(self, limit=50):
+        rows = self.db.query('''
+            SELECT j.id, j.kind, j.status, j.total, j.created_at, j.updated_at,
+                   SUM(CASE WHEN i.status = 'sent' THEN 1 ELSE 0 END),
+                   SUM(CASE WHEN i.status = 'failed' THEN 1 ELSE 0 END),
+                   SUM(CASE WHEN i.status = 'unsent' THEN 1 ELSE 0 END)
+            FROM jobs j LEFT JOIN job_items i ON i.job_id = j.id
+            GROUP BY j.id ORDER BY j.created_at DESC LIMIT ?
+        ''', (limit,))
+        return [{"id": r[0], "kind": r[1], "status": r[2], "total": r[3], "created_at": r[4],
+                 "updated_at": r[5], "sent": r[6] or 0, "failed": r[7] or 0, "unsent": r[8] or 0} for r in rows]
+
+    def mark_interrupted(self):
+        """Jobs still marked active at startup were cut off by a crash or shutdown."""
+        self.db.execute(f"UPDATE jobs SET status = 'interrupted' WHERE status IN ({','.join('?' * len(self.ACTIVE))})",
+                        self.ACTIVE)
+
+
+class Job:
+    """A campaign running on a worker thread, with progress reporting and pause/cancel controls."""
+
+    FINISHED = ('completed', 'failed', 'cancelled')
+
+    def __init__(self, job_id, kind, notify=None, store=None, done_keys=None):
+        self.id = job_id
+        self.kind = kind
+        self.store = store
+        # Item keys already delivered in an earlier (interrupted) run of this job
+        self.done_keys = set(done_keys or ())
+        self.status = 'queued'
+        self.total = 0
+        self.processed = 0
+        self.success = 0
+        self.errors = 0
+        self.current = None
+        self.result = None
+        self.created_at = datetime.now()
+        self.finished_at = None
+        self.thread = None
+        self._notify = notify
+        self._cancel = threading.Event()
+        self._resume = threading.Event()
+        self._resume.set()
+
+    def _changed(self):
+        if self._notify:
+            self._notify(self)
+
+    def set_total(self, total):
+        self.total = total
+        self._changed()
+
+    def progress(self, processed, success, errors, current=None):
+        """Record absolute progress counters after (or before) each contact."""
+        self.processed = processed
+        self.success = success
+        self.errors = errors
+        self.current = current
+        self._changed()
+
+    def is_done(self, item_key):
+        return item_key in self.done_keys
+
+    def mark_unconfirmed(self, item_key, recipient, error=None):
+        """A message that may or may not have gone out: a resume skips it and the user reviews it."""
+        self.done_keys.add(item_key)
+        if self.store:
+            self.store.record_item(self.id, item_key, recipient, 'unsent', error)
+
+    def record_item(self, item_key, recipient, success, error=None):
+        """Persist one recipient's outcome so a resumed run can skip it."""
+        if success:
+            self.done_keys.add(item_key)
+        else:
+            self.done_keys.discard(item_key)
+        if self.store:
+            self.store.record_item(self.id, item_key, recipient, 'sent' if success else 'failed', error)
+
+    def checkpoint(self):
+        """Call between contacts: blocks while paused and returns False once the job is cancelled."""
+        while not self._resume.wait(0.5):
+            if self._cancel.is_set():
+                break
+        return not self._cancel.is_set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def pause(self):
+        if self.status == 'running':
+            self._resume.clear()
+            self.status = 'paused'
+            self._changed()
+
+    def resume(self):
+        if self.status == 'paused':
+            self.status = 'running'
+            self._resume.set()
+            self._changed()
+
+    def cancel(self):
+        if self.status not in self.FINISHED:
+            self._cancel.set()
+            self._resume.set()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "total": self.total,
+            "processed": self.processed,
+            "success": self.success,
+            "errors": self.errors,
+            "current": self.current,
+            "result": self.result,
+            "created_at": self.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            "finished_at": self.finished_at.strftime('%Y-%m-%d %H:%M:%S') if self.finished_at else None
+        }
+
+
+class JobManager:
+    """Runs sender functions on worker threads so the pywebview bridge returns immediately."""
+
+    def __init__(self, notify=None, store=None):
+        self._notify = notify
+        self.store = store
+        self._lock = threading.Lock()
+        self._counter = 0
+        self.jobs = {}
+
+    def start(self, kind, target, args=(), kwargs=None, job_id=None, done_keys=None):
+        """
+        Run target(*args, job=job, **kwargs) in the background and return the Job.
+        Pass the id of a stored job and its delivered item keys to resume it.
+        """
+        kwargs = kwargs or {}
+        with self._lock:
+            if job_id is None:
+                self._counter += 1
+                job_id = f"{kind}-{datetime.now().strftime('%Y%m%d%H%M%S')}-{self._counter}"
+            existing = self.jobs.get(job_id)
+            if existing and existing.status not in Job.FINISHED:
+                raise Exception(f"Job {job_id} is already running")
+            job = Job(job_id, kind, self._notify, self.store, done_keys)
+            self.jobs[job_id] = job
+        if self.store:
+            self.store.create_job(job_id, kind, target.__name__, args, kwargs)
+
+        def run():
+            job.status = 'running'
+            if self.store:
+                self.store.set_status(job_id, 'running')
+            job._changed()
+            try:
+                job.result = target(*args, job=job, **kwargs)
+                if job.cancelled:
+                    job.status = 'cancelled'
+                elif isinstance(job.result, dict) and job.result.get("status") == "error":
+                    job.status = 'failed'
+                else:
+                    job.status = 'completed'
+            except Exception as e:
+                print(f"Job {job_id} crashed: {e}")
+                job.result = {"status": "error", "message": f"An error occurred: {str(e)}"}
+                job.status = 'failed'
+            job.finished_at = datetime.now()
+            if self.store:
+                try:
+                    self.store.set_status(job_id, job.status, job.total, job.result)
+                except Exception as e:
+                    print(f"Could not persist final state of job {job_id}: {e}")
+            job._changed()
+
+        job.thread = threading.Thread(target=run, name=job_id, daemon=True)
+        job.thread.start()
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+
+class DriverManager:
+    """Keeps one warm, logged-in WhatsApp Web session alive across send calls."""
+
+    WHATSAPP_URL = "https://web.whatsapp.com"
+    LOGIN_XPATH = '//div[@contenteditable="true"][@data-tab="3"]'
+
+    def __init__(self, driver_factory, readiness, name="default"):
+        self._driver_factory = driver_factory
+        self.readiness = readiness
+        self.name = name
+        # Each session navigates its own browser, so it keeps its own per-run navigation stats
+        self.navigator = ChatNavigator(readiness)
+        self._state_lock = threading.Lock()
+        self._busy = threading.Lock()
+        self.driver = None
+        self.logged_in = False
+        self.created_at = None
+        self.last_used = None
+        self.restarts = 0
+
+    def _is_alive(self):
+        """Cheap health check: the browser must answer a script call and still have a window."""
+        if not self.driver:
+            return False
+        try:
+            self.driver.execute_script("return document.readyState")
+            return len(self.driver.window_handles) > 0
+        except Exception:
+            return False
+
+    def _is_logged_in(self):
+        try:
+            return bool(self.driver.find_elements(By.XPATH, self.LOGIN_XPATH))
+        except Exception:
+            return False
+
+    def _quit_driver(self):
+        if self.driver:
+            try:
+                self.driver.quit()
+            except:
+                pass
+        self.driver = None
+        self.logged_in = False
+        self.created_at = None
+
+    def acquire(self, max_wait_time=120):
+        """
+        Return a healthy, logged-in driver reserved for the caller, or None on login timeout.
+        Every driver returned by acquire() must be handed back with release().
+        """
+        self._busy.acquire()
+        try:
+            with self._state_lock:
+                if self.driver and not self._is_alive():
+                    print("Cached Chrome session is not responding, recreating it...")
+                    self._quit_driver()
+                    self.restarts += 1
+
+                if not self.driver:
+                    self.driver = self._driver_factory()
+                    self.created_at = time.time()
+                    self.driver.get(self.WHATSAPP_URL)
+                elif "web.whatsapp.com" not in self.driver.current_url:
+                    self.logged_in = False
+                    self.driver.get(self.WHATSAPP_URL)
+
+            if self.logged_in and self._is_logged_in():
+                print("Reusing warm WhatsApp Web session")
+            else:
+                self.logged_in = False
+                print("Waiting for WhatsApp Web to load...")
+                if not self.readiness.wait_for_login(self.driver, max_wait_time):
+                    self._busy.release()
+                    return None
+                self.logged_in = True
+
+            self.last_used = time.time()
+            return self.driver
+        except Exception:
+            with self._state_lock:
+                self._quit_driver()
+            self._busy.release()
+            raise
+
+    def restart(self, max_wait_time=120):
+        """
+        Replace the browser of a session the caller has acquired and is still holding, with the
+        same profile, and wait for WhatsApp Web to log in again. Returns the new driver or None.
+        """
+        with self._state_lock:
+            self._quit_driver()
+            self.restarts += 1
+            self.driver = self._driver_factory()
+            self.created_at = time.time()
+            self.driver.get(self.WHATSAPP_URL)
+        if not self.readiness.wait_for_login(self.driver, max_wait_time):
+            return None
+        self.logged_in = True
+        self.last_used = time.time()
+        return self.driver
+
+    def release(self):
+        """Hand the session back without closing the browser, so the next campaign starts on a warm session."""
+        self.last_used = time.time()
+        self._busy.release()
+
+    def shutdown(self):
+        """Close the browser, e.g. when the app window is closed."""
+        with self._state_lock:
+            self._quit_driver()
+
+    def get_state(self):
+        """Report warm/cold/busy state for the UI without touching the browser."""
+        if self._busy.locked():
+            state = "busy"
+        elif self.driver and self.logged_in:
+            state = "warm"
+        else:
+            state = "cold"
+
+        def fmt(ts):
+            return datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S') if ts else None
+
+        return {
+            "name": self.name,
+            "state": state,
+            "logged_in": self.logged_in,
+            "created_at": fmt(self.created_at),
+            "last_used": fmt(self.last_used),
+            "restarts": self.restarts
+        }
+
+
+class SessionWatchdog:
+    """
+    Keeps a running campaign on a working WhatsApp Web session. After a failed send it checks
+    whether the browser died or WhatsApp dropped the session (QR code, "Phone not connected");
+    if so it recovers the session - re-login or a browser restart with the same profile - and
+    the same contact is tried once more, unless the message may already have gone out. When that
+    is impossible the watchdog is marked lost and the caller stops, leaving the remaining
+    contacts to a resume.
+    """
+
+    SESSION_STATE_JS = """
+        if (document.querySelector('div[contenteditable="true"][data-tab="3"]')) {
+            if (document.querySelector('span[data-icon="alert-phone"], span[data-icon="alert-computer"]')) return 'offline';
+            var side = document.querySelector('#side');
+            var text = side ? (side.innerText || '').slice(0, 300) : '';
+            if (text.indexOf('Phone not connected') !== -1 || text.indexOf('Computer not connected') !== -1) return 'offline';
+            return 'ok';
+        }
+        if (document.querySelector('canvas[aria-label*="Scan"], div[data-ref] canvas, [data-testid="qrcode"]')) return 'logged_out';
+        return 'loading';
+    """
+    LOAD_GRACE = 30
+    POLL_INTERVAL = 2.0
+    LOST_MESSAGE = "WhatsApp session was lost and could not be recovered - resume the campaign from Campaign History once WhatsApp Web is back"
+
+    def __init__(self, manager, deliveries=None, login_wait=300, offline_grace=120, max_restarts=3):
+        self.manager = manager
+        self.deliveries = deliveries
+        self.driver = manager.driver
+        self.login_wait = login_wait
+        self.offline_grace = offline_grace
+        self.max_restarts = max_restarts
+        self.restarts = 0
+        self.recoveries = 0
+        self.lost = False
+
+    def state(self):
+        """'ok', 'offline', 'logged_out', 'loading', or 'dead' when the browser does not answer."""
+        try:
+            if not self.driver or not self.driver.window_handles:
+                return 'dead'
+            return self.driver.execute_script(self.SESSION_STATE_JS) or 'loading'
+        except Exception:
+            return 'dead'
+
+    def _announce(self, job, text):
+        print(f"[{self.manager.name}] {text}")
+        if job:
+            job.progress(job.processed, job.success, job.errors, text)
+
+    def _wait_until_ok(self, timeout, job=None):
+        deadline = time.time() + timeout
+        while time.time() < deadline and not (job and job.cancelled):
+            state = self.state()
+            if state == 'ok':
+                self.manager.readiness.wait_for(self.driver, "chat_list", PageReadiness.CHAT_LIST_JS)
+                return True
+            if state == 'dead':
+                return False
+            time.sleep(self.POLL_INTERVAL)
+        return False
+
+    def _restart(self, job=None):
+        if self.restarts >= self.max_restarts:
+            print(f"[{self.manager.name}] Gave up after {self.restarts} browser restarts")
+            return False
+        self.restarts += 1
+        self._announce(job, f"Browser not responding, restarting it (restart {self.restarts} of {self.max_restarts})...")
+        try:
+            driver = self.manager.restart(self.login_wait)
+        except Exception as e:
+            print(f"[{self.manager.name}] Browser restart failed: {e}")
+            return False
+        if not driver:
+            return False
+        if self.deliveries:
+            self.deliveries.handover(self.driver, driver)
+        self.driver = driver
+        return True
+
+    def check(self, job=None):
+        """
+        Probe the session and recover it when needed. Returns 'ok', 'recovered', or None when the
+        session could not be brought back (the watchdog is then lost) or the job was cancelled.
+        """
+        if self.lost:
+            return None
+        state = self.state()
+        if state == 'ok':
+            return 'ok'
+        recovered = False
+        if state != 'dead':
+            self.manager.logged_in = False
+            if state == 'logged_out':
+                self._announce(job, "WhatsApp Web logged out - scan the QR code to continue the campaign...")
+                recovered = self._wait_until_ok(self.login_wait, job)
+            else:
+                self._announce(job, "WhatsApp Web not connected, waiting for it to come back..." if state == 'offline'
+                               else "WhatsApp Web not responding, waiting for it to load...")
+                recovered = self._wait_until_ok(self.offline_grace if state == 'offline' else self.LOAD_GRACE, job)
+                if not recovered and not (job and job.cancelled) and self.state() not in ('dead', 'logged_out'):
+                    # Reload the app once before giving up on this browser
+                    try:
+                        self.driver.get(DriverManager.WHATSAPP_URL)
+                        recovered = self._wait_until_ok(self.login_wait, job)
+                    except Exception as e:
+                        print(f"[{self.manager.name}] Reload failed: {e}")
+        if not recovered and not (job and job.cancelled) and self.state() == 'dead':
+            recovered = self._restart(job)
+        if recovered:
+            self.manager.logged_in = True
+            self.recoveries += 1
+            self._announce(job, "WhatsApp session recovered, continuing from the current contact")
+            return 'recovered'
+        if not (job and job.cancelled):
+            self.lost = True
+            print(f"[{self.manager.name}] {self.LOST_MESSAGE}")
+        return None
+
+    def send(self, attempt, job=None):
+        """
+        Run attempt(driver) -> (sent, reason) on the current driver. A failure caused by a lost
+        session is recovered and the attempt repeated once on the recovered session. A failure
+        that may have happened after the message left (FailureLedger.MAYBE_SENT) is returned as
+        it is instead, so the ledger checks the chat before anything is sent again.
+        """
+        if self.lost:
+            return False, "WhatsApp session lost"
+        try:
+            sent, reason = attempt(self.driver)
+        except Exception as e:
+            sent, reason = False, f"{type(e).__name__}: {e}"
+        if sent or self.check(job) != 'recovered':
+            return sent, reason
+        if FailureLedger.classify(reason) in FailureLedger.MAYBE_SENT:
+            return sent, reason
+        try:
+            return attempt(self.driver)
+        except Exception as e:
+            return False, f"{type(e).__name__}: {e}"
+
+    def summary(self):
+        return f"{self.recoveries} session recoveries, {self.restarts} browser restarts" if self.recoveries or self.restarts else ""
+
 
 class Api:
+    # Contact files above this size are streamed in chunks instead of loaded whole
+    STREAM_THRESHOLD_BYTES = 5 * 1024 * 1024
+    STREAM_CHUNK_ROWS = 5000
+    STREAM_PREVIEW_ROWS = 20
+
     def __init__(self):
         self.window = None
         self.driver = None
-        self.bot_thread = None
+        self.readiness = PageReadiness()
+        self.driver_manager = DriverManager(self._get_driver, self.readiness)
+        self.navigator = self.driver_manager.navigator
+        self.sessions = {"default": self.driver_manager}
+        self._sessions_lock = threading.Lock()
+        self.composer = MessageComposer(self.readiness)
         
         # --- VERSION CONTROL: This is the latest version required to run the app ---
         self.LATEST_APP_VERSION = '2.0.0'
@@ -32,98 +2729,48 @@ class Api:
         app_dir.mkdir(parents=True, exist_ok=True)
         self.db_path = app_dir / 'whatsapp_data.db'
         
-        self._init_database()
-        self._init_users_database()
-
-        self.current_user = None
-
-    def _init_database(self):
-        """Initialize SQLite database for storing groups and templates."""
         print(f"--- Initializing database at: {self.db_path} ---")
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS groups (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT UNIQUE NOT NULL,
-                members TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS templates (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT UNIQUE NOT NULL,
-                content TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        self.db = Database(self.db_path)
+        self.db.migrate(MIGRATIONS)
 
-    def _init_users_database(self):
-        """Initialize users table in database."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("PRAGMA table_info(users)")
-        columns = [row[1] for row in cursor.fetchall()]
-        
-        if not columns:
-            cursor.execute('''
-                CREATE TABLE users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    password TEXT NOT NULL,
-                    role TEXT NOT NULL DEFAULT 'user',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_login TIMESTAMP
-                )
-            ''')
-        else:
-            if 'role' not in columns:
-                cursor.execute('ALTER TABLE users ADD COLUMN role TEXT NOT NULL DEFAULT "user"')
-            if 'created_at' not in columns:
-                cursor.execute('ALTER TABLE users ADD COLUMN created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP')
-            if 'last_login' not in columns:
-                cursor.execute('ALTER TABLE users ADD COLUMN last_login TIMESTAMP')
-        
-        cursor.execute('''
-            INSERT OR IGNORE INTO users (username, password, role) 
-            VALUES (?, ?, ?)
-        ''', ('admin', '123456', 'admin'))
-        
-        conn.commit()
-        conn.close()
+        # Campaigns run as background jobs so js_api calls return immediately; their
+        # progress is stored so interrupted runs can be resumed
+        self.job_store = JobStore(self.db)
+        self.job_store.mark_interrupted()
+        self.job_manager = JobManager(self._push_job_update, self.job_store)
+        self.datasets = DatasetRegistry()
+        self.phones = PhoneNormalizer(self._get_setting('default_country_code', '91'))
+        broken = self.phones.self_check()
+        if broken:
+            print(f"WARNING: phone normalization is not stable for {broken}; numbers may be re-prefixed")
+        self.number_status = NumberStatusCache(self.db)
+        self.selectors = SelectorRegistry(self.db)
+        self.forwarder = MessageForwarder(self.readiness, self.selectors)
+        self.deliveries = DeliveryTracker(self.db)
+        # One pacer per WhatsApp account, created on first use
+        self.pacers = {}
+        self._pacers_lock = threading.Lock()
+        self.media = MediaAttacher(self.readiness, self.selectors, self.composer,
+                                   ImagePreprocessor(app_dir / 'media_cache'))
+        self.courier_renderer = CourierMessageRenderer(self._get_setting('courier_header'),
+                                                       self._get_setting('courier_footer'))
+
+        self.current_user = None
 
     def authenticate_user(self, username, password):
         """Authenticate user, store session, and navigate the window."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT id, username, role FROM users 
-                WHERE username = ? AND password = ?
-            ''', (username, password))
-            
-            user = cursor.fetchone()
-            conn.close()
+            with self.db.transaction() as cursor:
+                cursor.execute('''
+                    SELECT id, username, role FROM users 
+                    WHERE username = ? AND password = ?
+                ''', (username, password))
+                user = cursor.fetchone()
+                if user:
+                    cursor.execute('UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?', (user[0],))
             
             if user:
                 self.current_user = {"id": user[0], "username": user[1], "role": user[2]}
-
-                conn_update = sqlite3.connect(self.db_path)
-                cursor_update = conn_update.cursor()
-                cursor_update.execute('''
-                    UPDATE users SET last_login = CURRENT_TIMESTAMP 
-                    WHERE id = ?
-                ''', (self.current_user['id'],))
-                conn_update.commit()
-                conn_update.close()
                 
                 role = self.current_user['role']
                 if role == 'admin':
@@ -208,16 +2855,13 @@ class Api:
 
     def get_all_users(self):
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
+            rows = self.db.query('''
                 SELECT id, username, role, created_at, last_login 
                 FROM users ORDER BY created_at DESC
             ''')
             
             users = []
-            for row in cursor.fetchall():
+            for row in rows:
                 users.append({
                     "id": row[0],
                     "username": row[1],
@@ -226,7 +2870,6 @@ class Api:
                     "last_login": row[4]
                 })
             
-            conn.close()
             return {"status": "success", "users": users}
             
         except Exception as e:
@@ -234,17 +2877,11 @@ class Api:
 
     def create_user(self, username, password, role):
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
+            self.db.execute('''
                 INSERT INTO users (username, password, role) 
                 VALUES (?, ?, ?)
             ''', (username, password, role))
             
-            conn.commit()
-            conn.close()
-            
             return {"status": "success", "message": f"User '{username}' created successfully"}
             
         except sqlite3.IntegrityError:
@@ -254,23 +2891,17 @@ class Api:
 
     def update_user(self, user_id, username, password, role):
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
             if password:
-                cursor.execute('''
+                self.db.execute('''
                     UPDATE users SET username = ?, password = ?, role = ? 
                     WHERE id = ?
                 ''', (username, password, role, user_id))
             else:
-                cursor.execute('''
+                self.db.execute('''
                     UPDATE users SET username = ?, role = ? 
                     WHERE id = ?
                 ''', (username, role, user_id))
             
-            conn.commit()
-            conn.close()
-            
             return {"status": "success", "message": f"User '{username}' updated successfully"}
             
         except sqlite3.IntegrityError:
@@ -280,18 +2911,14 @@ class Api:
 
     def delete_user(self, user_id):
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT username FROM users WHERE id = ?', (user_id,))
-            user = cursor.fetchone()
-            
-            if user and user[0] == 'admin':
-                return {"status": "error", "message": "Cannot delete the main admin user"}
-            
-            cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
-            conn.commit()
-            conn.close()
+            with self.db.transaction() as cursor:
+                cursor.execute('SELECT username FROM users WHERE id = ?', (user_id,))
+                user = cursor.fetchone()
+                
+                if user and user[0] == 'admin':
+                    return {"status": "error", "message": "Cannot delete the main admin user"}
+                
+                cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
             
             return {"status": "success", "message": "User deleted successfully"}
             
@@ -319,14 +2946,16 @@ class Api:
         except Exception as e:
             return {"status": "error", "message": f"Error handling file upload: {str(e)}"}
 
-    def _get_driver(self):
+    def _get_driver(self, profile_name=None):
         max_retries = 3
         for attempt in range(max_retries):
             try:
                 driver_path = os.path.join(os.path.dirname(__file__), 'chromedriver.exe')
                 service = Service(executable_path=driver_path)
                 options = webdriver.ChromeOptions()
-                user_data_dir = os.path.join(os.path.dirname(__file__), 'whatsapp_session')
+                # Every linked WhatsApp account gets its own Chrome profile directory
+                profile_dir = 'whatsapp_session' if profile_name in (None, 'default') else f'whatsapp_session_{profile_name}'
+                user_data_dir = os.path.join(os.path.dirname(__file__), profile_dir)
                 options.add_argument(f"user-data-dir={user_data_dir}")
                 options.add_argument("--start-maximized")
                 options.add_argument("--no-sandbox")
@@ -348,6 +2977,76 @@ class Api:
                 time.sleep(1)
         return None
 
+    def get_driver_status(self):
+        """Expose the shared WhatsApp Web session state (warm/cold/busy, last used) to the UI."""
+        return {"status": "success", "driver": self.driver_manager.get_state()}
+
+    def close_whatsapp_session(self):
+        """Close the shared browser; the next campaign will start a fresh one."""
+        try:
+            self.driver_manager.shutdown()
+            return {"status": "success", "message": "WhatsApp Web session closed"}
+        except Exception as e:
+            return {"status": "error", "message": f"Error closing session: {str(e)}"}
+
+    # Session names become Chrome profile directory names (whatsapp_session_<name>)
+    SESSION_NAME_PATTERN = r'[A-Za-z0-9_-]{1,40}'
+
+    def _check_session_names(self, session_names):
+        """Strip and validate a list of session names. Returns (names, error message or None)."""
+        names = list(dict.fromkeys(name.strip() for name in (session_names or []) if name and name.strip()))
+        bad = [name for name in names if not re.fullmatch(self.SESSION_NAME_PATTERN, name)]
+        if bad:
+            return names, (f"Invalid session name(s): {', '.join(bad)}. "
+                           "Session names may only contain letters, numbers, '-' and '_' (up to 40)")
+        return names, None
+
+    def _get_session(self, name):
+        """Return the DriverManager for a named WhatsApp account, creating it on first use."""
+        name = name or "default"
+        if not re.fullmatch(self.SESSION_NAME_PATTERN, name):
+            raise ValueError(f"Invalid session name: {name!r}")
+        with self._sessions_lock:
+            if name not in self.sessions:
+                self.sessions[name] = DriverManager(lambda: self._get_driver(name), self.readiness, name)
+            return self.sessions[name]
+
+    def get_whatsapp_sessions(self):
+        """List the linked WhatsApp accounts (one browser profile each) and their state."""
+        try:
+            rows = self.db.query('SELECT name FROM whatsapp_sessions ORDER BY name')
+            names = ["default"] + [row[0] for row in rows
+                                   if row[0] != "default" and re.fullmatch(self.SESSION_NAME_PATTERN, row[0])]
+            return {"status": "success", "sessions": [self._get_session(name).get_state() for name in names]}
+        except Exception as e:
+            return {"status": "error", "message": f"Error getting sessions: {str(e)}"}
+
+    def add_whatsapp_session(self, name):
+        """Register a named session; its profile directory is created when it first starts."""
+        name = (name or "").strip()
+        if not re.fullmatch(self.SESSION_NAME_PATTERN, name):
+            return {"status": "error", "message": "Session names may only contain letters, numbers, '-' and '_' (up to 40)"}
+        try:
+            self.db.execute('INSERT OR IGNORE INTO whatsapp_sessions (name) VALUES (?)', (name,))
+            self._get_session(name)
+            return {"status": "success", "message": f"Session '{name}' added"}
+        except Exception as e:
+            return {"status": "error", "message": f"Error adding session: {str(e)}"}
+
+    def remove_whatsapp_session(self, name):
+        """Forget a named session and close its browser. The profile directory is kept on disk."""
+        if name == "default":
+            return {"status": "error", "message": "The default session cannot be removed"}
+        try:
+            self.db.execute('DELETE FROM whatsapp_sessions WHERE name = ?', (name,))
+            with self._sessions_lock:
+                session = self.sessions.pop(name, None)
+            if session:
+                session.shutdown()
+            return {"status": "success", "message": f"Session '{name}' removed"}
+        except Exception as e:
+            return {"status": "error", "message": f"Error removing session: {str(e)}"}
+
     def get_image_file_path(self):
         """Get image file path through file dialog"""
         try:
@@ -365,26 +3064,20 @@ class Api:
             print(f"Error selecting image file: {e}")
         return None
 
-    def validate_and_prepare_image(self, image_path):
-        """Validate image file and return absolute path"""
-        if not image_path:
-            return None
-                
+    def get_image_file_paths(self):
+        """Pick one or more attachments; returns a list of absolute paths."""
         try:
-            abs_path = os.path.abspath(image_path)
-            if os.path.exists(abs_path):
-                # Check file size (WhatsApp has limits)
-                file_size = os.path.getsize(abs_path)
-                if file_size > 64 * 1024 * 1024:  # 64MB limit
-                    print(f"Warning: File too large ({file_size} bytes)")
-                    return None
-                return abs_path
-            else:
-                print(f"Image file not found: {abs_path}")
-                return None
+            file_types = ('Image Files (*.png;*.jpg;*.jpeg;*.gif;*.bmp;*.webp)', 'All files (*.*)')
+            result = self.window.create_file_dialog(webview.OPEN_DIALOG, allow_multiple=True, file_types=file_types)
+            return [os.path.abspath(path) for path in (result or []) if os.path.exists(path)]
         except Exception as e:
-            print(f"Error validating image: {e}")
-            return None
+            print(f"Error selecting image files: {e}")
+        return []
+
+    def validate_and_prepare_image(self, image_path):
+        """Validate image file and return absolute path"""
+        media = self.media.prepare(image_path)
+        return media.path if media else None
 
     def open_file_dialog(self):
         """Opens a file dialog for the user to select an image."""
@@ -444,6 +3137,160 @@ class Api:
         except Exception as e:
             return {"status": "error", "message": f"Error selecting file: {str(e)}"}
 
+    def _read_table(self, file_path, columns=None, **kwargs):
+        """
+        Read a CSV or Excel sheet as strings. When `columns` is given only those headers
+        (matched after stripping whitespace) are parsed, so wide exports stay cheap to load.
+        """
+        usecols = None
+        if columns is not None:
+            wanted = set(columns)
+            usecols = lambda column: str(column).strip() in wanted
+        if file_path.endswith('.csv'):
+            df = pd.read_csv(file_path, usecols=usecols, dtype=str, **kwargs)
+        else:
+            df = pd.read_excel(file_path, usecols=usecols, dtype=str, **kwargs)
+        df.columns = df.columns.astype(str).str.strip()
+        return df
+
+    BULK_COLUMNS = ('Name', 'Phone', 'Email', 'Message')
+
+    def _text_column(self, df, name):
+        """A column as stripped strings with blanks for missing cells (or all blanks if absent)."""
+        if name not in df.columns:
+            return pd.Series('', index=df.index)
+        return df[name].fillna('').astype(str).str.strip()
+
+    def _ingest_stats(self, label, rows, started):
+        elapsed = time.perf_counter() - started
+        rows_per_sec = int(rows / elapsed) if elapsed > 0 else rows
+        print(f"--- {label}: parsed {rows} rows in {elapsed:.2f}s ({rows_per_sec} rows/sec) ---")
+        return {"parse_time": round(elapsed, 3), "rows_per_sec": rows_per_sec}
+
+    def _iter_table_chunks(self, file_path, columns=None, chunksize=None):
+        """
+        Yield a CSV or Excel sheet as string DataFrames of at most `chunksize` rows. CSV uses
+        pandas' chunked reader and .xlsx a read-only openpyxl row iterator, so only one chunk
+        is held in memory at a time.
+        """
+        chunksize = chunksize or self.STREAM_CHUNK_ROWS
+        wanted = set(columns) if columns is not None else None
+        if file_path.endswith('.csv'):
+            usecols = (lambda column: str(column).strip() in wanted) if wanted is not None else None
+            for chunk in pd.read_csv(file_path, usecols=usecols, dtype=str, chunksize=chunksize):
+                chunk.columns = chunk.columns.astype(str).str.strip()
+                yield chunk
+            return
+
+        if not file_path.endswith('.xlsx'):
+            # Legacy .xls has no streaming reader, so it is loaded once and sliced
+            df = self._read_table(file_path, columns)
+            for start in range(0, len(df), chunksize):
+                yield df.iloc[start:start + chunksize]
+            return
+
+        from openpyxl import load_workbook
+
+        def cell_text(value):
+            if value is None:
+                return None
+            if isinstance(value, float) and value.is_integer():
+                # Phone numbers stored as numbers must not pick up a trailing ".0"
+                return str(int(value))
+            return str(value)
+
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            header = [str(h).strip() if h is not None else f"Unnamed: {i}" for i, h in enumerate(header)]
+            keep = [i for i, h in enumerate(header) if wanted is None or h in wanted]
+            names = [header[i] for i in keep]
+            buffer = []
+            for row in rows:
+                values = [cell_text(row[i]) if i < len(row) else None for i in keep]
+                if all(v is None for v in values):
+                    continue
+                buffer.append(values)
+                if len(buffer) >= chunksize:
+                    yield pd.DataFrame(buffer, columns=names)
+                    buffer = []
+            if buffer:
+                yield pd.DataFrame(buffer, columns=names)
+        finally:
+            workbook.close()
+
+    def _bulk_contacts_from_frame(self, df, first_number=1, seen=None):
+        """
+        Vectorized Name/Phone/Email/Message cleaning. Rows without a valid phone are dropped
+        and repeated numbers are collapsed onto their first row. Returns (contacts, merged
+        row count, duplicate report); `seen` carries numbers across streamed chunks.
+        """
+        phones = self.phones.normalize_series(self._text_column(df, 'Phone'))
+        row_numbers = range(first_number, first_number + len(df))
+        names = self._text_column(df, 'Name')
+        fallback_names = 'Contact ' + pd.Series(row_numbers, index=df.index).astype(str)
+        names = names.where(names != '', fallback_names)
+        emails = self._text_column(df, 'Email')
+        messages = self._text_column(df, 'Message')
+
+        valid = phones != ''
+        keep, merged, report = PhoneNormalizer.duplicates(phones[valid], pd.Series(row_numbers, index=df.index)[valid])
+        valid[valid] = keep
+        if seen is not None:
+            earlier = valid & phones.isin(seen)
+            merged += int(earlier.sum())
+            valid &= ~earlier
+            seen.update(phones[valid])
+        contacts = [
+            {
+                "name": name,
+                "phone": phone,
+                "email": email,
+                "custom_message": custom_message or None
+            }
+            for name, phone, email, custom_message in zip(
+                names[valid], phones[valid], emails[valid], messages[valid])
+        ]
+        return contacts, merged, report
+
+    def _iter_bulk_contacts(self, file_path, stats=None):
+        """Generator over a contact file's valid, de-duplicated contacts, read chunk by chunk."""
+        first_number = 1
+        seen = set()
+        for chunk in self._iter_table_chunks(file_path, columns=self.BULK_COLUMNS):
+            contacts, merged, _ = self._bulk_contacts_from_frame(chunk, first_number, seen)
+            if stats is not None:
+                stats["duplicates"] = stats.get("duplicates", 0) + merged
+            yield from contacts
+            first_number += len(chunk)
+
+    def _scan_bulk_file(self, file_path):
+        """Count a large contact file's valid contacts in bounded memory, keeping only a preview."""
+        started = time.perf_counter()
+        preview = []
+        total = 0
+        scan = {"duplicates": 0}
+        for contact in self._iter_bulk_contacts(file_path, scan):
+            if len(preview) < self.STREAM_PREVIEW_ROWS:
+                preview.append(contact)
+            total += 1
+        if not total:
+            return {"status": "error", "message": "No valid contacts found in Excel file."}
+        return {
+            "status": "success",
+            "streamed": True,
+            "contacts": preview,
+            "total": total,
+            "source": {"file_path": file_path, "total": total},
+            "duplicates_merged": scan["duplicates"],
+            "message": f"Found {total} contacts ({scan['duplicates']} duplicate numbers merged); "
+                       f"they will be streamed from the file while sending",
+            **self._ingest_stats("Bulk contacts (streamed)", total, started)
+        }
+
     def parse_bulk_excel(self, file_path):
         """Parse Excel file for bulk sender."""
         try:
@@ -454,44 +3301,25 @@ class Api:
             if not os.path.exists(file_path):
                 return {"status": "error", "message": f"File not found: {file_path}"}
             
-            # Read the Excel file
-            if file_path.endswith('.csv'):
-                df = pd.read_csv(file_path)
-            else:
-                df = pd.read_excel(file_path)            
-            # Clean column names
-            df.columns = df.columns.str.strip()
+            # Large lists stay on disk and are streamed into the send queue
+            if os.path.getsize(file_path) >= self.STREAM_THRESHOLD_BYTES:
+                return self._scan_bulk_file(file_path)
             
-            contacts = []
-            for index, row in df.iterrows():
-                try:
-                    name = str(row.get('Name', f'Contact {index + 1}')).strip()
-                    phone = str(row.get('Phone', '')).strip()
-                    email = str(row.get('Email', '')).strip()
-                    custom_message = str(row.get('Message', '')).strip()
-                    
-                    # Clean phone number
-                    phone = re.sub(r'[^\d]', '', phone)
-                    if len(phone) >= 10:
-                        contact = {
-                            "name": name,
-                            "phone": phone,
-                            "email": email,
-                            "custom_message": custom_message if custom_message and custom_message != 'nan' else None
-                        }
-                        contacts.append(contact)
-                
-                except Exception as e:
-                    print(f"Error processing row {index}: {e}")
-                    continue
+            started = time.perf_counter()
+            df = self._read_table(file_path, columns=self.BULK_COLUMNS)
+            contacts, merged, duplicates = self._bulk_contacts_from_frame(df)
             
             if not contacts:
                 return {"status": "error", "message": "No valid contacts found in Excel file."}
             
+            merged_text = f" ({merged} duplicate numbers merged)" if merged else ""
             return {
                 "status": "success",
                 "contacts": contacts,
-                "message": f"Successfully parsed {len(contacts)} contacts"
+                "duplicates_merged": merged,
+                "duplicates": duplicates,
+                "message": f"Successfully parsed {len(contacts)} contacts{merged_text}",
+                **self._ingest_stats("Bulk contacts", len(df), started)
             }
             
         except Exception as e:
@@ -502,17 +3330,11 @@ class Api:
         try:
             # --- CHANGE: Added print to confirm function is being called ---
             print(f"--- Saving template '{template_name}' to database... ---")
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
+            self.db.execute('''
                 INSERT OR REPLACE INTO templates (name, content) 
                 VALUES (?, ?)
             ''', (template_name, template_content))
             
-            conn.commit()
-            conn.close()
-            
             return {"status": "success", "message": f"Template '{template_name}' saved successfully"}
             
         except Exception as e:
@@ -521,11 +3343,7 @@ class Api:
     def get_templates(self):
         """Get all saved templates."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT id, name, content FROM templates ORDER BY name')
-            rows = cursor.fetchall()
+            rows = self.db.query('SELECT id, name, content FROM templates ORDER BY name')
             
             templates = []
             for row in rows:
@@ -535,7 +3353,6 @@ class Api:
                     "content": row[2]
                 })
             
-            conn.close()
             return {"status": "success", "templates": templates}
             
         except Exception as e:
@@ -544,79 +3361,20 @@ class Api:
     def get_template_content(self, template_id):
         """Get content of a specific template by ID."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT content FROM templates WHERE id = ?', (template_id,))
-            row = cursor.fetchone()
+            row = self.db.query_one('SELECT content FROM templates WHERE id = ?', (template_id,))
             
             if row:
-                conn.close()
-                return {"status": "success", "content": row[0]}
+                return {"status": "success", "content": row[0], "fields": MessageTemplate.compile(row[0]).fields}
             else:
-                conn.close()
                 return {"status": "error", "message": "Template not found"}
                 
         except Exception as e:
             return {"status": "error", "message": f"Error getting template content: {str(e)}"}
         
-    def create_drag_drop_script(self, file_path):
-        """Create JavaScript for drag and drop file upload"""
-        import base64
-        
-        with open(file_path, 'rb') as f:
-            file_data = f.read()
-        
-        file_b64 = base64.b64encode(file_data).decode('utf-8')
-        file_name = os.path.basename(file_path)
-        
-        script = f"""
-        async function uploadFile() {{
-            try {{
-                // Create blob from base64
-                const response = await fetch('data:image/jpeg;base64,{file_b64}');
-                const blob = await response.blob();
-                const file = new File([blob], '{file_name}', {{ type: blob.type }});
-                
-                // Find drop target (message area)
-                const dropTarget = document.querySelector('#main') || 
-                                document.querySelector('[data-testid="conversation-panel-messages"]') ||
-                                document.querySelector('div[contenteditable="true"]');
-                
-                if (!dropTarget) return 'no_target';
-                
-                // Create drag event
-                const dataTransfer = new DataTransfer();
-                dataTransfer.items.add(file);
-                
-                const dragEvent = new DragEvent('drop', {{
-                    dataTransfer: dataTransfer,
-                    bubbles: true,
-                    cancelable: true
-                }});
-                
-                // Dispatch the event
-                dropTarget.dispatchEvent(dragEvent);
-                
-                return 'success';
-            }} catch (error) {{
-                return 'error: ' + error.message;
-            }}
-        }}
-        
-        return uploadFile();
-        """
-        return script
-
     def delete_template(self, template_id):
         """Delete a template."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('DELETE FROM templates WHERE id = ?', (template_id,))
-            conn.commit()
-            conn.close()
+            self.db.execute('DELETE FROM templates WHERE id = ?', (template_id,))
             
             return {"status": "success", "message": "Template deleted successfully"}
             
@@ -627,92 +3385,44 @@ class Api:
         """Send message to a WhatsApp group."""
         driver = None
         try:
-            driver = self._get_driver()
-            wait = WebDriverWait(driver, 45)
-            driver.get("https://web.whatsapp.com")
-            
-            print("Waiting for WhatsApp Web to load...")
-            
-            # Wait for login
-            login_successful = False
-            max_wait_time = 120
-            check_interval = 5
-            
-            for i in range(max_wait_time // check_interval):
-                try:
-                    search_elements = driver.find_elements(By.XPATH, '//div[@contenteditable="true"][@data-tab="3"]')
-                    if search_elements:
-                        login_successful = True
-                        break
-                    time.sleep(check_interval)
-                except Exception as e:
-                    time.sleep(check_interval)
-            
-            if not login_successful:
+            driver = self.driver_manager.acquire()
+            if not driver:
                 return {"status": "error", "message": "Login timeout - please make sure you're logged into WhatsApp Web"}
-            
-            time.sleep(2) # CHANGE 1
-            
+            wait = WebDriverWait(driver, 45)
+
             # Search for the group
             search_box = wait.until(EC.element_to_be_clickable((By.XPATH, '//div[@contenteditable="true"][@data-tab="3"]')))
             search_box.clear()
             search_box.send_keys(group_name)
-            time.sleep(3)
             
             # Click on the group
             try:
                 group_element = wait.until(EC.element_to_be_clickable((By.XPATH, f"//span[@title='{group_name}']")))
                 group_element.click()
-                time.sleep(3)
             except:
                 return {"status": "error", "message": f"Group '{group_name}' not found"}
+
+            if not self.readiness.wait_for_compose_box(driver):
+                return {"status": "error", "message": f"Chat for group '{group_name}' did not load"}
             
             # Send image if provided
-            if image_path and os.path.exists(image_path):
-                try:
-                    # Click attachment button
-                    clip_button = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "span[data-testid='clip']")))
-                    clip_button.click()
-                    time.sleep(2)
-                    
-                    # Upload image
-                    file_input = wait.until(EC.presence_of_element_located((By.XPATH, "//input[@accept='image/*,video/mp4,video/3gpp,video/quicktime']")))
-                    file_input.send_keys(image_path)
-                    time.sleep(5)
-                    
-                    # Add caption if message provided
-                    if message:
-                        try:
-                            caption_box = driver.find_element(By.XPATH, "//div[@contenteditable='true'][@data-tab='10']")
-                            caption_box.send_keys(message)
-                        except:
-                            pass
-                    
-                    # Send
-                    send_button = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "span[data-testid='send']")))
-                    send_button.click()
-                    time.sleep(3)
-                    
-                except Exception as img_error:
-                    print(f"Error sending image: {img_error}")
-                    # Continue to send text message if image fails
+            media = self.media.prepare(image_path) if image_path else None
+            if media:
+                sent_before = self.readiness.outgoing_count(driver)
+                image_result = self.media.send(driver, media, message or "")
+                if image_result["status"] == "success":
+                    self.readiness.wait_for_message_tick(driver, sent_before)
+                else:
+                    print(f"Error sending image: {image_result['message']}")
             
             # Send text message if provided and no image was sent
             if message and not image_path:
                 message_box = wait.until(EC.element_to_be_clickable((By.XPATH, '//div[@contenteditable="true"][@data-tab="10"]')))
-                message_box.click()
-                time.sleep(0.3) # CHANGE 1
-                
-                # Type message line by line
-                message_lines = message.split('\n')
-                for i, line in enumerate(message_lines):
-                    if line.strip():
-                        message_box.send_keys(line)
-                    if i < len(message_lines) - 1:
-                        message_box.send_keys(Keys.SHIFT + Keys.ENTER)
+                self.composer.compose(driver, message_box, message)
                 
-                time.sleep(2)
+                sent_before = self.readiness.outgoing_count(driver)
                 message_box.send_keys(Keys.ENTER)
+                self.readiness.wait_for_message_tick(driver, sent_before)
             
             return {"status": "success", "message": f"Message sent to group '{group_name}' successfully"}
             
@@ -720,165 +3430,211 @@ class Api:
             return {"status": "error", "message": f"Error sending to group: {str(e)}"}
         finally:
             if driver:
-                try:
-                    time.sleep(3)
-                    driver.quit()
-                except:
-                    pass
+                self.driver_manager.release()
 
     def parse_excel_file(self, file_path):
-        """Parse Excel file to extract all courier and customer data from multiple rows."""
-        try:
-            # Read the Excel file
-            if file_path.endswith('.csv'):
-                df = pd.read_csv(file_path)
-            else:
-                df = pd.read_excel(file_path)
-            
-            # Clean column names - remove extra spaces
-            df.columns = df.columns.str.strip()
-            
-            # Print column names for debugging
-            print("Available columns:", list(df.columns))
-            
-            all_courier_data = []
-            all_customers = []
-            
-            # Process each row in the Excel file
-            for index, row in df.iterrows():
-                try:
-                    # Fix date format (remove time component)
-                    date_value = str(row.get('Date', '')).strip()
-                    if date_value and date_value != 'nan':
-                        try:
-                            # If it's a pandas datetime, format it properly
-                            if 'Timestamp' in str(type(row.get('Date'))):
-                                formatted_date = row.get('Date').strftime('%d-%b-%Y')
-                            else:
-                                # Handle string dates - remove time if present
-                                date_only = date_value.split(' ')[0]  # Take only date part
-                                formatted_date = date_only
-                        except:
-                            formatted_date = date_value
-                    else:
-                        formatted_date = ''
-                    
-                    # Extract courier data from current row with improved column matching
-                    docket_value = str(row.get('Docket No', row.get('Docket No.', ''))).strip()
-                    
-                    courier_data = {
-                        "date": formatted_date,
-                        "challan_no": str(row.get('Challan No', '')).strip(),
-                        "customer_code": str(row.get('Customer Code', '')).strip(),
-                        "customer_name": str(row.get('Customer', '')).strip(),
-                        "customer_location": str(row.get('Location', '')).strip(),
-                        "courier_name": str(row.get('Courier Name', '')).strip(),
-                        "docket_no": docket_value,
-                        "courier_link": str(row.get('Courier Link', '')).strip(),
-                        "no_of_boxes": str(row.get('No. of boxes', '')).strip(),
-                        "shipment_type": str(row.get('Shipment', row.get('Shipment Type', 'Complete'))).strip(),
-                        "items": []
-                    }
-                    
-                    # Debug prints
-                    print(f"Row {index} - Docket No column value: '{docket_value}'")
-                    print(f"Row {index} - Customer: '{courier_data['customer_name']}'")
-                    print(f"Row {index} - Date processed: '{formatted_date}'")
-                    
-                    # Extract items with their quantities from the row
-                    item_columns = {
-                        "13X17 Blue Base Film ACC-91": "13X17 Blue Base Film ACC-91",
-                        "8X10 Blue Base Film ACC-91": "8X10 Blue Base Film ACC-91", 
-                        "Accurate Paper ACC-41 A4": "Accurate Paper ACC-41 A4",
-                        "Accurate Paper ACC-61 A4": "Accurate Paper ACC-61 A4",
-                        "Accurate Paper ACC-61 A5": "Accurate Paper ACC-61 A5",
-                        "White Instant Film-ACC-81 - A3": "White Instant Film-ACC-81 - A3",
-                        "White Instant Film-ACC-81 - A4": "White Instant Film-ACC-81 - A4",
-                        "BLACK Ink-81": "BLACK Ink-81",
-                        "CYAN Ink-81": "CYAN Ink-81",
-                        "LIGHT CYAN Ink-81": "LIGHT CYAN Ink-81",
-                        "LIGHT MAGENTA-Ink-81": "LIGHT MAGENTA-Ink-81",
-                        "MAGENTA Ink-81": "MAGENTA Ink-81",
-                        "YELLOW Ink-81": "YELLOW Ink-81",
-                        "Maintanace box": "Maintanace box"
-                    }
-                    
-                    # Add items with their quantities
-                    for item_name, column_name in item_columns.items():
-                        try:
-                            quantity = row.get(column_name, 0)
-                            if pd.notna(quantity) and str(quantity).strip():
-                                # Handle different quantity formats
-                                if isinstance(quantity, str) and 'Grm' in quantity:
-                                    qty_val = int(re.sub(r'[^\d]', '', quantity.split('Grm')[0]))
-                                    unit = 'Grm'
-                                else:
-                                    qty_val = int(float(str(quantity))) if str(quantity).replace('.', '').isdigit() else 0
-                                    unit = 'Grm' if 'Ink' in item_name else ''
-                                
-                                courier_data["items"].append({
-                                    "name": item_name,
-                                    "quantity": qty_val,
-                                    "unit": unit
-                                })
-                            else:
-                                # Add item with 0 quantity to maintain structure
-                                courier_data["items"].append({
-                                    "name": item_name,
-                                    "quantity": 0,
-                                    "unit": 'Grm' if 'Ink' in item_name else ''
-                                })
-                        except (ValueError, TypeError) as e:
-                            print(f"Error processing item {item_name}: {e}")
-                            courier_data["items"].append({
-                                "name": item_name,
-                                "quantity": 0,
-                                "unit": 'Grm' if 'Ink' in item_name else ''
-                            })
-                    
-                    all_courier_data.append(courier_data)
-                    
-                    # Extract customer data from mobile number column
-                    mobile_numbers = str(row.get('Mobile No.', row.get('Mobile No', ''))).strip()
-                    customer_name = courier_data["customer_name"]
-                    customer_location = courier_data["customer_location"]
-                    
-                    if mobile_numbers and mobile_numbers != 'nan':
-                        # Split multiple numbers if they exist (comma separated)
-                        numbers = [num.strip() for num in mobile_numbers.split(',') if num.strip()]
-                        
-                        for i, number in enumerate(numbers):
-                            # Clean the number
-                            clean_number = re.sub(r'[^\d]', '', number)
-                            if len(clean_number) >= 10:
-                                # Use actual customer name instead of generic "Customer X"
-                                customer_display_name = customer_name if customer_name and customer_name != 'nan' else f"Customer {len(all_customers) + 1}"
-                                
-                                customer = {
-                                    "name": customer_display_name,
-                                    "mobile": clean_number,
-                                    "address": customer_location,
-                                    "email": f"{customer_display_name.lower().replace(' ', '.')}@example.com",
-                                    "row_index": index,
-                                    "courier_data": courier_data  # Link customer to their courier data
-                                }
-                                all_customers.append(customer)
-                    
-                except Exception as e:
-                    print(f"Error processing row {index}: {e}")
-                    continue
-            
-            if not all_customers:
+        """Parse a courier sheet into a server-side dataset and return a summary for the page."""
+        result = self._parse_courier_sheet(file_path)
+        if result["status"] != "success":
+            return result
+        dataset = self._add_courier_dataset(result, file_path)
+        sample = result["sample"]
+        return {
+            "status": "success",
+            "dataset": DatasetRegistry.describe(dataset),
+            "total_customers": dataset["total"],
+            "total_courier_entries": result["courier_entries"],
+            "total_items": result["total_items"],
+            "duplicates_merged": result["duplicates_merged"],
+            "unmatched_columns": result.get("unmatched_columns", []),
+            "sample": {"challan_no": sample.get("challan_no", ""), "customer_name": sample.get("customer_name", "")},
+            "preview": DatasetRegistry.page_rows(dataset["rows"], 0, 50)
+        }
+
+    def _add_courier_dataset(self, result, file_path, handle=None):
+        return self.datasets.add("courier", result["customer_data"], columns=["name", "mobile", "address"],
+                                 file_path=file_path, handle=handle, total=result["total"], streamed=result["streamed"])
+
+    def _courier_schema(self):
+        rows = self.db.query('SELECT name, kind, aliases, unit FROM courier_columns ORDER BY position, name')
+        return CourierSheetSchema([{"name": r[0], "kind": r[1], "aliases": json.loads(r[2]), "unit": r[3]}
+                                   for r in rows])
+
+    def _courier_quantities(self, raw, default_unit):
+        """Vectorized quantity/unit parsing: '250 Grm' -> (250, 'Grm'), '3' / '3.0' -> 3, anything else -> 0."""
+        is_grm = raw.str.contains('Grm', regex=False)
+        grm_qty = pd.to_numeric(raw.str.split('Grm').str[0].str.replace(r'\D', '', regex=True), errors='coerce')
+        plain = raw.where(raw.str.replace('.', '', regex=False).str.isdigit())
+        quantity = pd.to_numeric(plain, errors='coerce').where(~is_grm, grm_qty).fillna(0).astype(int)
+        unit = pd.Series(default_unit, index=raw.index).where(~is_grm, 'Grm')
+        return quantity, unit
+
+    def _courier_rows_from_frame(self, df, fields, items, seen, customer_offset=0):
+        """
+        Vectorized courier rows for one chunk of a sheet whose index holds sheet row positions.
+        Returns (courier data, customers, merged duplicate count, duplicate report); `seen`
+        carries (number, challan) keys across chunks.
+        """
+        text = {name: self._text_column(df, fields.get(name, '')) for name in CourierSheetSchema.FIELDS}
+
+        # Excel dates arrive as 'YYYY-MM-DD HH:MM:SS'; show them as 05-Jan-2025, other text keeps its date part
+        parsed_dates = pd.to_datetime(text['date'], format='%Y-%m-%d %H:%M:%S', errors='coerce')
+        dates = parsed_dates.dt.strftime('%d-%b-%Y').where(parsed_dates.notna(), text['date'].str.split(' ').str[0])
+        shipment = text['shipment_type'].where(text['shipment_type'] != '', 'Complete') \
+            if 'shipment_type' in fields else pd.Series('Complete', index=df.index)
+
+        # Only products actually shipped on a row are materialised
+        items_by_row = [[] for _ in range(len(df))]
+        for item_name, header, default_unit in items:
+            quantity, unit = self._courier_quantities(self._text_column(df, header), default_unit)
+            shipped = (quantity > 0).to_numpy().nonzero()[0]
+            for position, qty, item_unit in zip(shipped, quantity.iloc[shipped], unit.iloc[shipped]):
+                items_by_row[position].append({"name": item_name, "quantity": int(qty), "unit": item_unit})
+
+        courier_rows = [
+            {
+                "date": date,
+                "challan_no": challan_no,
+                "customer_code": customer_code,
+                "customer_name": customer_name,
+                "customer_location": location,
+                "courier_name": courier_name,
+                "docket_no": docket_no,
+                "courier_link": courier_link,
+                "no_of_boxes": boxes,
+                "shipment_type": shipment_type,
+                "items": row_items
+            }
+            for date, challan_no, customer_code, customer_name, location, courier_name, docket_no, courier_link,
+                boxes, shipment_type, row_items in zip(
+                dates, text['challan_no'], text['customer_code'], text['customer_name'], text['customer_location'],
+                text['courier_name'], text['docket_no'], text['courier_link'], text['no_of_boxes'], shipment,
+                items_by_row)
+        ]
+
+        # One customer per valid number; a cell may hold several comma separated numbers
+        numbers = self.phones.normalize_series(text['mobile'].str.split(',').explode())
+        numbers = numbers[numbers != '']
+        # A number listed twice for the same challan would get the same message twice
+        keys = numbers + '|' + text['challan_no'].reindex(numbers.index)
+        keep, merged, duplicates = PhoneNormalizer.duplicates(keys, numbers.index + 2)
+        earlier = keep & keys.isin(seen)
+        merged += int(earlier.sum())
+        keep &= ~earlier
+        seen.update(keys[keep])
+        numbers = numbers[keep]
+        positions = df.index.get_indexer(numbers.index)
+        customers = []
+        for position, row_index, clean_number in zip(positions, numbers.index, numbers):
+            courier_data = courier_rows[position]
+            customer_name = courier_data["customer_name"]
+            # Use actual customer name instead of generic "Customer X"
+            customer_display_name = customer_name or f"Customer {customer_offset + len(customers) + 1}"
+            customers.append({
+                "name": customer_display_name,
+                "mobile": clean_number,
+                "address": courier_data["customer_location"],
+                "email": f"{customer_display_name.lower().replace(' ', '.')}@example.com",
+                "row_index": int(row_index),
+                "courier_data": courier_data  # Link customer to their courier data
+            })
+        return courier_rows, customers, merged, duplicates
+
+    def _iter_courier_sheet(self, file_path, stats=None):
+        """
+        Generator over a courier sheet's customers (one per valid number, each linked to its
+        courier entry), read chunk by chunk. `stats` collects the matched columns, courier
+        entry, product and row counts and the merged duplicates as the sheet is read.
+        """
+        stats = stats if stats is not None else {}
+        stats.update(rows=0, courier_entries=0, items=0, customers=0, duplicates_merged=0, duplicates=[], sample=None)
+        seen = set()
+        fields = items = None
+        for chunk in self._iter_table_chunks(file_path):
+            if fields is None:
+                fields, items, stats["unmatched_columns"] = self._courier_schema().match(chunk.columns)
+                print(f"Courier columns matched: {fields}; {len(items)} products; unmatched: {stats['unmatched_columns']}")
+                if 'mobile' not in fields:
+                    raise ValueError("No mobile number column found. Please check the Mobile No. column header.")
+            chunk.index = pd.RangeIndex(stats["rows"], stats["rows"] + len(chunk))
+            courier_rows, customers, merged, duplicates = self._courier_rows_from_frame(
+                chunk, fields, items, seen, stats["customers"])
+            stats["rows"] += len(chunk)
+            stats["courier_entries"] += len(courier_rows)
+            stats["items"] += sum(1 for entry in courier_rows for item in entry["items"] if item["quantity"] > 0)
+            stats["customers"] += len(customers)
+            stats["duplicates_merged"] += merged
+            stats["duplicates"] += duplicates[:max(0, 100 - len(stats["duplicates"]))]
+            if stats["sample"] is None and courier_rows:
+                stats["sample"] = {"challan_no": courier_rows[0]["challan_no"], "customer_name": courier_rows[0]["customer_name"]}
+            yield from customers
+
+    def _parse_courier_sheet(self, file_path):
+        """
+        Read a courier sheet chunk by chunk. Small sheets keep every customer in memory; large
+        ones keep only a preview and are streamed from the file again when sent or paged.
+        """
+        try:
+            started = time.perf_counter()
+            streamed = os.path.getsize(file_path) >= self.STREAM_THRESHOLD_BYTES
+            stats, customers = {}, []
+            for customer in self._iter_courier_sheet(file_path, stats):
+                if not streamed or len(customers) < self.STREAM_PREVIEW_ROWS:
+                    customers.append(customer)
+            
+            if not customers:
                 return {"status": "error", "message": "No valid customers found in Excel file. Please check Mobile No. column format."}
             
             return {
                 "status": "success",
-                "courier_data": all_courier_data,
-                "customer_data": all_customers
+                "customer_data": customers,
+                "total": stats["customers"],
+                "streamed": streamed,
+                "courier_entries": stats["courier_entries"],
+                "total_items": stats["items"],
+                "sample": stats["sample"] or {},
+                "unmatched_columns": stats["unmatched_columns"],
+                "duplicates_merged": stats["duplicates_merged"],
+                "duplicates": stats["duplicates"],
+                **self._ingest_stats("Courier sheet" + (" (streamed)" if streamed else ""), stats["rows"], started)
             }
             
         except Exception as e:
             return {"status": "error", "message": f"Error parsing Excel file: {str(e)}"}
+
+    def get_courier_schema(self):
+        """List the header mappings and products the courier parser recognises."""
+        try:
+            return {"status": "success", "columns": self._courier_schema().columns}
+        except Exception as e:
+            return {"status": "error", "message": f"Error getting courier columns: {str(e)}"}
+
+    def save_courier_column(self, name, kind='item', aliases=None, unit=''):
+        """Add or update a product (kind 'item') or the aliases of a courier field."""
+        name = (name or '').strip()
+        if not name:
+            return {"status": "error", "message": "Column name is required"}
+        if kind not in ('item', 'field'):
+            return {"status": "error", "message": "Column kind must be 'item' or 'field'"}
+        if kind == 'field' and name not in CourierSheetSchema.FIELDS:
+            return {"status": "error", "message": f"Unknown courier field '{name}'"}
+        try:
+            aliases = [a.strip() for a in (aliases or []) if a and a.strip()]
+            self.db.execute('''
+                INSERT INTO courier_columns (name, kind, aliases, unit, position)
+                VALUES (?, ?, ?, ?, (SELECT COALESCE(MAX(position), 0) + 1 FROM courier_columns))
+                ON CONFLICT(name) DO UPDATE SET kind = excluded.kind, aliases = excluded.aliases, unit = excluded.unit
+            ''', (name, kind, json.dumps(aliases), unit or ''))
+            return {"status": "success", "message": f"Courier column '{name}' saved"}
+        except Exception as e:
+            return {"status": "error", "message": f"Error saving courier column: {str(e)}"}
+
+    def delete_courier_column(self, name):
+        try:
+            self.db.execute("DELETE FROM courier_columns WHERE name = ? AND kind = 'item'", (name,))
+            return {"status": "success", "message": f"Product '{name}' removed"}
+        except Exception as e:
+            return {"status": "error", "message": f"Error removing courier column: {str(e)}"}
         
     
     def parse_courier_files(self, file_data=None):
@@ -922,100 +3678,327 @@ class Api:
             return {"status": "error", "message": f"Error parsing files: {str(e)}"}
 
     def format_courier_message(self, courier_data, customer):
-        message_parts = []
-        
-        # Header
-        message_parts.append("Greeting from *Accurate Medical Print Solutions*")
-        message_parts.append("")
-        message_parts.append("*COURIER DISPATCH NOTIFICATION*")
-        message_parts.append("=" * 25)
-        
-        # Customer details
-        message_parts.append(f"*Challan No:* {courier_data['challan_no']}")
-        message_parts.append(f"*Date:* {courier_data['date']}")
-        message_parts.append(f"*Customer:* {customer['name']}")
-        message_parts.append(f"*Delivery Location:* {customer['address']}")
-        
-        message_parts.append("")
-        
-        # Courier details
-        message_parts.append("*COURIER DETAILS*")
-        message_parts.append("-" * 20)
-        message_parts.append(f"*Courier:* {courier_data['courier_name']}")
-        message_parts.append(f"*Docket No:* `{courier_data['docket_no']}`")
-        message_parts.append(f"*No. of Boxes:* {courier_data['no_of_boxes']}")
-        message_parts.append(f"*Track at:* {courier_data['courier_link']}")
-        
-        message_parts.append("")
-        
-        # Items shipped (only non-zero quantities with bold quantities and units)
-        message_parts.append("*ITEMS SHIPPED*")
-        message_parts.append("-" * 15)
-        
-        item_count = 0
-        for item in courier_data['items']:
-            if item['quantity'] > 0:
-                item_count += 1
-                # Make both quantity and unit bold using WhatsApp formatting
-                unit_text = f" *{item['unit']}*" if item['unit'] else ""
-                message_parts.append(f"• {item['name']}: *{item['quantity']}*{unit_text}")
-        
-        if item_count == 0:
-            message_parts.append("• No items with specified quantities")
-        
-        message_parts.append("")
-        # Add shipment type AFTER the items list
-        shipment_type = courier_data.get('shipment_type', 'Complete')
-        message_parts.append(f"*Shipment Type:* {shipment_type}")
-        
-        message_parts.append("")
-        message_parts.append("*Your order has been dispatched successfully!*")
-        message_parts.append("")
-        message_parts.append("For any queries, contact us on 8108100404 or email us on logistics@accuratemedical.in")
-        
-        return "\n".join(message_parts)
+        return self.courier_renderer.render(courier_data, customer)
+
+    def _get_setting(self, key, default=None):
+        row = self.db.query_one('SELECT value FROM app_settings WHERE key = ?', (key,))
+        return row[0] if row else default
+
+    def _set_setting(self, key, value):
+        self.db.execute('''
+            INSERT INTO app_settings (key, value) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = CURRENT_TIMESTAMP
+        ''', (key, value))
+
+    def get_courier_message_settings(self):
+        return {
+            "status": "success",
+            "header": self.courier_renderer.header.text,
+            "footer": self.courier_renderer.footer.text
+        }
+
+    def save_courier_message_settings(self, header, footer):
+        """Save the company header/footer used in courier notifications."""
+        try:
+            errors = MessageTemplate.compile(header).errors + MessageTemplate.compile(footer).errors
+            if errors:
+                return {"status": "error", "message": "; ".join(errors)}
+            with self.db.transaction():
+                self._set_setting('courier_header', header)
+                self._set_setting('courier_footer', footer)
+            self.courier_renderer.configure(header, footer)
+            return {"status": "success", "message": "Courier message header and footer saved"}
+        except Exception as e:
+            return {"status": "error", "message": f"Error saving courier settings: {str(e)}"}
+
+    def benchmark_courier_rendering(self, rows=10000, challans=500):
+        """
+        Render a synthetic dispatch sheet of `rows` customers spread over `challans` challans,
+        once rebuilding every message and once through the per-challan cache.
+        """
+        items = [{"name": f"Item {i}", "quantity": i % 3, "unit": "Grm" if i % 2 else ""} for i in range(14)]
+        entries = [{"date": "01-Jan-2025", "challan_no": f"CH{n}", "customer_code": "", "customer_name": f"Customer {n}",
+                    "customer_location": "City", "courier_name": "Courier", "docket_no": f"D{n}",
+                    "courier_link": "https://example.com/track", "no_of_boxes": "2", "shipment_type": "Complete",
+                    "items": items} for n in range(challans)]
+        customers = [{"name": f"Customer {i}", "address": "City", "courier_data": entries[i % challans]}
+                     for i in range(rows)]
+
+        uncached = CourierMessageRenderer(self.courier_renderer.header.text, self.courier_renderer.footer.text)
+        rendered = []
+        started = time.perf_counter()
+        for customer in customers:
+            prefix, suffix = uncached._challan_parts(customer["courier_data"])
+            rendered.append(f"{prefix}\n*Customer:* {customer['name']}\n*Delivery Location:* {customer['address']}\n{suffix}")
+        uncached_time = time.perf_counter() - started
+
+        cached = CourierMessageRenderer(self.courier_renderer.header.text, self.courier_renderer.footer.text)
+        started = time.perf_counter()
+        rendered_cached = [cached.render(customer["courier_data"], customer) for customer in customers]
+        cached_time = time.perf_counter() - started
+        if rendered_cached != rendered:
+            return {"status": "error", "message": "Cached rendering does not match the uncached messages"}
+
+        result = {
+            "status": "success",
+            "rows": rows,
+            "challans": challans,
+            "uncached_per_sec": int(rows / uncached_time) if uncached_time else rows,
+            "cached_per_sec": int(rows / cached_time) if cached_time else rows,
+            "cache": dict(cached.stats)
+        }
+        print(f"--- Courier render benchmark: {result} ---")
+        return result
+
+    def _open_chat(self, driver, navigator, mobile, chat_name=None, source='send'):
+        """
+        navigator.open_chat behind the number status cache: returns 'cached-invalid' without
+        navigating for numbers already known to be invalid, and records what a navigation found.
+        """
+        status = self.number_status.lookup(mobile)
+        if status == 'invalid':
+            self.number_status.count_saved()
+            return 'cached-invalid'
+        # Only numbers that opened before can have a chat for the sidebar search to find
+        state = navigator.open_chat(driver, mobile, chat_name, known_chat=status == 'valid')
+        try:
+            self.number_status.record(mobile, {'ready': 'valid', 'invalid': 'invalid'}.get(state, 'unknown'), source)
+        except Exception as e:
+            print(f"Could not record number status for {mobile}: {e}")
+        return state
+
+    def _pacer(self, session_name="default"):
+        with self._pacers_lock:
+            pacer = self.pacers.get(session_name)
+            if pacer is None:
+                pacer = self.pacers[session_name] = SendPacer(int(self._get_setting('messages_per_minute', '20')))
+            return pacer
+
+    def _paced_send(self, pacer, job, driver, send, *args, item_key=None, recipient=None):
+        """
+        Run one send through the pacer: wait for a token, time the send and feed the outcome back.
+        With an item_key, a sent message is handed to the delivery tracker.
+        """
+        pacer.acquire(job=job)
+        started = time.time()
+        try:
+            sent, reason = send(*args)
+        except Exception as e:
+            pacer.report(driver, False, str(e))
+            raise
+        pacer.report(driver, sent, reason, time.time() - started)
+        if job and item_key is not None:
+            if sent:
+                self.deliveries.track(driver, job, item_key, recipient)
+            self.deliveries.poll(driver)
+        return sent, reason
+
+    def _text_attempt(self, pacer, job, navigator, mobile, text, chat_name=None, item_key=None):
+        """One paced text send as a function of the driver, so SessionWatchdog can repeat it on a recovered browser."""
+        return lambda driver: self._paced_send(pacer, job, driver, self._send_text_message, driver, navigator, mobile, text,
+                                               chat_name, item_key=item_key, recipient=mobile)
+
+    def _bulk_attempt(self, pacer, job, navigator, mobile, final_message, media, chat_name=None, item_key=None):
+        """Like _text_attempt, for a Bulk Sender contact (attachments and/or text)."""
+        return lambda driver: self._paced_send(pacer, job, driver, self._send_bulk_contact, driver, WebDriverWait(driver, 45),
+                                               navigator, mobile, final_message, media, chat_name,
+                                               item_key=item_key, recipient=mobile)
+
+    def _sent_checker(self, watchdog, navigator):
+        """FailureLedger already_sent function: reopen the chat and look at its last outgoing bubble."""
+        def already_sent(payload):
+            mobile, text, chat_name = payload
+            if self._open_chat(watchdog.driver, navigator, mobile, chat_name) != 'ready':
+                return False
+            return self.readiness.last_outgoing_matches(watchdog.driver, text)
+        return already_sent
+
+    def _text_resender(self, pacer, job, watchdog, navigator):
+        """FailureLedger retry function for text sends queued with a (mobile, text, chat_name) payload."""
+        def resend(item_key, recipient, payload):
+            mobile, text, chat_name = payload
+            return watchdog.send(self._text_attempt(pacer, job, navigator, mobile, text, chat_name, item_key), job)
+        return resend
+
+    def _finish_run(self, watchdog, navigator, job, ledger, resend):
+        """
+        End-of-run bookkeeping shared by the senders: the ledger's retry rounds for transient
+        failures (checking the chat first for possibly-sent ones), then settling messages still
+        pending. Returns how many sends moved from failed to sent, negative when more were
+        written off than recovered. On a lost session nothing is retried and whatever is
+        pending is written off.
+        """
+        recovered = 0
+        if not watchdog.lost:
+            recovered = ledger.retry(resend, self._sent_checker(watchdog, navigator))
+        # Only messages that left the pending state count as sent
+        unsent = self._settle_deliveries(watchdog.driver, None if watchdog.lost else navigator, job, ledger,
+                                         session_lost=watchdog.lost)
+        return recovered - unsent
+
+    @staticmethod
+    def _lost_result(job, success_count, error_count, ledger):
+        if job:
+            job.progress(job.processed, success_count, error_count)
+        return {"status": "error", "message": f"{SessionWatchdog.LOST_MESSAGE}. Sent so far: {success_count}, Errors: {error_count}.",
+                "failures": ledger.breakdown()}
+
+    def _settle_deliveries(self, driver, navigator, job, ledger=None, session_lost=False):
+        """
+        Wait for messages still pending at the end of a run. Those that never left the clock are
+        marked 'unsent' and listed among the failed recipients for review. They are not sent again
+        by a resume: WhatsApp Web may still deliver them. Returns how many there were. On a lost
+        session nothing can be read, so whatever is still pending counts as unsent right away.
+        """
+        if not job:
+            return 0
+        unsent = self.deliveries.abandon(driver) if session_lost else self.deliveries.settle(driver, navigator)
+        for entry in unsent:
+            print(f"Message to {entry['recipient']} never left the pending state")
+            job.mark_unconfirmed(entry["item_key"], entry["recipient"], "stuck pending, not sent")
+            if ledger:
+                ledger.fail(entry["item_key"], entry["recipient"], "stuck pending, not sent")
+        return len(unsent)
+
+    def get_dead_letters(self, job_id=None, limit=500):
+        """Recipients that could not be reached, newest first, optionally for one campaign."""
+        try:
+            where, params = ("WHERE job_id = ?", (job_id,)) if job_id else ("", ())
+            rows = self.db.query(f'''
+                SELECT job_id, item_key, recipient, category, reason, attempts, message, created_at
+                FROM dead_letters {where} ORDER BY created_at DESC LIMIT ?
+            ''', params + (limit,))
+            keys = ("job_id", "item_key", "recipient", "category", "reason", "attempts", "message", "created_at")
+            return {"status": "success", "dead_letters": [dict(zip(keys, row)) for row in rows]}
+        except Exception as e:
+            return {"status": "error", "message": f"Error loading failed recipients: {str(e)}"}
+
+    def export_dead_letters(self, job_id=None):
+        """Write the dead-letter list to an Excel file in Downloads, ready to fix and re-import."""
+        try:
+            where, params = ("WHERE job_id = ?", (job_id,)) if job_id else ("", ())
+            rows = self.db.query(f'''
+                SELECT recipient, category, reason, attempts, message, job_id, created_at
+                FROM dead_letters {where} ORDER BY job_id, created_at
+            ''', params)
+            if not rows:
+                return {"status": "error", "message": "No failed recipients to export"}
+            labels = {category: label for category, (label, _) in FailureLedger.CATEGORIES.items()}
+            df = pd.DataFrame([(r[0], labels.get(r[1], r[1]), r[2], r[3], r[4], r[5], r[6]) for r in rows],
+                              columns=['Phone', 'Failure', 'Reason', 'Attempts', 'Message', 'Campaign', 'Failed At'])
 
-    def send_courier_notifications(self, courier_data_list, customer_data):
+            downloads_path = os.path.expanduser("~/Downloads")
+            if not os.path.exists(downloads_path):
+                downloads_path = os.path.dirname(__file__)
+            export_path = os.path.join(downloads_path, f"failed_recipients_{job_id or 'all'}.xlsx")
+            df.to_excel(export_path, index=False)
+            return {"status": "success", "message": f"{len(rows)} failed recipients exported to: {export_path}",
+                    "path": export_path}
+        except Exception as e:
+            return {"status": "error", "message": f"Error exporting failed recipients: {str(e)}"}
+
+    def clear_dead_letters(self, job_id=None):
+        try:
+            if job_id:
+                self.db.execute('DELETE FROM dead_letters WHERE job_id = ?', (job_id,))
+            else:
+                self.db.execute('DELETE FROM dead_letters')
+            return {"status": "success", "message": "Failed recipient list cleared"}
+        except Exception as e:
+            return {"status": "error", "message": f"Error clearing failed recipients: {str(e)}"}
+
+    def get_delivery_report(self, job_id):
+        """Final delivery state counts for a campaign (pending/sent/delivered/read/unsent)."""
+        try:
+            return {"status": "success", "deliveries": self.deliveries.summary(job_id)}
+        except Exception as e:
+            return {"status": "error", "message": f"Error loading delivery report: {str(e)}"}
+
+    def get_pacing_settings(self):
+        return {"status": "success", "messages_per_minute": int(self._get_setting('messages_per_minute', '20')),
+                "sessions": {name: pacer.summary() for name, pacer in self.pacers.items()}}
+
+    def save_pacing_settings(self, messages_per_minute):
+        """Set the target send rate per WhatsApp account; the pacer still slows down below it when throttled."""
+        try:
+            rate = int(messages_per_minute)
+        except (TypeError, ValueError):
+            return {"status": "error", "message": "Messages per minute must be a number"}
+        if not SendPacer.MIN_RATE <= rate <= 120:
+            return {"status": "error", "message": f"Messages per minute must be between {int(SendPacer.MIN_RATE)} and 120"}
+        try:
+            self._set_setting('messages_per_minute', str(rate))
+            with self._pacers_lock:
+                for pacer in self.pacers.values():
+                    pacer.configure(rate)
+            return {"status": "success", "message": f"Sending at up to {rate} messages per minute"}
+        except Exception as e:
+            return {"status": "error", "message": f"Error saving pacing settings: {str(e)}"}
+
+    def _send_text_message(self, driver, navigator, mobile, text, chat_name=None):
+        """Open a chat and send one text message. Returns (success, reason)."""
+        # Switch chats in-page, reloading only if that fails
+        chat_state = self._open_chat(driver, navigator, mobile, chat_name)
+        if chat_state in ('invalid', 'cached-invalid'):
+            print(f"Invalid number: {mobile}")
+            return False, "invalid number (cached)" if chat_state == 'cached-invalid' else "invalid number"
+
+        # Fast message box detection
+        message_box = self.find_message_box_fast(driver, WebDriverWait(driver, 10))
+        if not message_box:
+            print(f"Could not find message box for {mobile}")
+            return False, "compose box not found"
+
+        # Insert the whole message in one operation
+        self.composer.compose(driver, message_box, text)
+
+        # Send message; delivery is followed by DeliveryTracker while the loop moves on
+        sent_before = self.readiness.outgoing_count(driver)
+        message_box.send_keys(Keys.ENTER)
+        if not self.readiness.wait_for_outgoing(driver, sent_before):
+            return False, "message did not appear in chat"
+        return True, "text sent"
+
+    def send_courier_notifications(self, courier_data_list=None, customer_data=None, dataset=None, job=None):
         """Optimized courier notifications sender."""
         driver = None
         try:
+            if dataset:
+                dataset = self._resolve_dataset(dataset)
+                # A large sheet is read from its file again as the loop advances
+                customer_data, total_customers = self._dataset_rows(dataset), dataset["total"]
+            else:
+                total_customers = len(customer_data)
             print("Starting courier notification process...")
-            driver = self._get_driver()
-            driver.get("https://web.whatsapp.com")
-            
-            print("Waiting for WhatsApp Web to load...")
-            
-            # Faster login detection
-            login_successful = False
-            max_wait_time = 60  # Reduced from 120
-            check_interval = 2   # Reduced from 5
-            
-            for i in range(max_wait_time // check_interval):
-                try:
-                    search_elements = driver.find_elements(By.XPATH, '//div[@contenteditable="true"][@data-tab="3"]')
-                    if search_elements:
-                        login_successful = True
-                        break
-                    time.sleep(check_interval)
-                except Exception as e:
-                    time.sleep(check_interval)
-            
-            if not login_successful:
+            driver = self.driver_manager.acquire(max_wait_time=60)
+            if not driver:
                 return {"status": "error", "message": "Login timeout - please make sure you're logged into WhatsApp Web"}
-            
-            # Reduced wait after login
-            time.sleep(3)  # Reduced from 10
-            
+            self.navigator.reset_stats()
+
             success_count = 0
             error_count = 0
+            skipped_count = 0
+            pacer = self._pacer()
+            ledger = FailureLedger(self.db, job)
+            watchdog = SessionWatchdog(self.driver_manager, self.deliveries)
+            if job:
+                job.set_total(total_customers)
             
             # Process customers in batches for better performance
             batch_size = 5
-            for batch_start in range(0, len(customer_data), batch_size):
-                batch_end = min(batch_start + batch_size, len(customer_data))
-                batch_customers = customer_data[batch_start:batch_end]
+            for batch_start, batch_customers in self._batches(customer_data, batch_size):
                 
                 for i, customer in enumerate(batch_customers):
+                    item_key = str(batch_start + i)
+                    if job:
+                        job.progress(batch_start + i, success_count, error_count, customer['name'])
+                        if not job.checkpoint():
+                            break
+                        if job.is_done(item_key):
+                            skipped_count += 1
+                            continue
+                    mobile = customer.get('mobile', '')
+                    payload = None
                     try:
                         customer_index = batch_start + i + 1
                         print(f"\n--- Processing customer {customer_index}: {customer['name']} ---")
@@ -1026,567 +4009,408 @@ class Api:
                         # Format the message for this customer
                         formatted_message = self.format_courier_message(customer_courier_data, customer)
                         
-                        # Clean mobile number
-                        mobile = re.sub(r'[^\d]', '', customer['mobile'].strip())
-                        
-                        # Add country code if needed
-                        if len(mobile) == 10:
-                            mobile = '91' + mobile
-                        elif len(mobile) == 12 and mobile.startswith('91'):
-                            pass
-                        elif len(mobile) == 13 and mobile.startswith('091'):
-                            mobile = mobile[1:]
-                        
+                        mobile = self._normalize_mobile(customer['mobile'])
                         print(f"Final mobile number: {mobile}")
+                        payload = (mobile, formatted_message, customer['name'])
                         
-                        # Navigate faster
-                        url = f"https://web.whatsapp.com/send?phone={mobile}"
-                        driver.get(url)
-                        
-                        # Reduced wait time
-                        time.sleep(3)  # Reduced from 8
-                        
-                        # Quick invalid number check
-                        try:
-                            invalid_elements = driver.find_elements(By.XPATH, 
-                                "//div[contains(text(), 'Phone number shared via url is invalid') or contains(text(), 'not exist')]")
-                            if invalid_elements:
-                                print(f"Invalid number: {mobile}")
-                                error_count += 1
-                                continue
-                        except:
-                            pass
-                        
-                        # Fast message box detection
-                        message_box = self.find_message_box_fast(driver, WebDriverWait(driver, 10))
-                        
-                        if not message_box:
-                            print(f"Could not find message box for {mobile}")
-                            error_count += 1
-                            continue
-                        
-                        # Send message quickly
-                        message_box.click()
-                        time.sleep(0.3)  # CHANGE 1: Reduced wait
-                        
-                        # Clear and type message
-                        message_box.send_keys(Keys.CONTROL + "a", Keys.DELETE)
-                        time.sleep(0.2) # CHANGE 1
-                        
-                        # Type message in chunks for speed
-                        message_lines = formatted_message.split('\n')
-                        for j, line in enumerate(message_lines):
-                            if line.strip():
-                                message_box.send_keys(line)
-                            if j < len(message_lines) - 1:
-                                message_box.send_keys(Keys.SHIFT + Keys.ENTER)
-                        
-                        # Send message
-                        message_box.send_keys(Keys.ENTER)
-                        print(f"Message sent successfully to {customer['name']} ({mobile})")
-                        success_count += 1
-                        
-                        # Minimal wait between messages
-                        time.sleep(0.5)  # CHANGE 1: Reduced from 5
-                        
+                        sent, reason = watchdog.send(self._text_attempt(pacer, job, self.navigator, mobile, formatted_message,
+                                                                        customer['name'], item_key), job)
+                        driver = watchdog.driver
                     except Exception as e:
                         print(f"Error processing {customer['name']}: {str(e)}")
-                        error_count += 1
-                        continue
-                
-                # Short batch break
-                if batch_end < len(customer_data):
-                    print("--- Short batch break ---")
-                    time.sleep(1)
-            
-            print(f"\n=== Final Results ===")
-            print(f"Success: {success_count}, Errors: {error_count}")
-            
-            return {
-                "status": "success",
-                "message": f"Courier notifications sent! Success: {success_count}, Errors: {error_count}"
-            }
-            
-        except Exception as e:
-            print(f"Critical error: {str(e)}")
-            return {"status": "error", "message": f"An error occurred: {str(e)}"}
-        finally:
-            if driver:
-                time.sleep(0.8)  # CHANGE 1: Reduced from 5
-                try:
-                    driver.quit()
-                except:
-                    pass
-                
-    def send_image_to_contact(self, driver, wait, image_path, caption_message=""):
-        """
-        Simplified and robust image sending method for WhatsApp Web
-        """
-        print(f"=== STARTING IMAGE SEND DEBUG ===")
-        print(f"Image path: {image_path}")
-        print(f"Caption: {caption_message}")
-        
-        try:
-            # Method 1: Traditional attachment button approach
-            print("DEBUG: Attempting Method 1 - Attachment Button")
-            
-            # Wait for chat to be fully loaded
-            print("DEBUG: Waiting for chat interface...")
-            time.sleep(3)
-            
-            # Find and click attachment/clip button - try multiple selectors
-            attachment_selectors = [
-                '[data-testid="clip"]',
-                '[data-icon="clip"]', 
-                'span[data-testid="clip"]',
-                'button[aria-label="Attach"]',
-                'div[title="Attach"]'
-            ]
-            
-            attachment_clicked = False
-            for i, selector in enumerate(attachment_selectors):
-                try:
-                    print(f"DEBUG: Trying attachment selector {i+1}: {selector}")
-                    attachment_btn = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, selector)))
-                    attachment_btn.click()
-                    print(f"DEBUG: Attachment button clicked with selector {i+1}")
-                    attachment_clicked = True
-                    break
-                except Exception as e:
-                    print(f"DEBUG: Attachment selector {i+1} failed: {e}")
-                    continue
-            
-            if not attachment_clicked:
-                print("DEBUG: All attachment selectors failed, trying Method 2")
-                return self.send_image_method_2(driver, wait, image_path, caption_message)
-            
-            time.sleep(2)
-            
-            # Find photo/document option and click it
-            print("DEBUG: Looking for photo/document option...")
-            photo_selectors = [
-                'input[accept*="image"]',
-                'input[type="file"][accept*="image"]',
-                'li[data-testid="mi-attach-photo"]',
-                'button[aria-label="Photos & Videos"]'
-            ]
-            
-            photo_clicked = False
-            for i, selector in enumerate(photo_selectors):
-                try:
-                    print(f"DEBUG: Trying photo selector {i+1}: {selector}")
+                        sent, reason = False, f"{type(e).__name__}: {e}"
                     
-                    if selector.startswith('input'):
-                        # Direct file input - send keys directly
-                        file_input = driver.find_element(By.CSS_SELECTOR, selector)
-                        print(f"DEBUG: Found file input, sending keys...")
-                        file_input.send_keys(image_path)
-                        photo_clicked = True
-                        break
+                    if job:
+                        job.record_item(item_key, mobile, sent, None if sent else reason)
+                    if sent:
+                        print(f"Message sent successfully to {customer['name']} ({mobile})")
+                        success_count += 1
                     else:
-                        # Button - click first then find input
-                        photo_btn = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, selector)))
-                        photo_btn.click()
-                        print(f"DEBUG: Photo button clicked with selector {i+1}")
-                        time.sleep(1)
-                        
-                        # Now find the file input
-                        file_input = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, 'input[type="file"]')))
-                        file_input.send_keys(image_path)
-                        photo_clicked = True
-                        break
-                        
-                except Exception as e:
-                    print(f"DEBUG: Photo selector {i+1} failed: {e}")
-                    continue
-            
-            if not photo_clicked:
-                print("DEBUG: Could not find photo input, trying Method 2")
-                return self.send_image_method_2(driver, wait, image_path, caption_message)
-            
-            print("DEBUG: File uploaded, waiting for preview...")
-            time.sleep(5)
-            
-            # Add caption if provided
-            if caption_message and caption_message.strip():
-                print("DEBUG: Adding caption...")
-                caption_selectors = [
-                    'div[contenteditable="true"][data-tab="10"]',
-                    'div[aria-placeholder="Add a caption..."]',
-                    'div[data-testid="media-caption-input"]'
-                ]
-                
-                for selector in caption_selectors:
-                    try:
-                        caption_input = driver.find_element(By.CSS_SELECTOR, selector)
-                        caption_input.click()
-                        time.sleep(1)
-                        caption_input.send_keys(caption_message)
-                        print("DEBUG: Caption added successfully")
+                        ledger.fail(item_key, mobile, reason, payload, payload[1] if payload else None)
+                        error_count += 1
+                    if watchdog.lost:
                         break
-                    except Exception as e:
-                        print(f"DEBUG: Caption selector failed: {e}")
-                        continue
-            
-            # Send the image
-            print("DEBUG: Sending image...")
-            send_selectors = [
-                'span[data-testid="send"]',
-                'button[data-testid="send"]',
-                '[aria-label="Send"]'
-            ]
-            
-            for i, selector in enumerate(send_selectors):
-                try:
-                    send_btn = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, selector)))
-                    send_btn.click()
-                    print(f"DEBUG: Image sent successfully with selector {i+1}")
-                    return {"status": "success", "message": "Image sent via Method 1"}
-                except Exception as e:
-                    print(f"DEBUG: Send selector {i+1} failed: {e}")
-                    continue
-            
-            # If no send button found, try Enter key
-            try:
-                driver.find_element(By.TAG_NAME, 'body').send_keys(Keys.ENTER)
-                print("DEBUG: Image sent via Enter key")
-                return {"status": "success", "message": "Image sent via Enter key"}
-            except Exception as e:
-                print(f"DEBUG: Enter key failed: {e}")
-                
-            return {"status": "error", "message": "Could not send image - no send button found"}
-            
-        except Exception as e:
-            print(f"DEBUG: Method 1 completely failed: {e}")
-            return self.send_image_method_2(driver, wait, image_path, caption_message)
-
-    def send_image_method_2(self, driver, wait, image_path, caption_message=""):
-        """
-        Alternative method using direct input injection
-        """
-        print("DEBUG: Attempting Method 2 - Direct Input Injection")
-        
-        try:
-            # Create hidden file input and inject it
-            print("DEBUG: Creating hidden file input...")
-            
-            create_input_script = """
-            // Remove any existing hidden inputs
-            var existingInputs = document.querySelectorAll('input[id="hidden-file-input"]');
-            existingInputs.forEach(function(input) { input.remove(); });
-            
-            // Create new hidden input
-            var input = document.createElement('input');
-            input.type = 'file';
-            input.id = 'hidden-file-input';
-            input.accept = 'image/*,video/mp4,video/3gpp,video/quicktime';
-            input.style.display = 'none';
-            input.multiple = false;
-            document.body.appendChild(input);
-            return 'input_created';
-            """
-            
-            result = driver.execute_script(create_input_script)
-            print(f"DEBUG: Input creation result: {result}")
-            
-            if result != 'input_created':
-                return {"status": "error", "message": "Could not create hidden input"}
-            
-            # Send file to the hidden input
-            print("DEBUG: Sending file to hidden input...")
-            hidden_input = driver.find_element(By.ID, "hidden-file-input")
-            hidden_input.send_keys(image_path)
-            time.sleep(2)
-            
-            # Trigger file processing
-            print("DEBUG: Triggering file processing...")
-            
-            trigger_script = """
-            var input = document.getElementById('hidden-file-input');
-            if (input && input.files && input.files.length > 0) {
-                var file = input.files[0];
-                
-                // Find message input area for drag simulation
-                var dropTarget = document.querySelector('#main') || 
-                                document.querySelector('[data-testid="conversation-panel-messages"]');
                 
-                if (dropTarget) {
-                    // Create drag events
-                    var dt = new DataTransfer();
-                    dt.items.add(file);
-                    
-                    var dragEnter = new DragEvent('dragenter', { dataTransfer: dt, bubbles: true });
-                    var dragOver = new DragEvent('dragover', { dataTransfer: dt, bubbles: true });
-                    var drop = new DragEvent('drop', { dataTransfer: dt, bubbles: true });
-                    
-                    dropTarget.dispatchEvent(dragEnter);
-                    dropTarget.dispatchEvent(dragOver);
-                    dropTarget.dispatchEvent(drop);
-                    
-                    return 'file_processed';
-                } else {
-                    return 'no_drop_target';
-                }
-            } else {
-                return 'no_file_found';
-            }
-            """
-            
-            process_result = driver.execute_script(trigger_script)
-            print(f"DEBUG: File processing result: {process_result}")
-            
-            if process_result != 'file_processed':
-                return {"status": "error", "message": f"File processing failed: {process_result}"}
-            
-            # Wait for media preview
-            print("DEBUG: Waiting for media preview...")
-            time.sleep(5)
-            
-            # Check if preview loaded
-            preview_selectors = [
-                '[data-testid="media-viewer"]',
-                '[data-testid="send-container"]',
-                'div[data-testid="send"]'
-            ]
-            
-            preview_found = False
-            for selector in preview_selectors:
-                if driver.find_elements(By.CSS_SELECTOR, selector):
-                    preview_found = True
-                    print(f"DEBUG: Preview found with selector: {selector}")
+                if job and job.cancelled:
+                    print("Courier notifications cancelled")
                     break
+                if watchdog.lost:
+                    break
+
+            gained = self._finish_run(watchdog, self.navigator, job, ledger, self._text_resender(pacer, job, watchdog, self.navigator))
+            success_count += gained
+            error_count -= gained
+            driver = watchdog.driver
+            if watchdog.lost:
+                return self._lost_result(job, success_count, error_count, ledger)
             
-            if not preview_found:
-                return {"status": "error", "message": "Media preview did not load"}
-            
-            # Add caption and send (same as Method 1)
-            if caption_message and caption_message.strip():
-                print("DEBUG: Adding caption...")
-                caption_selectors = [
-                    'div[contenteditable="true"][data-tab="10"]',
-                    'div[aria-placeholder="Add a caption..."]'
-                ]
-                
-                for selector in caption_selectors:
-                    try:
-                        caption_input = driver.find_element(By.CSS_SELECTOR, selector)
-                        caption_input.click()
-                        time.sleep(1)
-                        caption_input.send_keys(caption_message)
-                        print("DEBUG: Caption added successfully")
-                        break
-                    except:
-                        continue
-            
-            # Send the image
-            print("DEBUG: Sending image...")
-            send_selectors = [
-                'span[data-testid="send"]',
-                'button[data-testid="send"]'
-            ]
-            
-            for selector in send_selectors:
-                try:
-                    send_btn = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, selector)))
-                    send_btn.click()
-                    print("DEBUG: Image sent successfully via Method 2")
-                    return {"status": "success", "message": "Image sent via Method 2"}
-                except:
-                    continue
+            print(f"\n=== Final Results ===")
+            print(f"Success: {success_count}, Errors: {error_count}, {self.navigator.summary()}, pacing {pacer.summary()}")
+            if job:
+                job.progress(success_count + error_count + skipped_count, success_count, error_count)
             
-            return {"status": "error", "message": "Could not send image - no send button found"}
+            skipped_text = f", Skipped (already sent): {skipped_count}" if skipped_count else ""
+            failure_text = f" Failures - {ledger.summary_text()}." if ledger.summary_text() else ""
+            recovery_text = f", {watchdog.summary()}" if watchdog.summary() else ""
+            return {
+                "status": "success",
+                "message": f"Courier notifications sent! Success: {success_count}, Errors: {error_count}{skipped_text} ({self.navigator.summary()}{recovery_text}).{failure_text}",
+                "navigation": dict(self.navigator.stats),
+                "failures": ledger.breakdown(),
+                "session_recoveries": watchdog.recoveries
+            }
             
         except Exception as e:
-            print(f"DEBUG: Method 2 failed: {e}")
-            return {"status": "error", "message": f"Method 2 failed: {str(e)}"}
+            print(f"Critical error: {str(e)}")
+            return {"status": "error", "message": f"An error occurred: {str(e)}"}
+        finally:
+            if driver:
+                self.driver_manager.release()
+                
+    def send_image_to_contact(self, driver, wait, image_path, caption_message=""):
+        """Send an image (a path or a prepared MediaFile) with an optional caption to the open chat."""
+        media = image_path if isinstance(image_path, MediaFile) else self.media.prepare(image_path)
+        if not media:
+            return {"status": "error", "message": "Image file is missing or not supported"}
+        return self.media.send(driver, media, caption_message)
+
+    def _normalize_mobile(self, number):
+        """Normalize to E.164; unparseable input is passed through as bare digits."""
+        return self.phones.normalize(number) or re.sub(r'[^\d]', '', str(number))
+
+    def get_phone_settings(self):
+        return {"status": "success", "country_code": self.phones.country_code}
+
+    def save_phone_settings(self, country_code):
+        """Set the country code added to numbers written without one."""
+        country_code = re.sub(r'\D', '', str(country_code or ''))
+        if not 1 <= len(country_code) <= 3:
+            return {"status": "error", "message": "Country code must be 1-3 digits, e.g. 91"}
+        try:
+            candidate = PhoneNormalizer(country_code)
+            broken = candidate.self_check()
+            if broken:
+                return {"status": "error", "message": f"Country code +{country_code} would re-prefix already normalized numbers: {', '.join(broken)}"}
+            self._set_setting('default_country_code', country_code)
+            self.phones.configure(country_code)
+            return {"status": "success", "message": f"Default country code set to +{country_code}"}
+        except Exception as e:
+            return {"status": "error", "message": f"Error saving phone settings: {str(e)}"}
+
+    def _prepare_bulk_contacts(self, numbers, contacts):
+        """Turn either the parsed Excel contacts or the manual number list into contact dicts."""
+        if contacts:
+            return contacts
+        prepared, seen = [], set()
+        for i, num in enumerate(numbers):
+            if not num.strip():
+                continue
+            # The same number pasted twice is only messaged once
+            key = self.phones.normalize(num) or num.strip()
+            if key in seen:
+                continue
+            seen.add(key)
+            prepared.append({"phone": num.strip(), "name": f"Contact {i+1}", "custom_message": None})
+        return prepared
 
-    def send_whatsapp_messages(self, numbers, message, image_path, use_template=False, template_content="", contacts=None):
-        """Enhanced function for the Bulk Sender tool with better image handling."""
+    def _resolve_bulk_image(self, image_path):
+        """Resolve the campaign attachments once; returns a list of prepared MediaFiles."""
+        paths = image_path if isinstance(image_path, (list, tuple)) else [image_path]
+        media = []
+        for path in paths:
+            if not path or path == "null" or path == "undefined":
+                continue
+            # If the path looks like a blob URL or not a valid file path, prompt for file selection
+            if not os.path.exists(path) or path.startswith('blob:'):
+                print("Image path invalid or blob URL detected, prompting for file selection...")
+                path = self.get_image_file_path()
+            prepared = self.media.prepare(path)
+            if prepared:
+                media.append(prepared)
+        return media
+
+    def _resolve_bulk_message(self, contact, contact_name, message, use_template, template_content):
+        """Pick the template, the contact's own Excel message or the default message, personalised with {name}."""
+        custom_message = contact.get('custom_message') if hasattr(contact, 'get') else None
+        values = {"name": contact_name}
+        if use_template and template_content:
+            return MessageTemplate.compile(template_content).render(values)
+        elif custom_message and custom_message.strip() and custom_message.strip() != 'nan':
+            return MessageTemplate.compile(custom_message).render(values)
+        elif message and message.strip():
+            return MessageTemplate.compile(message).render(values)
+        return ""
+
+    def _send_bulk_contact(self, driver, wait, navigator, mobile, final_message, media, chat_name=None):
+        """Open one chat and send the image and/or text. Returns (success, reason)."""
+        # Check for invalid number
+        chat_state = self._open_chat(driver, navigator, mobile, chat_name)
+        if chat_state in ('invalid', 'cached-invalid'):
+            print(f"Invalid number: {mobile}")
+            return False, "invalid number (cached)" if chat_state == 'cached-invalid' else "invalid number"
+
+        # Send image with message if both provided
+        if media:
+            print(f"--- Starting image send for {mobile} ---")
+            sent_count = 0
+            clicked = False
+            for item in media:
+                # The message goes out as the caption of the first attachment
+                sent_before = self.readiness.outgoing_count(driver)
+                image_result = self.media.send(driver, item, final_message if sent_count == 0 else "")
+                if image_result["status"] != "success":
+                    # Nothing went out, so one more try cannot duplicate the attachment
+                    print(f"Attachment {sent_count + 1} of {len(media)} failed ({image_result['message']}), trying once more")
+                    image_result = self.media.send(driver, item, final_message if sent_count == 0 else "")
+                if image_result["status"] != "success":
+                    break
+                if not self.readiness.wait_for_outgoing(driver, sent_before):
+                    # Send was clicked, so the attachment may still go out
+                    clicked = True
+                    break
+                sent_count += 1
+
+            if sent_count == len(media):
+                return True, "image sent" if sent_count == 1 else f"{sent_count} images sent"
+            if sent_count:
+                return False, f"partial upload: only {sent_count} of {len(media)} images sent"
+            if clicked:
+                # Neither a text fallback nor a plain retry: the caption could go out twice
+                print(f"Image send for {mobile} was not confirmed in time")
+                return False, "send timed out before the bubble appeared"
+
+            print(f"Image send failed for {mobile}: {image_result['message']}")
+            # Fall back to text-only message if image fails
+            if not (final_message and final_message.strip()):
+                return False, "image upload failed"
+            print("Falling back to text-only message...")
+
+        if not (final_message and final_message.strip()):
+            print(f"No message or image to send to {mobile}")
+            return False, "nothing to send"
+
+        print(f"Sending text message to {mobile}")
+
+        # Find message input box
+        message_box = self.selectors.find(driver, "message_box", timeout=15)
+
+        if not message_box:
+            print("Could not find message input box")
+            return False, "compose box not found"
+
+        # Replace any existing text with the whole message at once
+        self.composer.compose(driver, message_box, final_message)
+
+        # Send message; delivery is followed by DeliveryTracker while the loop moves on
+        sent_before = self.readiness.outgoing_count(driver)
+        message_box.send_keys(Keys.ENTER)
+        if not self.readiness.wait_for_outgoing(driver, sent_before):
+            return False, "message did not appear in chat"
+        return True, "text sent"
+
+    def send_whatsapp_messages(self, numbers, message, image_path, use_template=False, template_content="", contacts=None,
+                               source=None, job=None, broadcast=False):
+        """
+        Enhanced function for the Bulk Sender tool with better image handling.
+        With `broadcast`, the first message is sent normally and every later recipient whose
+        message is identical gets it through the forward dialog, in batches; personalised
+        messages and recipients the dialog cannot find are still sent chat by chat.
+        """
         driver = None
         try:
-            driver = self._get_driver()
-            wait = WebDriverWait(driver, 45)
-            driver.get("https://web.whatsapp.com")
-            
-            print("Waiting for WhatsApp Web to load...")
-            
-            # Wait for login
-            login_successful = False
-            max_wait_time = 120
-            check_interval = 5
-            
-            for i in range(max_wait_time // check_interval):
-                try:
-                    search_elements = driver.find_elements(By.XPATH, '//div[@contenteditable="true"][@data-tab="3"]')
-                    if search_elements:
-                        login_successful = True
-                        break
-                    time.sleep(check_interval)
-                except Exception as e:
-                    time.sleep(check_interval)
-            
-            if not login_successful:
+            driver = self.driver_manager.acquire()
+            if not driver:
                 return {"status": "error", "message": "Login timeout - please make sure you're logged into WhatsApp Web"}
-            
-            time.sleep(2) # CHANGE 1
-            
+            self.navigator.reset_stats()
+
             success_count = 0
             error_count = 0
             
-            # Update the image path handling
-            if image_path and image_path != "null" and image_path != "undefined":
-                # If image_path looks like a blob URL or not a valid file path, prompt for file selection
-                if not os.path.exists(image_path) or image_path.startswith('blob:'):
-                    print("Image path invalid or blob URL detected, prompting for file selection...")
-                    image_path = self.get_image_file_path()
-
-            # Determine which data source to use
-            if contacts:
-                # Use Excel contacts
-                data_source = contacts
+            media = self._resolve_bulk_image(image_path)
+            if source:
+                # Streamed from the file as the loop advances
+                data_source = self._iter_bulk_contacts(source["file_path"])
+                total_contacts = source.get("total", 0)
             else:
-                # Use plain numbers list
-                data_source = [{"phone": num.strip(), "name": f"Contact {i+1}", "custom_message": None} 
-                                for i, num in enumerate(numbers) if num.strip()]
-            
-            for contact in data_source:
+                data_source = self._prepare_bulk_contacts(numbers, contacts)
+                total_contacts = len(data_source)
+            if job:
+                job.set_total(total_contacts)
+            
+            if broadcast and len(media) > 1:
+                print("Broadcast forwards a single message; sending chat by chat for several attachments")
+                broadcast = False
+            pacer = self._pacer()
+            ledger = FailureLedger(self.db, job)
+            watchdog = SessionWatchdog(self.driver_manager, self.deliveries)
+            anchor = None  # (mobile, chat_name, message) of the chat holding the broadcast message
+            anchor_open = False
+            forward_batch = []
+            forwarded_count = 0
+
+            def record(index, mobile, contact_name, sent, reason, payload=None):
+                nonlocal success_count, error_count
+                if job:
+                    job.record_item(str(index), mobile, sent, None if sent else reason)
+                if sent:
+                    print(f"Message sent successfully to {contact_name} ({mobile}): {reason}")
+                    success_count += 1
+                else:
+                    # payload (mobile, message, chat name) lets the ledger retry it at the end of the run
+                    ledger.fail(str(index), mobile, reason, payload, payload[1] if payload else None)
+                    error_count += 1
+
+            def resend(item_key, recipient, payload):
+                mobile, final_message, chat_name = payload
+                return watchdog.send(self._bulk_attempt(pacer, job, self.navigator, mobile, final_message, media,
+                                                        chat_name, item_key), job)
+
+            def flush_forwards():
+                nonlocal driver, anchor_open, forwarded_count
+                batch = list(forward_batch)
+                forward_batch.clear()
+                forwarded = {}
+                if anchor_open or self._open_chat(driver, self.navigator, anchor[0], anchor[1]) == 'ready':
+                    anchor_open = True
+                    # One forward reaches the whole batch, so it costs a token per chat
+                    pacer.acquire(len(batch), job=job)
+                    started = time.time()
+                    forwarded = self.forwarder.forward_last(driver, [(mobile, chat_name) for _, mobile, _, chat_name, _ in batch])
+                    pacer.report(driver, bool(forwarded), None if forwarded else "forward failed", time.time() - started)
+                for index, mobile, contact_name, chat_name, final_message in batch:
+                    if mobile in forwarded:
+                        forwarded_count += 1
+                        if job:
+                            self.deliveries.watch(driver, job, str(index), mobile, forwarded[mobile])
+                        record(index, mobile, contact_name, True, "forwarded")
+                        continue
+                    # Not reachable from the forward dialog: send it directly
+                    sent, reason = watchdog.send(self._bulk_attempt(pacer, job, self.navigator, mobile, final_message, media,
+                                                                    chat_name, str(index)), job)
+                    driver = watchdog.driver
+                    anchor_open = False
+                    record(index, mobile, contact_name, sent, reason, (mobile, final_message, chat_name))
+
+            def prepare(entry):
+                # Runs on the pipeline thread, ahead of the contact the browser is working on
+                index, contact = entry
+                if job and job.is_done(str(index)):
+                    return None
                 if isinstance(contact, dict):
                     number = contact.get('phone', '')
                     contact_name = contact.get('name', 'Contact')
                 else:
                     number = contact
                     contact_name = 'Contact'
-                
-                if not number.strip():
-                    continue
-                    
-                try:
-                    # Clean the number
-                    mobile = re.sub(r'[^\d]', '', number.strip())
-                    
-                    # Add country code if needed
-                    if len(mobile) == 10:
-                        mobile = '91' + mobile
-                    elif len(mobile) == 12 and mobile.startswith('91'):
-                        mobile = mobile
-                    elif len(mobile) == 13 and mobile.startswith('091'):
-                        mobile = mobile[1:]
-                    
-                    print(f"Processing {contact_name}: {mobile}")
-                    
-                    url = f"https://web.whatsapp.com/send?phone={mobile}"
-                    driver.get(url)
-                    time.sleep(8)
-                    
-                    # Check for invalid number
+                prepared = {"number": number, "contact_name": contact_name}
+                if number.strip():
+                    mobile = self._normalize_mobile(number)
+                    prepared.update(
+                        mobile=mobile,
+                        message=self._resolve_bulk_message(contact, contact_name, message, use_template, template_content),
+                        chat_name=contact_name if contacts or source else None,
+                        known_invalid=self.number_status.is_invalid(mobile))
+                return prepared
+
+            skipped_count = 0
+            cancelled = False
+            pipeline = SendPipeline(enumerate(data_source), prepare)
+            try:
+                for entry, prepared, prepare_error in pipeline:
+                    if entry is None:
+                        raise prepare_error
+                    index, contact = entry
+                    if job:
+                        job.progress(index, success_count, error_count, contact.get('name') if isinstance(contact, dict) else contact)
+                        if not job.checkpoint():
+                            print("Bulk send cancelled")
+                            cancelled = True
+                            break
+                    if prepared is None and prepare_error is None:
+                        skipped_count += 1
+                        continue
+                    if prepare_error:
+                        print(f"Error preparing contact {index + 1}: {prepare_error}")
+                        recipient = str(contact.get('phone', '') if isinstance(contact, dict) else contact)
+                        if job:
+                            job.record_item(str(index), recipient, False, str(prepare_error))
+                        ledger.fail(str(index), recipient, str(prepare_error))
+                        error_count += 1
+                        continue
+                    number, contact_name = prepared["number"], prepared["contact_name"]
+                    if not number.strip():
+                        continue
+                        
                     try:
-                        invalid_elements = driver.find_elements(By.XPATH, "//div[contains(text(), 'Phone number shared via url is invalid') or contains(text(), 'Telefonnummer') or contains(text(), 'not exist') or contains(text(), 'doesn\\'t have WhatsApp')]")
-                        if invalid_elements:
+                        mobile, final_message, chat_name = prepared["mobile"], prepared["message"], prepared["chat_name"]
+                        print(f"Processing {contact_name}: {mobile}")
+
+                        if prepared["known_invalid"]:
+                            # Known from an earlier run; neither a navigation nor a pacing token is spent
+                            self.number_status.count_saved()
                             print(f"Invalid number: {mobile}")
-                            error_count += 1
+                            record(index, mobile, contact_name, False, "invalid number (cached)")
                             continue
-                    except:
-                        pass
-                    
-                    # Determine message to send
-                    final_message = ""
-                    if use_template and template_content:
-                        final_message = template_content.replace("{name}", contact_name)
-                    elif hasattr(contact, 'get') and contact.get('custom_message') and contact.get('custom_message').strip() and contact.get('custom_message').strip() != 'nan':
-                        final_message = contact.get('custom_message').replace("{name}", contact_name)
-                    elif message and message.strip():
-                        final_message = message.replace("{name}", contact_name)
-                    
-                    # Send image with message if both provided
-                    if image_path and os.path.exists(image_path):
-                        print(f"--- Starting image send for {mobile} ---")
-                        image_result = self.send_image_to_contact(driver, wait, image_path, final_message)
-                            
-                        if image_result["status"] == "success":
-                            print(f"Image sent successfully to {contact_name} ({mobile})")
-                            success_count += 1
-                            time.sleep(4)  # Wait after successful send
-                            continue  # Skip text-only message sending
-                        else:
-                            print(f"Image send failed for {mobile}: {image_result['message']}")
-                            # Fall back to text-only message if image fails
-                            if final_message and final_message.strip():
-                                print("Falling back to text-only message...")
-                                # Continue to text message sending code below
-                            else:
-                                error_count += 1
-                                continue
 
-                    # Send text message only (no image)
-                    if final_message and final_message.strip():
-                        try:
-                            print(f"Sending text message to {mobile}")
-                            
-                            # Find message input box
-                            message_selectors = [
-                                '//div[@contenteditable="true"][@data-tab="10"]',
-                                '//div[@contenteditable="true"][@data-tab="1"]',
-                                '//div[@role="textbox"][@contenteditable="true"]',
-                                '//div[@title="Type a message"]',
-                                '//footer//div[@contenteditable="true"]'
-                            ]
-                            
-                            message_box = None
-                            for selector in message_selectors:
-                                try:
-                                    message_box = wait.until(EC.element_to_be_clickable((By.XPATH, selector)))
+                        if anchor and final_message == anchor[2]:
+                            forward_batch.append((index, mobile, contact_name, chat_name, final_message))
+                            if len(forward_batch) >= MessageForwarder.BATCH_SIZE:
+                                flush_forwards()
+                                if watchdog.lost:
                                     break
-                                except:
-                                    continue
-                            
-                            if not message_box:
-                                print("Could not find message input box")
-                                error_count += 1
-                                continue
-                            
-                            message_box.click()
-                            time.sleep(0.3) # CHANGE 1
-                            
-                            # Clear any existing text
-                            message_box.send_keys(Keys.CONTROL + "a")
-                            message_box.send_keys(Keys.DELETE)
-                            time.sleep(0.2) # CHANGE 1
-                            
-                            # Type message line by line
-                            message_lines = final_message.split('\n')
-                            for j, line in enumerate(message_lines):
-                                if line.strip():
-                                    message_box.send_keys(line)
-                                if j < len(message_lines) - 1:
-                                    message_box.send_keys(Keys.SHIFT + Keys.ENTER)
-                            
-                            # Send message
-                            message_box.send_keys(Keys.ENTER)
-                            print("Text message sent successfully!")
-                            success_count += 1
-                            time.sleep(3)
-                            
-                        except Exception as text_error:
-                            print(f"Error sending text message to {mobile}: {str(text_error)}")
-                            error_count += 1
                             continue
-                    
-                    else:
-                        print(f"No message or image to send to {mobile}")
+
+                        sent, reason = watchdog.send(self._bulk_attempt(pacer, job, self.navigator, mobile, final_message,
+                                                                        media, chat_name, str(index)), job)
+                        driver = watchdog.driver
+                        anchor_open = False
+                        # With attachments only a chat that got the image can be the source; a text-only
+                        # fallback would be forwarded to everyone without it
+                        if broadcast and sent and anchor is None and reason == ("image sent" if media else "text sent"):
+                            # This chat now holds the message every identical recipient gets forwarded
+                            anchor = (mobile, chat_name, final_message)
+                            anchor_open = True
+                        record(index, mobile, contact_name, sent, reason, (mobile, final_message, chat_name))
+                        if watchdog.lost:
+                            break
+                        
+                    except Exception as e:
+                        print(f"Error processing number {number}: {str(e)}")
+                        if job:
+                            job.record_item(str(index), number, False, str(e))
+                        ledger.fail(str(index), prepared.get("mobile", number), f"{type(e).__name__}: {e}",
+                                    (prepared["mobile"], prepared["message"], prepared["chat_name"]) if "mobile" in prepared else None,
+                                    prepared.get("message"))
                         error_count += 1
                         continue
-                    
-                    time.sleep(2)  # Wait between messages
-                    
-                except Exception as e:
-                    print(f"Error processing number {number}: {str(e)}")
-                    error_count += 1
-                    continue
-            
-            total_processed = len(data_source)
+            finally:
+                pipeline.close()
+
+            if forward_batch and not cancelled and not watchdog.lost:
+                flush_forwards()
+
+            gained = self._finish_run(watchdog, self.navigator, job, ledger, resend)
+            success_count += gained
+            error_count -= gained
+            driver = watchdog.driver
+            if watchdog.lost:
+                return self._lost_result(job, success_count, error_count, ledger)
+            
+            total_processed = total_contacts
+            if job:
+                job.progress(success_count + error_count + skipped_count, success_count, error_count)
+            skipped_text = f", Skipped (already sent): {skipped_count}" if skipped_count else ""
+            forwarded_text = f", {forwarded_count} delivered by forwarding" if forwarded_count else ""
+            failure_text = f" Failures - {ledger.summary_text()}." if ledger.summary_text() else ""
+            recovery_text = f", {watchdog.summary()}" if watchdog.summary() else ""
             return {
                 "status": "success",
-                "message": f"Processing completed! Success: {success_count}, Errors: {error_count} out of {total_processed} contacts."
+                "message": f"Processing completed! Success: {success_count}, Errors: {error_count}{skipped_text} out of {total_processed} contacts ({self.navigator.summary()}{forwarded_text}{recovery_text}).{failure_text}",
+                "navigation": dict(self.navigator.stats),
+                "forwarded": forwarded_count,
+                "pacing": pacer.summary(),
+                "failures": ledger.breakdown(),
+                "session_recoveries": watchdog.recoveries
             }
             
         except Exception as e:
@@ -1594,60 +4418,186 @@ class Api:
             return {"status": "error", "message": f"An error occurred: {type(e).__name__} - {e}"}
         finally:
             if driver:
+                self.driver_manager.release()
+
+    def send_whatsapp_messages_parallel(self, numbers, message, image_path, session_names, use_template=False,
+                                        template_content="", contacts=None, messages_per_minute=None, source=None, job=None):
+        """
+        Bulk send sharded across several linked WhatsApp accounts, one browser per account.
+        Each account is paced separately; messages_per_minute overrides the saved target rate.
+        """
+        try:
+            session_names, error = self._check_session_names(session_names)
+            if error:
+                return {"status": "error", "message": error}
+            session_names = session_names or ["default"]
+            for name in session_names:
+                if name != "default":
+                    added = self.add_whatsapp_session(name)
+                    if added["status"] != "success":
+                        return added
+
+            media = self._resolve_bulk_image(image_path)
+            if source:
+                contact_list = self._iter_bulk_contacts(source["file_path"])
+            else:
+                contact_list = self._prepare_bulk_contacts(numbers, contacts)
+            pending = ((index, c) for index, c in enumerate(contact_list)
+                       if str(c.get('phone', '')).strip() and not (job and job.is_done(str(index))))
+            if source:
+                # Workers pull from the file as they go instead of sharding a full list up front
+                work = WorkStealingQueue([], session_names, feed=pending)
+                total_contacts = max(source.get("total", 0) - (len(job.done_keys) if job else 0), 0)
+            else:
+                data_source = list(pending)
+                work = WorkStealingQueue(data_source, session_names)
+                total_contacts = len(data_source)
+            reports = {name: {"session": name, "success": 0, "errors": 0, "status": "ok"} for name in session_names}
+            # One ledger per session, so each account retries its own failures in its own browser
+            ledgers = {name: FailureLedger(self.db, job) for name in session_names}
+            progress_lock = threading.Lock()
+            if job:
+                job.set_total(total_contacts)
+
+            def report_progress(current=None):
+                if job:
+                    with progress_lock:
+                        success = sum(r["success"] for r in reports.values())
+                        errors = sum(r["errors"] for r in reports.values())
+                        job.progress(success + errors, success, errors, current)
+
+            def worker(name):
+                session = self._get_session(name)
+                report = reports[name]
+                driver = None
+                # Holds this run's rate override, if any, until the worker is done
+                run = ExitStack()
                 try:
-                    time.sleep(3)
-                    driver.quit()
-                except:
-                    pass
+                    driver = session.acquire()
+                    if not driver:
+                        # This session's share stays in its deque for the others to steal
+                        report["status"] = "login timeout"
+                        return
+                    session.navigator.reset_stats()
+                    pacer = run.enter_context(self._pacer(name).override(messages_per_minute))
+                    ledger = ledgers[name]
+                    watchdog = SessionWatchdog(session, self.deliveries)
+
+                    def resend(item_key, recipient, payload):
+                        mobile, final_message, chat_name = payload
+                        return watchdog.send(self._bulk_attempt(pacer, job, session.navigator, mobile, final_message, media,
+                                                                chat_name, item_key), job)
+
+                    while True:
+                        if job and not job.checkpoint():
+                            break
+                        item = work.next(name)
+                        if item is None:
+                            break
+                        index, contact = item
+                        contact_name = contact.get('name', 'Contact')
+                        payload = None
+                        try:
+                            mobile = self._normalize_mobile(contact['phone'])
+                            print(f"[{name}] Processing {contact_name}: {mobile}")
+                            final_message = self._resolve_bulk_message(contact, contact_name, message, use_template, template_content)
+                            chat_name = contact_name if contacts or source else None
+                            payload = (mobile, final_message, chat_name)
+                            sent, reason = watchdog.send(self._bulk_attempt(pacer, job, session.navigator, mobile, final_message,
+                                                                            media, chat_name, str(index)), job)
+                            driver = watchdog.driver
+                        except Exception as e:
+                            print(f"[{name}] Error processing {contact_name}: {e}")
+                            sent, reason = False, f"{type(e).__name__}: {e}"
+                        if job:
+                            job.record_item(str(index), contact.get('phone'), sent, None if sent else reason)
+                        if not sent:
+                            ledger.fail(str(index), payload[0] if payload else contact.get('phone'), reason, payload,
+                                        payload[1] if payload else None)
+                        report["success" if sent else "errors"] += 1
+                        report_progress(f"[{name}] {contact_name}")
+                        if watchdog.lost:
+                            # What is left in this session's deque is stolen by the others
+                            break
+                    gained = self._finish_run(watchdog, session.navigator, job, ledger, resend)
+                    report["success"] += gained
+                    report["errors"] -= gained
+                    driver = watchdog.driver
+                    if watchdog.lost:
+                        report["status"] = "session lost"
+                        return
+                    report["navigation"] = dict(session.navigator.stats)
+                    report["pacing"] = pacer.summary()
+                    report["failures"] = ledger.breakdown()
+                    report["session_recoveries"] = watchdog.recoveries
+                except Exception as e:
+                    print(f"[{name}] Session failed: {e}")
+                    report["status"] = f"failed: {e}"
+                finally:
+                    run.close()
+                    if driver:
+                        session.release()
+
+            threads = [threading.Thread(target=worker, args=(name,), daemon=True) for name in session_names]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            work.drain()
+            report_progress()
+            success_count = sum(r["success"] for r in reports.values())
+            error_count = sum(r["errors"] for r in reports.values())
+            # Contacts no session got to (cancelled, login timeouts); a resume picks them up
+            unsent = max(total_contacts - success_count - error_count, 0)
+            if all(r["status"] == "login timeout" for r in reports.values()):
+                return {"status": "error", "message": "Login timeout on every session - please make sure each account is "
+                                                      "logged into WhatsApp Web", "sessions": list(reports.values())}
+            per_session = ", ".join(f"{r['session']}: {r['success']} sent" + (f" ({r['status']})" if r['status'] != "ok" else "")
+                                    for r in reports.values())
+            failures = {}
+            for ledger in ledgers.values():
+                for label, count in ledger.breakdown().items():
+                    failures[label] = failures.get(label, 0) + count
+            failure_text = " Failures - " + ", ".join(f"{label}: {count}" for label, count in failures.items()) + "." if failures else ""
+            return {
+                "status": "success",
+                "message": f"Processing completed across {len(session_names)} sessions! Success: {success_count}, "
+                           f"Errors: {error_count}" + (f", Not sent: {unsent}" if unsent else "") +
+                           f" out of {total_contacts} contacts. [{per_session}]{failure_text}",
+                "sessions": list(reports.values()),
+                "unsent": unsent,
+                "steals": work.steals,
+                "failures": failures
+            }
+
+        except Exception as e:
+            print(f"Critical error in send_whatsapp_messages_parallel: {str(e)}")
+            return {"status": "error", "message": f"An error occurred: {type(e).__name__} - {e}"}
+
+    def _shutdown_sessions(self):
+        """Close every session's browser when the app window closes."""
+        with self._sessions_lock:
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            session.shutdown()
+        self.selectors.flush()
 
     def find_message_box_fast(self, driver, wait):
         """Optimized message box finder with faster detection."""
-        # Try most common selectors first
-        fast_selectors = [
-            '//footer//div[@contenteditable="true"]',
-            '//div[@contenteditable="true"][@data-tab="10"]',
-            '//div[@role="textbox"][@contenteditable="true"]'
-        ]
-        
-        for selector in fast_selectors:
-            try:
-                element = driver.find_element(By.XPATH, selector)
-                if element.is_displayed() and element.is_enabled():
-                    return element
-            except:
-                continue
-        
-        # Fallback to wait-based approach
-        try:
-            return wait.until(EC.element_to_be_clickable((By.XPATH, '//footer//div[@contenteditable="true"]')))
-        except:
-            return None
+        return self.selectors.find(driver, "message_box", timeout=10)
         
     def save_custom_template(self, template_name, message_template, excel_file_name=None):
         """Save custom message template to database."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Create custom templates table if it doesn't exist
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS custom_templates (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT UNIQUE NOT NULL,
-                    message_template TEXT NOT NULL,
-                    excel_file_name TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            cursor.execute('''
+            errors = MessageTemplate.compile(message_template).errors
+            if errors:
+                return {"status": "error", "message": "; ".join(errors)}
+            self.db.execute('''
                 INSERT OR REPLACE INTO custom_templates (name, message_template, excel_file_name) 
                 VALUES (?, ?, ?)
             ''', (template_name, message_template, excel_file_name))
             
-            conn.commit()
-            conn.close()
-            
             return {"status": "success", "message": f"Custom template '{template_name}' saved successfully"}
             
         except Exception as e:
@@ -1656,11 +4606,7 @@ class Api:
     def get_custom_templates(self):
         """Get all saved custom templates."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT id, name, message_template, excel_file_name FROM custom_templates ORDER BY name')
-            rows = cursor.fetchall()
+            rows = self.db.query('SELECT id, name, message_template, excel_file_name FROM custom_templates ORDER BY name')
             
             templates = []
             for row in rows:
@@ -1671,7 +4617,6 @@ class Api:
                     "excel_file_name": row[3]
                 })
             
-            conn.close()
             return {"status": "success", "templates": templates}
             
         except Exception as e:
@@ -1681,21 +4626,17 @@ class Api:
     def get_custom_template_content(self, template_id):
         """Get content of a specific custom template by ID."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT message_template, excel_file_name FROM custom_templates WHERE id = ?', (template_id,))
-            row = cursor.fetchone()
+            row = self.db.query_one('SELECT message_template, excel_file_name FROM custom_templates WHERE id = ?',
+                                    (template_id,))
             
             if row:
-                conn.close()
                 return {
                     "status": "success", 
                     "message_template": row[0],
-                    "excel_file_name": row[1]
+                    "excel_file_name": row[1],
+                    "fields": MessageTemplate.compile(row[0]).fields
                 }
             else:
-                conn.close()
                 return {"status": "error", "message": "Custom template not found"}
                 
         except Exception as e:
@@ -1704,18 +4645,85 @@ class Api:
     def delete_custom_template(self, template_id):
         """Delete a custom template."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('DELETE FROM custom_templates WHERE id = ?', (template_id,))
-            conn.commit()
-            conn.close()
+            self.db.execute('DELETE FROM custom_templates WHERE id = ?', (template_id,))
             
             return {"status": "success", "message": "Custom template deleted successfully"}
             
         except Exception as e:
             return {"status": "error", "message": f"Error deleting custom template: {str(e)}"}
         
+    # Header words that mark the phone column of a custom sheet, before the user maps it
+    PHONE_HEADER_HINTS = ('phone', 'mobile', 'whatsapp', 'contact no', 'number')
+
+    def _custom_phone_duplicates(self, df, column, seen):
+        """
+        Numbers in `column` of one chunk that were already listed on another row (a cell may
+        hold several comma separated numbers). Returns (repeated row count, report); `seen`
+        carries numbers across chunks.
+        """
+        numbers = self.phones.normalize_series(df[column].str.split(',').explode())
+        numbers = numbers[numbers != '']
+        keep, merged, report = PhoneNormalizer.duplicates(numbers, numbers.index + 2)
+        earlier = keep & numbers.isin(seen)
+        seen.update(numbers[keep & ~earlier])
+        return merged + int(earlier.sum()), report
+
+    def _iter_custom_sheet(self, file_path, stats=None, columns=None):
+        """
+        Generator over a custom sheet's rows as stripped string dicts, read chunk by chunk.
+        `columns` limits the keys of each row; `stats` collects the header, the columns that
+        hold any value, the guessed phone column and its repeated numbers as the sheet is read.
+        """
+        stats = stats if stats is not None else {}
+        stats.update(rows=0, columns=None, filled=set(), phone_column=None, duplicates_merged=0, duplicates=[])
+        seen = set()
+        for chunk in self._iter_table_chunks(file_path):
+            if stats["columns"] is None:
+                stats["columns"] = list(chunk.columns)
+                # The phone column is guessed before the user maps it, to report repeated numbers
+                stats["phone_column"] = next((c for hint in self.PHONE_HEADER_HINTS for c in stats["columns"]
+                                              if hint in str(c).lower()), None)
+            chunk.index = pd.RangeIndex(stats["rows"], stats["rows"] + len(chunk))
+            stats["rows"] += len(chunk)
+            stats["filled"].update(column for column in stats["columns"] if chunk[column].notna().any())
+            if columns is not None:
+                chunk = chunk[[column for column in chunk.columns if column in columns]]
+            # Convert each chunk to dictionaries in one columnar pass
+            chunk = chunk.fillna('').apply(lambda column: column.astype(str).str.strip())
+            if stats["phone_column"] in chunk.columns:
+                merged, report = self._custom_phone_duplicates(chunk, stats["phone_column"], seen)
+                stats["duplicates_merged"] += merged
+                stats["duplicates"] += report[:max(0, 100 - len(stats["duplicates"]))]
+            yield from chunk.to_dict('records')
+
+    def _parse_custom_sheet(self, file_path):
+        """
+        Read a custom sheet chunk by chunk. Small sheets keep every row in memory; large ones
+        keep only a preview and are streamed from the file again when sent or paged.
+        """
+        started = time.perf_counter()
+        streamed = os.path.getsize(file_path) >= self.STREAM_THRESHOLD_BYTES
+        stats, data = {}, []
+        for row in self._iter_custom_sheet(file_path, stats):
+            if not streamed or len(data) < self.STREAM_PREVIEW_ROWS:
+                data.append(row)
+        columns = stats["columns"] or []
+        # Trailing columns without a header and without any values are spreadsheet noise
+        blank = [column for column in columns if column.startswith('Unnamed:') and column not in stats["filled"]]
+        if blank:
+            columns = [column for column in columns if column not in blank]
+            for row in data:
+                for column in blank:
+                    row.pop(column, None)
+        return {"status": "success", "data": data, "columns": columns, "total": stats["rows"], "streamed": streamed,
+                "phone_column": stats["phone_column"], "duplicates_merged": stats["duplicates_merged"],
+                "duplicates": stats["duplicates"],
+                **self._ingest_stats("Custom sheet" + (" (streamed)" if streamed else ""), stats["rows"], started)}
+
+    def _add_custom_dataset(self, result, file_path, handle=None):
+        return self.datasets.add("custom", result["data"], columns=result["columns"], file_path=file_path,
+                                 handle=handle, total=result["total"], streamed=result["streamed"])
+
     def analyze_custom_excel(self):
         """Analyze a custom Excel file and return column information."""
         try:
@@ -1728,34 +4736,24 @@ class Api:
             
             file_path = result[0]
             
-            # Read the Excel file
-            if file_path.endswith('.csv'):
-                df = pd.read_csv(file_path)
-            else:
-                df = pd.read_excel(file_path)
-            
-            # Clean column names
-            df.columns = df.columns.str.strip()
-            
-            # Convert DataFrame to list of dictionaries
-            data = []
-            for index, row in df.iterrows():
-                row_dict = {}
-                for col in df.columns:
-                    row_dict[col] = str(row[col]).strip() if pd.notna(row[col]) else ''
-                data.append(row_dict)
-            
-            # Get sample data (first row) for preview
-            sample_data = {}
-            if len(data) > 0:
-                sample_data = data[0]
+            result = self._parse_custom_sheet(file_path)
+            dataset = self._add_custom_dataset(result, file_path)
+            # The same number with the same rendered message is sent only once
+            duplicate_text = (f"; {result['duplicates_merged']} repeated numbers in '{result['phone_column']}' "
+                              f"will only get each distinct message once") if result["duplicates_merged"] else ""
             
             return {
                 "status": "success",
-                "data": data,
-                "columns": list(df.columns),
-                "sample_data": sample_data,
-                "message": f"Successfully analyzed {len(data)} rows with {len(df.columns)} columns"
+                "dataset": DatasetRegistry.describe(dataset),
+                "columns": result["columns"],
+                "sample_data": result["data"][0] if result["data"] else {},
+                "preview": DatasetRegistry.page_rows(dataset["rows"], 0, 20),
+                "message": f"Successfully analyzed {result['total']} rows with {len(result['columns'])} columns{duplicate_text}",
+                "phone_column": result["phone_column"],
+                "duplicates_merged": result["duplicates_merged"],
+                "duplicates": result["duplicates"],
+                "parse_time": result["parse_time"],
+                "rows_per_sec": result["rows_per_sec"]
             }
         
         except Exception as e:
@@ -1765,13 +4763,11 @@ class Api:
         """Navigate to WhatsApp chat with retry logic."""
         for attempt in range(max_retries):
             try:
-                url = f"https://web.whatsapp.com/send?phone={mobile}"
-                print(f"Navigation attempt {attempt + 1}: {url}")
+                print(f"Navigation attempt {attempt + 1}: {mobile}")
 
-                driver.get(url)
-
-                # --- OPTIMIZATION: Reduced navigation wait time ---
-                time.sleep(3)
+                chat_state = self._open_chat(driver, self.navigator, mobile)
+                if chat_state == 'cached-invalid':
+                    return "invalid"
                 
                 # Check if page loaded correctly
                 current_url = driver.current_url
@@ -1786,23 +4782,9 @@ class Api:
                     else:
                         return False
 
-                # Check for invalid number immediately
-                try:
-                    invalid_selectors = [
-                        "//div[contains(text(), 'Phone number shared via url is invalid')]",
-                        "//div[contains(text(), 'Telefonnummer')]", 
-                        "//div[contains(text(), 'not exist')]",
-                        "//div[contains(text(), \"doesn't have WhatsApp\")]"
-                    ]
-
-                    for selector in invalid_selectors:
-                        elements = driver.find_elements(By.XPATH, selector)
-                        if elements:
-                            print(f"Invalid number detected: {mobile}")
-                            return "invalid"
-                
-                except Exception as e:
-                    print(f"Error checking for invalid number: {e}")
+                if chat_state == 'invalid':
+                    print(f"Invalid number detected: {mobile}")
+                    return "invalid"
                 
                 return True
             
@@ -1817,159 +4799,137 @@ class Api:
 
     # --- MODIFIED FUNCTION WITH ALL CHANGES ---
     # CHANGE 5: Increase Batch Size
-    def send_custom_field_messages(self, excel_data, phone_field, name_field, message_template, batch_size=20):
+    def send_custom_field_messages(self, excel_data, phone_field, name_field, message_template, batch_size=20,
+                                   dataset=None, job=None):
         """Send WhatsApp messages using custom field mapping, with batching and multi-number support."""
         driver = None
         try:
-            # CHANGE 7: Pre-compile Regex
-            import re
-            phone_pattern = re.compile(r'[^\d]')  # Pre-compile for better performance
+            if dataset:
+                dataset = self._resolve_dataset(dataset)
+                # A large sheet is read from its file again as the loop advances
+                excel_data, total_processed = self._dataset_rows(dataset), dataset["total"]
+            else:
+                total_processed = len(excel_data)
+            template = MessageTemplate.compile(message_template)
+            # (number, message) pairs already handled in this run; repeats are not re-sent
+            handled = set()
+            duplicate_count = 0
 
-            driver = self._get_driver()
-            wait = WebDriverWait(driver, 45)
-            driver.get("https://web.whatsapp.com")
-            
-            print("Waiting for WhatsApp Web to load...")
-            
-            # Wait for login
-            login_successful = False
-            max_wait_time = 120
-            check_interval = 5
-            
-            for i in range(max_wait_time // check_interval):
-                try:
-                    search_elements = driver.find_elements(By.XPATH, '//div[@contenteditable="true"][@data-tab="3"]')
-                    if search_elements:
-                        login_successful = True
-                        break
-                    time.sleep(check_interval)
-                except Exception as e:
-                    time.sleep(check_interval)
-            
-            if not login_successful:
+            driver = self.driver_manager.acquire()
+            if not driver:
                 return {"status": "error", "message": "Login timeout - please make sure you're logged into WhatsApp Web"}
-            
-            # CHANGE 1: Reduce Wait Times
-            time.sleep(2)
-            
+            wait = WebDriverWait(driver, 45)
+            self.navigator.reset_stats()
+
             success_count = 0
             error_count = 0
+            skipped_count = 0
+            pacer = self._pacer()
+            ledger = FailureLedger(self.db, job)
+            watchdog = SessionWatchdog(self.driver_manager, self.deliveries)
+            if job:
+                job.set_total(total_processed)
             
             # --- OPTIMIZATION: Process in batches ---
-            for batch_start in range(0, len(excel_data), batch_size):
-                batch_end = min(batch_start + batch_size, len(excel_data))
-                batch_data = excel_data[batch_start:batch_end]
+            for batch_start, batch_data in self._batches(excel_data, batch_size):
 
                 for i, row_data in enumerate(batch_data):
                     row_index = batch_start + i + 1
+                    if job:
+                        job.progress(row_index - 1, success_count, error_count, str(row_data.get(name_field, f'Row {row_index}')))
+                        if not job.checkpoint():
+                            break
                     try:
                         phone_number_raw = str(row_data.get(phone_field, '')).strip()
                         if not phone_number_raw or phone_number_raw == 'nan':
                             print(f"Row {row_index}: No phone number found")
+                            ledger.fail(str(row_index - 1), "", "no phone number")
                             error_count += 1
                             continue
 
-                        # CHANGE 8: Reduce Multiple Number Processing Overhead
-                        phone_numbers_to_process = []
-                        if ',' in phone_number_raw:
-                            phone_numbers_to_process = [phone_pattern.sub('', n.strip()) for n in phone_number_raw.split(',') if n.strip() and len(phone_pattern.sub('', n.strip())) >= 10]
-                        else:
-                            # CHANGE 7: Use pre-compiled regex
-                            clean_num = phone_pattern.sub('', phone_number_raw)
-                            if len(clean_num) >= 10:
-                                phone_numbers_to_process = [clean_num]
+                        # A cell may hold several comma separated numbers
+                        phone_numbers_to_process = list(dict.fromkeys(
+                            mobile for mobile in (self.phones.normalize(n) for n in phone_number_raw.split(',')) if mobile))
 
                         if not phone_numbers_to_process:
                             print(f"Row {row_index}: No valid phone numbers found in '{phone_number_raw}'")
+                            ledger.fail(str(row_index - 1), phone_number_raw, "no valid phone number")
                             error_count += 1
                             continue
 
+                        # Rendered once per row and shared by every number in the cell
+                        processed_message = template.render(row_data)
+
                         # Process each phone number found in the cell
                         for mobile in phone_numbers_to_process:
-                            # Add country code if needed
-                            if len(mobile) == 10:
-                                mobile = '91' + mobile
-                            elif len(mobile) == 12 and mobile.startswith('91'):
-                                pass # Already correct
-                            elif len(mobile) == 13 and mobile.startswith('091'):
-                                mobile = mobile[1:]
-                            
-                            if not (len(mobile) == 12 and mobile.startswith('91')):
-                                print(f"Row {row_index}: Invalid phone number format: {mobile}")
-                                error_count += 1
+                            if (mobile, processed_message) in handled:
+                                print(f"Row {row_index}: {mobile} already received this message, skipping")
+                                duplicate_count += 1
                                 continue
-                            
-                            # Process message template for each number
-                            processed_message = message_template
-                            for field_name, field_value in row_data.items():
-                                placeholder = "{" + field_name + "}"
-                                processed_message = processed_message.replace(placeholder, str(field_value))
+                            handled.add((mobile, processed_message))
                             
                             contact_name = str(row_data.get(name_field, f'Contact {row_index}')).strip()
+                            item_key = f"{row_index - 1}:{mobile}"
+                            if job and job.is_done(item_key):
+                                skipped_count += 1
+                                continue
                             print(f"Processing {contact_name}: {mobile}")
                             
-                            # CHANGE 2: Optimize Navigation with Better Error Handling
                             try:
-                                url = f"https://web.whatsapp.com/send?phone={mobile}"
-                                driver.get(url)
-                                time.sleep(2)  # Reduced from 3
-                                # Quick invalid number check
-                                if driver.find_elements(By.XPATH, "//div[contains(text(), 'Phone number shared via url is invalid') or contains(text(), 'not exist')]"):
-                                    print(f"Invalid number: {mobile}")
-                                    error_count += 1
-                                    continue
-                            except Exception as nav_error:
-                                print(f"Navigation failed for {mobile}: {nav_error}")
-                                error_count += 1
-                                continue
+                                chat_name = contact_name if name_field else None
+                                sent, reason = watchdog.send(self._text_attempt(pacer, job, self.navigator, mobile, processed_message,
+                                                                                chat_name, item_key), job)
+                                driver = watchdog.driver
+                            except Exception as send_error:
+                                print(f"Sending failed for {mobile}: {send_error}")
+                                sent, reason = False, f"{type(send_error).__name__}: {send_error}"
                             
-                            # CHANGE 3: Faster Message Box Detection
-                            try:
-                                message_box = driver.find_element(By.XPATH, '//footer//div[@contenteditable="true"]')
-                                if not message_box.is_displayed():
-                                    message_box = driver.find_element(By.XPATH, '//div[@contenteditable="true"][@data-tab="10"]')
-                            except:
-                                print(f"Could not find message input box for {mobile}")
+                            if job:
+                                job.record_item(item_key, mobile, sent, None if sent else reason)
+                            if not sent:
+                                ledger.fail(item_key, mobile, reason, (mobile, processed_message, chat_name), processed_message)
                                 error_count += 1
+                                if watchdog.lost:
+                                    break
                                 continue
-                            
-                            # ISSUE 1 FIX: Send message as single block
-                            message_box.click()
-                            time.sleep(0.3)
-                            message_box.send_keys(Keys.CONTROL + "a", Keys.DELETE)  # Clear existing content
-                            time.sleep(0.2)
-                            # Type message line by line to preserve formatting
-                            message_lines = processed_message.split('\n')
-                            for j, line in enumerate(message_lines):
-                                if line.strip():
-                                    message_box.send_keys(line)
-                                if j < len(message_lines) - 1:
-                                    message_box.send_keys(Keys.SHIFT + Keys.ENTER)
-                            time.sleep(1)
-                            message_box.send_keys(Keys.ENTER)  # Send as one message
 
                             print(f"Message sent successfully to {contact_name} ({mobile})")
                             success_count += 1
-                            # CHANGE 1: Reduced wait after sending message
-                            time.sleep(0.5)
                     
                     except Exception as e:
                         print(f"Error processing row {row_index}: {str(e)}")
+                        ledger.fail(str(row_index - 1), str(row_data.get(phone_field, '')), f"{type(e).__name__}: {e}")
                         error_count += 1
                         continue
-                    
-                    # CHANGE 1: Reduced wait between processing different contacts/rows
-                    time.sleep(0.8)
+                    if watchdog.lost:
+                        break
                 
-                # CHANGE 5: Reduce Batch Breaks
-                if batch_end < len(excel_data):
-                    print(f"--- Finished batch, taking a short break ---")
-                    time.sleep(0.3)
-            
-            total_processed = len(excel_data)
+                if job and job.cancelled:
+                    print("Custom field send cancelled")
+                    break
+                if watchdog.lost:
+                    break
+
+            gained = self._finish_run(watchdog, self.navigator, job, ledger, self._text_resender(pacer, job, watchdog, self.navigator))
+            success_count += gained
+            error_count -= gained
+            driver = watchdog.driver
+            if watchdog.lost:
+                return self._lost_result(job, success_count, error_count, ledger)
+            
+            if job:
+                job.progress(total_processed if not job.cancelled else job.processed, success_count, error_count)
+            skipped_text = f", Skipped (already sent): {skipped_count}" if skipped_count else ""
+            if duplicate_count:
+                skipped_text += f", Duplicates skipped: {duplicate_count}"
+            failure_text = f" Failures - {ledger.summary_text()}." if ledger.summary_text() else ""
+            recovery_text = f", {watchdog.summary()}" if watchdog.summary() else ""
             return {
                 "status": "success",
-                "message": f"Custom field messages sent! Success: {success_count}, Errors: {error_count} out of {total_processed} contacts."
+                "message": f"Custom field messages sent! Success: {success_count}, Errors: {error_count}{skipped_text} out of {total_processed} contacts ({self.navigator.summary()}{recovery_text}).{failure_text}",
+                "navigation": dict(self.navigator.stats),
+                "failures": ledger.breakdown(),
+                "session_recoveries": watchdog.recoveries
             }
             
         except Exception as e:
@@ -1977,12 +4937,282 @@ class Api:
             return {"status": "error", "message": f"An error occurred: {str(e)}"}
         finally:
             if driver:
-                try:
-                    time.sleep(3)
-                    driver.quit()
-                except:
-                    pass
-    
+                self.driver_manager.release()
+
+    # --- Parsed datasets: rows stay in Python, the page works with handles and pages ---
+    def _resolve_dataset(self, ref):
+        """Look a dataset reference up, re-parsing its file if the handle is gone (e.g. after a restart)."""
+        dataset = self.datasets.get(ref.get("handle"))
+        if dataset:
+            return dataset
+        file_path = ref.get("file_path")
+        if not file_path or not os.path.exists(file_path):
+            raise ValueError("The uploaded sheet is no longer available - please upload it again")
+        print(f"--- Reloading dataset {ref.get('handle')} from {file_path} ---")
+        if ref.get("kind") == "courier":
+            result = self._parse_courier_sheet(file_path)
+            if result["status"] != "success":
+                raise ValueError(result["message"])
+            return self._add_courier_dataset(result, file_path, ref.get("handle"))
+        return self._add_custom_dataset(self._parse_custom_sheet(file_path), file_path, ref.get("handle"))
+
+    @staticmethod
+    def _batches(rows, size):
+        """(start index, list) pairs of at most `size` rows from a list or a generator."""
+        rows = iter(rows)
+        start = 0
+        while True:
+            batch = list(itertools.islice(rows, size))
+            if not batch:
+                return
+            yield start, batch
+            start += len(batch)
+
+    def _dataset_rows(self, dataset):
+        """A dataset's rows: the kept list, or for a streamed dataset a fresh pass over its file."""
+        if not dataset.get("streamed"):
+            return dataset["rows"]
+        if dataset["kind"] == "courier":
+            return self._iter_courier_sheet(dataset["file_path"])
+        return self._iter_custom_sheet(dataset["file_path"], columns=dataset["columns"])
+
+    def get_dataset_page(self, handle, offset=0, limit=50):
+        """Return one page of a parsed sheet's rows for display."""
+        dataset = self.datasets.get(handle)
+        if not dataset:
+            return {"status": "error", "message": "Dataset not found - please upload the file again"}
+        offset = max(int(offset or 0), 0)
+        limit = min(max(int(limit or 50), 1), 500)
+        return {
+            "status": "success",
+            "columns": dataset["columns"],
+            "total": dataset["total"],
+            "offset": offset,
+            "rows": DatasetRegistry.page_rows(self._dataset_rows(dataset), offset, limit)
+        }
+
+    def validate_message_template(self, message_template, dataset=None):
+        """Check a template's filters and, given a dataset, that every field it uses is a column."""
+        try:
+            template = MessageTemplate.compile(message_template)
+            problems = list(template.errors)
+            if dataset:
+                columns = self._resolve_dataset(dataset)["columns"]
+                missing = template.missing(columns)
+                if missing:
+                    problems.append("Unknown fields: " + ", ".join("{" + field + "}" for field in missing))
+            if problems:
+                return {"status": "error", "message": "; ".join(problems), "fields": template.fields}
+            return {"status": "success", "fields": template.fields}
+        except Exception as e:
+            return {"status": "error", "message": f"Error validating template: {str(e)}"}
+
+    def preview_custom_messages(self, dataset, phone_field, name_field, message_template, offset=0, limit=20):
+        """Render the template for a page of dataset rows, exactly as the send job will."""
+        try:
+            check = self.validate_message_template(message_template, dataset)
+            rows = list(itertools.islice(self._dataset_rows(self._resolve_dataset(dataset)), int(offset), int(offset) + int(limit)))
+            template = MessageTemplate.compile(message_template)
+            previews = [
+                {
+                    "name": row.get(name_field, '') if name_field else f"Contact {int(offset) + i + 1}",
+                    "phone": row.get(phone_field, ''),
+                    "message": message
+                }
+                for i, (row, message) in enumerate(zip(rows, template.render_all(rows)))
+            ]
+            return {"status": "success", "previews": previews,
+                    "warning": check["message"] if check["status"] != "success" else None}
+        except Exception as e:
+            return {"status": "error", "message": f"Error rendering preview: {str(e)}"}
+
+    def discard_dataset(self, handle):
+        self.datasets.discard(handle)
+        return {"status": "success"}
+
+    # --- Number status cache ---
+    def validate_numbers(self, numbers=None, source=None, job=None):
+        """
+        Check which numbers are on WhatsApp without sending anything, filling the number
+        status cache so later campaigns skip the invalid ones.
+        """
+        driver = None
+        try:
+            if source:
+                numbers = (contact["phone"] for contact in self._iter_bulk_contacts(source["file_path"]))
+                total = source.get("total", 0)
+            else:
+                numbers = list(dict.fromkeys(n for n in (self.phones.normalize(n) for n in numbers or []) if n))
+                total = len(numbers)
+            if job:
+                job.set_total(total)
+
+            driver = self.driver_manager.acquire()
+            if not driver:
+                return {"status": "error", "message": "Login timeout - please make sure you're logged into WhatsApp Web"}
+            self.navigator.reset_stats()
+
+            counts = {"valid": 0, "invalid": 0, "unknown": 0, "cached": 0}
+            for index, mobile in enumerate(numbers):
+                if job:
+                    job.progress(index, counts["valid"], counts["invalid"], mobile)
+                    if not job.checkpoint():
+                        break
+                if self.number_status.lookup(mobile):
+                    counts["cached"] += 1
+                    continue
+                state = self._open_chat(driver, self.navigator, mobile, source='validate')
+                counts[{'ready': 'valid', 'invalid': 'invalid'}.get(state, 'unknown')] += 1
+
+            if job:
+                job.progress(sum(counts.values()), counts["valid"], counts["invalid"])
+            return {
+                "status": "success",
+                "message": f"Validation finished! Valid: {counts['valid']}, Invalid: {counts['invalid']}, "
+                           f"Unknown: {counts['unknown']}, Already known: {counts['cached']}",
+                "counts": counts
+            }
+        except Exception as e:
+            print(f"Critical error in validate_numbers: {str(e)}")
+            return {"status": "error", "message": f"An error occurred: {str(e)}"}
+        finally:
+            if driver:
+                self.driver_manager.release()
+
+    def start_number_validation(self, numbers=None, source=None):
+        return self._start_job("validate", self.validate_numbers, numbers, source=source)
+
+    def get_selector_stats(self):
+        """Hit/miss counts per WhatsApp Web selector, for diagnosing UI changes."""
+        return {"status": "success", "groups": self.selectors.report()}
+
+    def get_number_status_summary(self):
+        """Cached valid/invalid counts and how many chat loads the cache has saved."""
+        try:
+            return {"status": "success", **self.number_status.summary()}
+        except Exception as e:
+            return {"status": "error", "message": f"Error getting number status: {str(e)}"}
+
+    def clear_number_status(self):
+        try:
+            self.db.execute('DELETE FROM number_status')
+            return {"status": "success", "message": "Number status cache cleared"}
+        except Exception as e:
+            return {"status": "error", "message": f"Error clearing number status: {str(e)}"}
+
+    # --- Background jobs: start_* return a job id, progress is pushed to the page ---
+    def _push_job_update(self, job):
+        """Push job progress to the page; the UI registers window.onJobUpdate to receive it."""
+        if not self.window:
+            return
+        try:
+            self.window.evaluate_js(f"window.onJobUpdate && window.onJobUpdate({json.dumps(job.to_dict())})")
+        except Exception as e:
+            print(f"Could not push job update: {e}")
+
+    def _start_job(self, kind, target, *args, **kwargs):
+        try:
+            job = self.job_manager.start(kind, target, args, kwargs)
+            return {"status": "success", "job_id": job.id, "message": f"Job {job.id} started"}
+        except Exception as e:
+            return {"status": "error", "message": f"Error starting job: {str(e)}"}
+
+    def start_bulk_send(self, numbers, message, image_path, use_template=False, template_content="", contacts=None,
+                        session_names=None, source=None, broadcast=False):
+        """
+        Start the Bulk Sender in the background. Any session other than the default one (even a
+        single one) goes through the sessions path, in parallel when there are several. Broadcast
+        (forwarding) runs in the default session, since the forwarded message lives in one chat.
+        """
+        session_names, error = self._check_session_names(session_names)
+        if error:
+            return {"status": "error", "message": error}
+        named = session_names and session_names != ["default"]
+        if broadcast:
+            if named:
+                return {"status": "error", "message": "Broadcast mode runs in the default session only - clear the session list or turn off broadcast"}
+            return self._start_job("bulk", self.send_whatsapp_messages, numbers, message, image_path,
+                                   use_template, template_content, contacts, source=source, broadcast=True)
+        if named:
+            return self._start_job("bulk", self.send_whatsapp_messages_parallel, numbers, message, image_path,
+                                   session_names, use_template, template_content, contacts, source=source)
+        return self._start_job("bulk", self.send_whatsapp_messages, numbers, message, image_path,
+                               use_template, template_content, contacts, source=source)
+
+    def start_courier_send(self, dataset):
+        """Start courier notifications for a sheet parsed by handle_file_upload."""
+        return self._start_job("courier", self.send_courier_notifications, dataset=dataset)
+
+    def start_custom_field_send(self, dataset, phone_field, name_field, message_template):
+        """Start a custom-field send for a sheet parsed by analyze_custom_excel."""
+        check = self.validate_message_template(message_template, dataset)
+        if check["status"] != "success":
+            return check
+        return self._start_job("custom", self.send_custom_field_messages, None, phone_field, name_field,
+                               message_template, dataset=dataset)
+
+    def get_job_status(self, job_id):
+        job = self.job_manager.get(job_id)
+        if not job:
+            return {"status": "error", "message": "Job not found"}
+        return {"status": "success", "job": job.to_dict()}
+
+    def list_jobs(self):
+        return {"status": "success", "jobs": [job.to_dict() for job in self.job_manager.jobs.values()]}
+
+    def pause_job(self, job_id):
+        job = self.job_manager.get(job_id)
+        if not job:
+            return {"status": "error", "message": "Job not found"}
+        job.pause()
+        return {"status": "success", "message": "Job paused after the current contact"}
+
+    def resume_job(self, job_id):
+        job = self.job_manager.get(job_id)
+        if not job:
+            return {"status": "error", "message": "Job not found"}
+        job.resume()
+        return {"status": "success", "message": "Job resumed"}
+
+    def cancel_job(self, job_id):
+        job = self.job_manager.get(job_id)
+        if not job:
+            return {"status": "error", "message": "Job not found"}
+        job.cancel()
+        return {"status": "success", "message": "Job will stop after the current contact"}
+
+    def get_saved_jobs(self):
+        """List stored campaigns, including interrupted ones that can be resumed."""
+        try:
+            return {"status": "success", "jobs": self.job_store.list_jobs()}
+        except Exception as e:
+            return {"status": "error", "message": f"Error getting saved jobs: {str(e)}"}
+
+    def resume_campaign(self, job_id):
+        """Re-run a stored campaign, skipping every recipient already marked as sent."""
+        resumable = {
+            "send_whatsapp_messages": self.send_whatsapp_messages,
+            "send_whatsapp_messages_parallel": self.send_whatsapp_messages_parallel,
+            "send_courier_notifications": self.send_courier_notifications,
+            "send_custom_field_messages": self.send_custom_field_messages,
+            "validate_numbers": self.validate_numbers,
+        }
+        try:
+            saved = self.job_store.load_job(job_id)
+            if not saved:
+                return {"status": "error", "message": "Job not found"}
+            target = resumable.get(saved["method"])
+            if not target:
+                return {"status": "error", "message": f"Jobs of type '{saved['method']}' cannot be resumed"}
+
+            delivered = self.job_store.delivered_keys(job_id)
+            job = self.job_manager.start(saved["kind"], target, saved["args"], saved["kwargs"],
+                                         job_id=job_id, done_keys=delivered)
+            return {"status": "success", "job_id": job.id,
+                    "message": f"Resuming job {job.id}, skipping {len(delivered)} recipients already sent or awaiting review"}
+        except Exception as e:
+            return {"status": "error", "message": f"Error resuming job: {str(e)}"}
+
     # ISSUE 2: Add Clear Button Functionality
     def clear_courier_data(self):
         """Clear all courier notification data."""
@@ -2029,6 +5259,7 @@ if __name__ == '__main__':
             min_size=(1200, 700)
         )
         api.window = window
+        window.events.closed += api._shutdown_sessions
         webview.start(debug=False)
     
     start_app()